@@ -1,14 +1,16 @@
 """The acoustics module provides the means to handle the acoustic wave involved
 in the acousto-optic interaction. An AOL associates an AcousticDrive object with
-each AOD object. When an optic ray (Ray object) is incident on the AOD, the
-AcousticDrive is called to generate the local acoustics, an Acoustics object.
-The Acoustics object is used in the xu_stroud_model module to handle the
-acousto-optic interaction."""
+each AOD object. When optic rays are incident on the AOD, the AcousticDrive is
+called to generate the local acoustics at each ray, an AcousticField object
+holding arrays. The AcousticField is used in the xu_stroud_model module to
+handle the acousto-optic interaction. An Acoustics object describes the
+acoustics at a single ray, and lists of them are converted with as_acoustic_field."""
 
-from numpy import pi, dot, dtype, array, sqrt
+from numpy import pi, dot, dtype, array, sqrt, atleast_1d, broadcast_arrays
 import numpy as np
 
 teo2_ac_vel = 612.8834
+teo2_density = 5990
 pointing_ramp_time = 30e6
 default_power = 1
 
@@ -31,10 +33,60 @@ class Acoustics(object):
         return self.wavevector_mag * aod.acoustic_direction
 
     def amplitude(self, aod):
-        teo2_density = 5990;
-        numerator = 2 * self.power
-        denominator = teo2_density * self.velocity**3 * aod.transducer_width * aod.transducer_height # use of aperture width assumes square aperture
-        return sqrt(numerator / denominator) # Xu & Stroud (2.143)
+        return calc_amplitudes(aod, self.power, self.velocity)
+
+class AcousticField(object):
+    """The local acoustics at each of a bundle of rays, held as arrays of
+    frequencies, powers and velocities. It is the array counterpart of a list
+    of Acoustics objects: indexing with an integer gives an Acoustics object,
+    with a slice or index array gives a smaller AcousticField. The properties
+    used by the diffraction, including the amplitudes, are computed once per
+    AOD, see get_properties."""
+
+    def __init__(self, frequencies, powers=default_power, velocities=teo2_ac_vel):
+        (frequencies, powers, velocities) = broadcast_arrays(*[atleast_1d(array(a, dtype=dtype(float))) for a in (frequencies, powers, velocities)])
+        self.frequencies = frequencies
+        self.powers = powers
+        self.velocities = velocities
+        self.wavevector_mags = 2 * pi * frequencies / velocities
+        self.properties = {} # keyed on id of the AOD
+
+    @staticmethod
+    def from_acoustics(acoustics):
+        """Gather a list of Acoustics objects into an AcousticField."""
+        values = array([(a.frequency, a.power, a.velocity) for a in acoustics], dtype=dtype(float)).reshape(-1, 3)
+        return AcousticField(values[:,0], values[:,1], values[:,2])
+
+    def __len__(self):
+        return self.frequencies.size
+
+    def __getitem__(self, key):
+        if isinstance(key, (int, np.integer)):
+            return Acoustics(self.frequencies[key], self.powers[key], self.velocities[key])
+        return AcousticField(self.frequencies[key], self.powers[key], self.velocities[key])
+
+    def __iter__(self):
+        return (self[k] for k in range(len(self)))
+
+    def get_properties(self, aod):
+        """The (frequencies, wavevector magnitudes, amplitudes) at the AOD. The
+        amplitudes include the transducer efficiency of the AOD."""
+        key = id(aod)
+        if key not in self.properties or self.properties[key][0] is not aod:
+            amplitudes = calc_amplitudes(aod, self.powers, self.velocities) * sqrt(aod.transducer_efficiency_func(self.frequencies)) # square root because transducer eff is in terms of power
+            self.properties[key] = (aod, (self.frequencies, self.wavevector_mags, amplitudes))
+        return self.properties[key][1]
+
+def as_acoustic_field(acoustics):
+    """Return acoustics unchanged if already an AcousticField, else gather the list of Acoustics objects into one."""
+    if hasattr(acoustics, 'wavevector_mags'): # duck type rather than isinstance, module may be imported under two names
+        return acoustics
+    return AcousticField.from_acoustics(acoustics)
+
+def calc_amplitudes(aod, powers, velocities):
+    numerator = 2 * powers
+    denominator = teo2_density * velocities**3 * aod.transducer_width * aod.transducer_height # use of aperture width assumes square aperture
+    return sqrt(numerator / denominator) # Xu & Stroud (2.143)
 
 class AcousticDrive(object):
     """A class to hold the drive parameters for an AOD. An AOL associates an
@@ -58,8 +110,9 @@ class AcousticDrive(object):
         self.ramp_time = ramp_time
 
     def get_local_acoustics(self, time, ray_positions, base_ray_position, aod_direction):
-        """Returns an Acoustics object to represent the local acoustic field at the
-        point an optic ray is incident on an AOD."""
+        """Returns an AcousticField to represent the local acoustic field at the
+        points the optic rays are incident on an AOD. The time may be a scalar
+        or an array with a time for each ray."""
         distances = dot(array(ray_positions)[:,0:2] - base_ray_position, aod_direction[0:2])
         effective_time = time - distances/self.velocity
 
@@ -69,4 +122,4 @@ class AcousticDrive(object):
             t = effective_time
 
         frequencies = self.const + self.linear * t + self.quad * np.power(t, 2.)
-        return [Acoustics(f, self.power, self.velocity) for f in frequencies]
\ No newline at end of file
+        return AcousticField(frequencies, self.power, self.velocity)
\ No newline at end of file
@@ -1,14 +1,19 @@
 """The aod module contains the Aod class, representing an AOD."""
 
-from teo2 import calc_refractive_indices, ord_ref_ind_gradient
-from xu_stroud_model import diffract_acousto_optically
-from vector_utils import perpendicular_component_list, normalise_list, normalise, \
-    angle_between_unit_vectors
-from error_utils import check_is_unit_vector
-from numpy import array, sqrt, arcsin, sin, cos, cross, dot, dtype, outer, power, allclose, arctan2
+from teo2 import calc_refractive_indices_cos, calc_refractive_indices_and_gradients_cos, group_by_table
+from xu_stroud_model import diffract_acousto_optically, diffract_both_passes, rescattering_fraction
+from vector_utils import perpendicular_component_list, normalise_list, normalise
+from error_utils import check_is_unit_vector, check_are_unit_vectors, checks_enabled, RayValidationError
+from ray_bundle import as_ray_bundle, update_rays
+from numpy import array, sqrt, arcsin, sin, cos, cross, dot, dtype, outer, power, arctan2, \
+    zeros, ones, arange, maximum, where, nonzero, all, array_equal, clip
 from numpy.linalg import norm
-from scipy.optimize import fsolve
-import teo2
+import itertools
+
+refraction_tolerance = 1e-13 # on the Newton step in angle, radians
+refraction_max_iterations = 20
+use_refraction_maps = True # look up refraction of rays at table wavelengths, see Aod.get_refraction_map_groups
+geometry_stamps = itertools.count() # unique across all Aods, see Aod.update_geometry
 
 class Aod(object):
     """The Aod class represents an AOD. An Aod object can be used alone to
@@ -21,8 +26,9 @@ class Aod(object):
         self.transducer_width = transducer_width
         self.transducer_efficiency_func = transducer_efficiency_func
 
-        check_is_unit_vector(normal)
-        check_is_unit_vector(relative_ac_dir)
+        if checks_enabled():
+            check_is_unit_vector(normal)
+            check_is_unit_vector(relative_ac_dir)
 
     @property
     def optic_axis(self):
@@ -30,11 +36,40 @@ class Aod(object):
         designs. For now, the optic axis is taken to be aligned with the normal."""
         return self.normal
     @property
+    def normal(self):
+        return self._normal
+    @normal.setter
+    def normal(self, v):
+        self._normal = read_only_array(v)
+        self.update_geometry()
+
+    @property
+    def relative_acoustic_direction(self):
+        return self._relative_acoustic_direction
+    @relative_acoustic_direction.setter
+    def relative_acoustic_direction(self, v):
+        self._relative_acoustic_direction = read_only_array(v)
+        self.update_geometry()
+
+    @property
     def acoustic_direction(self):
         """The AOD aperture is, as a first approximation, normal to [0,0,1] (the z-axis)
         and the relative_acoustic_direction is defined based on this. The actual
-        acoustic_direction needs to be rotated according for the exact normal."""
+        acoustic_direction needs to be rotated according for the exact normal.
+        Cached, see update_geometry."""
+        return self._acoustic_direction
 
+    def update_geometry(self):
+        """Recalculate the cached geometry. Called whenever the normal or relative
+        acoustic direction is set; both are read-only arrays so they cannot be
+        changed in place behind the cache. The new geometry_stamp lets an AolFull
+        tell that its own cached geometry is out of date."""
+        if not hasattr(self, '_normal') or not hasattr(self, '_relative_acoustic_direction'):
+            return # still in __init__
+        self._acoustic_direction = read_only_array(self.calc_acoustic_direction())
+        self.geometry_stamp = next(geometry_stamps)
+
+    def calc_acoustic_direction(self):
         # three basis vectors
         z = array([0.,0.,1.])
         invariant = normalise( cross(self.relative_acoustic_direction, z) )
@@ -53,73 +88,190 @@ class Aod(object):
 
         return sound_vector
 
-    def propagate_ray(self, rays, local_acoustics, order):
+    def propagate_ray(self, rays, local_acoustics, order, rescattering='full', rescattering_correction=1.):
         """Take a bunch of optic rays through the AOD by first refracting into
         the AOD, then diffracting acousto-optically, propagating through the
-        AOD and finally refracting out. """
+        AOD and finally refracting out. Takes a list of Ray objects or a RayBundle.
+        See xu_stroud_model.diffract_acousto_optically for the rescattering modes.
+        With rescattering 'off' the efficiencies are scaled by rescattering_correction,
+        a factor or one per ray. Returns the per-ray correction factors, or None when
+        rescattering is off."""
         # can only take local_acoustics because there is no centre or location on the AOD object
-        tol = 0.5 * (10**-teo2.accuracy)
-        assert allclose([r.wavelength_vac for r in rays], rays[0].wavelength_vac, rtol=0, atol=tol) # can only handle small range of wavelengths at a time
-        self.refract_in(rays)
-        diffract_acousto_optically(self, rays, local_acoustics, order)
-        self.move_ray_through_aod(rays)
-        self.refract_out(rays)
-
-    def move_ray_through_aod(self, rays):
-        directions = self.get_ray_direction_ord(rays)
+        bundle = as_ray_bundle(rays) # rays may have different wavelengths, see teo2.calc_refractive_indices
+        check_are_unit_vectors(bundle.wavevectors_unit) # bulk checks at stage boundaries, see error_utils.policy
+        self.refract_in(bundle)
+        check_are_unit_vectors(bundle.wavevectors_unit)
+        corrections = diffract_acousto_optically(self, bundle, local_acoustics, order, \
+                        rescattering=rescattering, rescattering_correction=rescattering_correction)
+        check_are_unit_vectors(bundle.wavevectors_unit)
+        self.move_ray_through_aod(bundle)
+        self.refract_out(bundle)
+        check_are_unit_vectors(bundle.wavevectors_unit)
+        update_rays(rays, bundle)
+        return corrections
+
+    def split_ray(self, rays, local_acoustics, orders=(0, 1, -1), second_order=False):
+        """Take a bundle of optic rays through the AOD into several diffraction
+        orders. The undiffracted order 0 keeps the energy not diffracted into
+        either first order and stays extraordinary. With second_order, the light
+        the model rescatters from order +-1 is followed into order +-2, again
+        extraordinary. Returns a list of (order, RayBundle) at the AOD exit.
+        The input bundle is left refracted into the AOD."""
+        bundle = as_ray_bundle(rays)
+        self.refract_in(bundle)
+        zero_order_fraction = ones(len(bundle))
+        branches = []
+        for order in (1, -1):
+            (efficiencies, wavevecs_unit, wavevecs_mag, efficiencies_r, wavevecs_r_unit, wavevecs_r_mag) = \
+                diffract_both_passes(self, bundle.wavevectors_unit, bundle.wavevectors_vac_mag, local_acoustics, order, (0,1))
+            rescattering_terms = rescattering_fraction * efficiencies_r
+            zero_order_fraction -= efficiencies
+            if order in orders:
+                branches.append((order, 1, make_branch(bundle, wavevecs_unit, wavevecs_mag, efficiencies * (1 - rescattering_terms))))
+            if second_order:
+                branches.append((2*order, 0, make_branch(bundle, wavevecs_r_unit, wavevecs_r_mag, efficiencies * rescattering_terms)))
+        if 0 in orders:
+            zero_order = make_branch(bundle, bundle.wavevectors_unit, bundle.wavevectors_vac_mag, clip(zero_order_fraction, 0, 1))
+            branches.insert(0, (0, 0, zero_order))
+
+        for (_, polarisation, branch) in branches:
+            self.move_ray_through_aod(branch, polarisation)
+            self.refract_out(branch, polarisation)
+        return [(order, branch) for (order, _, branch) in branches]
+
+    def move_ray_through_aod(self, rays, polarisation=1):
+        """Polarisation is 0 for extraordinary light, e.g. undiffracted, and 1 for ordinary."""
+        bundle = as_ray_bundle(rays)
+        directions = self.get_ray_direction_ord(bundle, polarisation)
         distances = self.crystal_thickness / dot(directions, self.normal)
-        for m in range(len(rays)):
-            rays[m].position += distances[m] * directions[m]
+        bundle.positions += (directions.T * distances).T
+        update_rays(rays, bundle)
 
-    def get_ray_direction_ord(self, rays):
-        """Take account of relatively minor walkoff due to shape of indicatrix."""
+    def get_ray_direction_ord(self, rays, polarisation=1):
+        """Take account of relatively minor walkoff due to shape of indicatrix.
+        For the ordinary polarisation unless polarisation is 0 (extraordinary)."""
         # reduce problem to 2D by finding components parallel and perpendicular to optic axis
-        wavelengths = [r.wavelength_vac for r in rays]
-        unit_vecs = array([r.wavevector_unit for r in rays])
+        bundle = as_ray_bundle(rays)
+        unit_vecs = bundle.wavevectors_unit
         unit_vecs_perp = normalise_list(unit_vecs - outer(dot(unit_vecs, self.optic_axis), self.optic_axis))
 
-        angles = angle_between_unit_vectors(unit_vecs, self.optic_axis)
-        
-        tan_walkoff_angle = -ord_ref_ind_gradient(angles, rays[0].wavelength_vac) 
+        cos_angles = dot(unit_vecs, self.optic_axis)
+
+        (_, gradients) = calc_refractive_indices_and_gradients_cos(cos_angles, bundle.wavelengths_vac)
+        tan_walkoff_angle = -gradients[polarisation]
         new_wavevecs = unit_vecs.transpose() + unit_vecs_perp.transpose() * tan_walkoff_angle
         return normalise_list(new_wavevecs.transpose())
 
     def calc_refractive_indices_vectors(self, unit_vectors, wavelength):
-        angles_to_axis = angle_between_unit_vectors(unit_vectors, self.optic_axis)
-        return calc_refractive_indices(angles_to_axis, wavelength)
+        cos_angles_to_axis = dot(unit_vectors, self.optic_axis)
+        return calc_refractive_indices_cos(cos_angles_to_axis, wavelength)
 
     def calc_refractive_indices_rays(self, rays):
-        wavevecs = [r.wavevector_unit for r in rays]
-        return self.calc_refractive_indices_vectors(wavevecs, rays[0].wavelength_vac)
+        bundle = as_ray_bundle(rays)
+        return self.calc_refractive_indices_vectors(bundle.wavevectors_unit, bundle.wavelengths_vac)
 
     def refract_in(self, rays):
         """Refract an optic ray into the AOD."""
         # get vectors perpendicular and parallel to normal
-        wavelength = rays[0].wavelength_vac
-        wavevecs = [r.wavevector_unit for r in rays]
+        bundle = as_ray_bundle(rays)
+        wavelength = bundle.wavelengths_vac
+        wavevecs = bundle.wavevectors_unit
         perpendicular_comps = perpendicular_component_list(wavevecs, self.normal)
 
         unit_perpendiculars = normalise_list(perpendicular_comps)
 
-        sin_angles_in = sqrt( 1 - power(dot(wavevecs, self.optic_axis), 2.) )
-        angle_guesses = arcsin(sin_angles_in / 2.26)
+        sin_angles_in = norm(cross(wavevecs, self.optic_axis), axis=1) # more accurate than sqrt(1 - cos^2) near the axis
+        (map_groups, off_table) = self.get_refraction_map_groups(wavelength)
+        refracted = zeros(wavevecs.shape)
+        for (refraction_maps, mask) in map_groups:
+            sin_angles = refraction_maps[0](sin_angles_in[mask]) # extraordinary in
+            refracted[mask] = outer(sqrt(1 - sin_angles**2), self.normal) + (sin_angles * unit_perpendiculars[mask].transpose()).transpose()
+
+        if off_table.any():
+            (angles, converged) = self.find_refraction_angles(unit_perpendiculars[off_table], sin_angles_in[off_table], wavelength[off_table])
+            if not all(converged):
+                raise RayValidationError("refraction angle did not converge", nonzero(off_table)[0][~converged])
+            refracted[off_table] = outer(cos(angles), self.normal) + (sin(angles) * unit_perpendiculars[off_table].transpose()).transpose()
+
+        bundle.wavevectors_unit = refracted
+        update_rays(rays, bundle)
+
+    def find_refraction_angles(self, unit_perpendiculars, sin_angles_in, wavelength):
+        """Solve Snell's law for the extraordinary wave, n_ext(angle) * sin(angle) = sin_angle_in,
+        where the refracted direction is cos(angle) * normal + sin(angle) * unit_perpendicular.
+        Each ray is solved independently by Newton's method using the analytic
+        index gradient, dropping rays from the working set as they converge.
+        Returns (angles, converged)."""
+        num_rays = sin_angles_in.shape[0]
+        wavelength = array(wavelength, dtype=dtype(float)) + zeros(num_rays) # one wavelength per ray
+        normal_to_axis = dot(self.normal, self.optic_axis)
+        perpendicular_to_axis = dot(unit_perpendiculars, self.optic_axis)
+
+        angles = arcsin(sin_angles_in / 2.26)
+        converged = zeros(num_rays, dtype=dtype(bool))
+        active = arange(num_rays)
+        for _ in range(refraction_max_iterations):
+            (a, sine, cosine) = (angles[active], sin(angles[active]), cos(angles[active]))
+            cos_to_axis = cosine * normal_to_axis + sine * perpendicular_to_axis[active]
+            ((n_ext, _), (n_ext_gradient, _)) = calc_refractive_indices_and_gradients_cos(cos_to_axis, wavelength[active])
+
+            # chain rule through the angle to the optic axis, whose gradient vanishes on the axis
+            sin_to_axis = sqrt(maximum((1 - cos_to_axis) * (1 + cos_to_axis), 0))
+            cos_to_axis_gradient = - sine * normal_to_axis + cosine * perpendicular_to_axis[active]
+            on_axis = sin_to_axis == 0
+            n_ext_gradient = where(on_axis, 0, - n_ext_gradient * cos_to_axis_gradient / where(on_axis, 1, sin_to_axis))
+
+            step = (n_ext * sine - sin_angles_in[active]) / (n_ext_gradient * sine + n_ext * cosine)
+            angles[active] = a - step
+            done = abs(step) < refraction_tolerance
+            converged[active[done]] = True
+            active = active[~done]
+            if active.size == 0:
+                break
+        return (angles, converged)
+
+    def get_refraction_map_groups(self, wavelength):
+        """The rays grouped by the tabulated refraction maps for their wavelength,
+        see teo2.ref_ind_lookup and teo2.group_by_table, as ([(maps, mask)], off_table).
+        Rays without maps, or all rays if the maps are disabled or do not apply to
+        this AOD, are off_table and are refracted exactly. Each ray's group depends
+        only on its own wavelength."""
+        wavelength = array(wavelength, dtype=dtype(float))
+        if not use_refraction_maps or not array_equal(self.optic_axis, self.normal):
+            return ([], ones(wavelength.shape, dtype=dtype(bool)))
+        return group_by_table(wavelength, 'refraction')
+
+    def refract_out(self, rays, polarisation=1):
+        """Refract an optic ray out of the AOD. The ray is ordinary unless polarisation is 0 (extraordinary)."""
+        bundle = as_ray_bundle(rays)
+        wavevecs = bundle.wavevectors_unit
+        (map_groups, off_table) = self.get_refraction_map_groups(bundle.wavelengths_vac)
+        refracted = zeros(wavevecs.shape)
+        for (refraction_maps, mask) in map_groups:
+            unit_perpendiculars = normalise_list(perpendicular_component_list(wavevecs[mask], self.normal))
+            sin_angles_out = refraction_maps[1 + polarisation](norm(cross(wavevecs[mask], self.normal), axis=1))
+            perpendicular_comps = (sin_angles_out * unit_perpendiculars.T).T
+            refracted[mask] = outer(sqrt(1 - sin_angles_out**2), self.normal) + perpendicular_comps # nans for total internal reflection
 
-        def zero_func(angles_out):
-            wavevector_unit = outer(cos(angles_out), self.normal) + (sin(angles_out) * unit_perpendiculars.T).T
-            n_ext = self.calc_refractive_indices_vectors(wavevector_unit, wavelength)[0]
-            return (n_ext * sin(angles_out)) - sin_angles_in
+        if off_table.any():
+            n_ords = self.calc_refractive_indices_vectors(wavevecs[off_table], bundle.wavelengths_vac[off_table])[polarisation]
+            perpendicular_comps = perpendicular_component_list((n_ords * wavevecs[off_table].T).T, self.normal)
+            parallel_components = outer(sqrt( 1 - power(norm(perpendicular_comps, axis=1), 2.) ), self.normal)
+            refracted[off_table] = parallel_components + perpendicular_comps # if this gives nans, probably total internal reflection
 
-        angles = fsolve(zero_func, angle_guesses, band=(0,0))
-        wavevector_unit = outer(cos(angles), self.normal) + (sin(angles) * unit_perpendiculars.transpose()).transpose()
+        bundle.wavevectors_unit = refracted
+        update_rays(rays, bundle)
 
-        for r,w in zip(rays, wavevector_unit):
-            r.wavevector_unit = w
+def make_branch(bundle, wavevectors_unit, wavevectors_vac_mag, energy_fractions):
+    """A copy of the bundle with new wavevectors and a fraction of its energy."""
+    branch = bundle.take(arange(len(bundle)))
+    branch.wavevectors_unit = wavevectors_unit
+    branch.wavevectors_vac_mag = wavevectors_vac_mag
+    branch.energies = branch.energies * energy_fractions
+    branch.rescatter = None
+    return branch
 
-    def refract_out(self, rays):
-        """Refract an optic ray out of the AOD."""
-        wavevecs = array([r.wavevector_unit for r in rays])
-        n_ords = self.calc_refractive_indices_rays(rays)[1]
-        perpendicular_comps = perpendicular_component_list((n_ords * wavevecs.T).T, self.normal)
-        parallel_components = outer(sqrt( 1 - power(norm(perpendicular_comps, axis=1), 2.) ), self.normal)
-        for m in range(len(rays)): # if this is throwing exceptions, probably total internal reflection
-            rays[m].wavevector_unit = parallel_components[m] + perpendicular_comps[m]
+def read_only_array(v):
+    arr = array(v, dtype=dtype(float))
+    arr.setflags(write=False)
+    return arr
@@ -0,0 +1,130 @@
+"""The aod_surrogate module provides the AodSurrogate class, a precomputed grid
+of the Xu-Stroud efficiency and output direction of a single AOD, interpolated
+for fast exploration of AOD designs. See AodVisualisation for its use."""
+
+from ray_bundle import RayBundle
+from acoustics import AcousticField
+from set_up_utils import make_aod_narrow, make_aod_wide
+from memoize import memoized
+from vector_utils import normalise, perpendicular_component
+from numpy import array, dtype, sin, sqrt, arcsin, zeros, ones, clip, searchsorted, \
+    broadcast_arrays, meshgrid, abs, nanmax, isfinite, linspace, pi, dot, cross
+from numpy.random import RandomState
+import itertools
+
+default_x_angles = linspace(0.5, 4.5, 81) * pi/180
+default_y_angles = array([0.])
+default_frequencies = linspace(20e6, 60e6, 161)
+default_powers = linspace(0, 2.5, 11)
+default_wavelengths = array([800e-9, 920e-9])
+
+class AodSurrogate(object):
+    """The efficiency and output direction of an Aod tabulated on a grid of
+    incidence angles, acoustic frequencies, acoustic powers and wavelengths,
+    and interpolated multilinearly. An incidence direction (x_angle, y_angle)
+    is the wavevector [sin(x_angle), sin(y_angle), ...] in the frame of the Aod,
+    see get_frame; output angles are given the same way.
+    An axis with one value fixes that dimension. Points off the grid are
+    evaluated with the exact model."""
+
+    @staticmethod
+    def create_surrogate(aod, order, x_angles=default_x_angles, y_angles=default_y_angles, frequencies=default_frequencies, \
+                            powers=default_powers, wavelengths=default_wavelengths, num_spot_checks=200):
+        """Tabulate the exact model over the grid and estimate the interpolation error at random points."""
+        surrogate = AodSurrogate(aod, order, (x_angles, y_angles, frequencies, powers, wavelengths))
+        if num_spot_checks:
+            surrogate.error_estimate = surrogate.spot_check(num_spot_checks)
+        return surrogate
+
+    def __init__(self, aod, order, axes):
+        self.aod = aod
+        self.order = order
+        self.axes = [array(a, dtype=dtype(float)).reshape(-1) for a in axes]
+        grid_points = meshgrid(*self.axes, indexing='ij')
+        self.tables = array(self.calc_exact(*grid_points))
+        self.error_estimate = None
+
+    def calc_exact(self, x_angles, y_angles, frequencies, powers, wavelengths):
+        """(efficiencies, x_angles_out, y_angles_out) from the exact model, with the shape of the broadcast inputs."""
+        inputs = broadcast_arrays(*[array(a, dtype=dtype(float)) for a in (x_angles, y_angles, frequencies, powers, wavelengths)])
+        (x, y, f, p, w) = [a.reshape(-1) for a in inputs]
+        (sin_x, sin_y) = (sin(x), sin(y))
+        frame = self.get_frame()
+        wavevecs = dot(array([sin_x, sin_y, sqrt(1 - sin_x**2 - sin_y**2)]).T, frame)
+        bundle = RayBundle(zeros((x.size, 3)), wavevecs, w)
+        acoustics = AcousticField(f, p)
+
+        self.aod.propagate_ray(bundle, acoustics, self.order)
+
+        wavevecs_out = dot(bundle.wavevectors_unit, frame.T)
+        outputs = (bundle.energies, arcsin(wavevecs_out[:,0]), arcsin(wavevecs_out[:,1]))
+        return [o.reshape(inputs[0].shape) for o in outputs]
+
+    def get_frame(self):
+        """The rows are the x, y and z axes of the Aod frame in the lab frame: x along
+        the acoustic direction in the plane of the Aod, z along the Aod normal."""
+        normal = self.aod.normal
+        x_axis = normalise(perpendicular_component(self.aod.acoustic_direction, normal))
+        return array([x_axis, cross(normal, x_axis), normal])
+
+    def is_on_grid(self, points):
+        """True where all the coordinates lie within the grid bounds."""
+        on_grid = ones(points[0].shape, dtype=bool)
+        for (axis, p) in zip(self.axes, points):
+            on_grid &= (p >= axis[0]) & (p <= axis[-1])
+        return on_grid
+
+    def interpolate(self, points):
+        """Multilinear interpolation of the tables at points on the grid."""
+        (indices, fractions) = ([], [])
+        for (axis, p) in zip(self.axes, points):
+            if axis.size == 1:
+                (idx, t) = (zeros(p.shape, dtype=int), zeros(p.shape))
+            else:
+                idx = clip(searchsorted(axis, p, 'right') - 1, 0, axis.size - 2)
+                t = (p - axis[idx]) / (axis[idx+1] - axis[idx])
+            indices.append(idx)
+            fractions.append(t)
+
+        corner_offsets = [(0,) if axis.size == 1 else (0, 1) for axis in self.axes]
+        result = zeros((self.tables.shape[0],) + points[0].shape)
+        for offsets in itertools.product(*corner_offsets):
+            weights = ones(points[0].shape)
+            for (t, o) in zip(fractions, offsets):
+                weights *= t if o else 1 - t
+            corner = tuple(idx + o for (idx, o) in zip(indices, offsets))
+            result += self.tables[(slice(None),) + corner] * weights
+        return result
+
+    def __call__(self, x_angles, y_angles, frequencies, powers, wavelengths):
+        """(efficiencies, x_angles_out, y_angles_out) with the shape of the broadcast inputs,
+        interpolated on the grid and exact elsewhere."""
+        points = broadcast_arrays(*[array(a, dtype=dtype(float)) for a in (x_angles, y_angles, frequencies, powers, wavelengths)])
+        on_grid = self.is_on_grid(points)
+        result = self.interpolate([p[on_grid] for p in points])
+        outputs = zeros((self.tables.shape[0],) + points[0].shape)
+        outputs[(slice(None),) + (on_grid,)] = result
+        off_grid = ~on_grid
+        if off_grid.any():
+            outputs[(slice(None),) + (off_grid,)] = self.calc_exact(*[p[off_grid] for p in points])
+        return tuple(outputs)
+
+    def spot_check(self, num_points, seed=0):
+        """Maximum and rms differences from the exact model at random points on the grid,
+        for the efficiency and for the output angles in radians."""
+        random = RandomState(seed)
+        points = [a[0] + (a[-1] - a[0]) * random.random_sample(num_points) for a in self.axes]
+        approx = self.interpolate(points)
+        exact = array(self.calc_exact(*points))
+        errors = abs(approx - exact)
+        errors = errors[:, isfinite(errors).all(axis=0)]
+        return {'efficiency_max': nanmax(errors[0]), \
+                'efficiency_rms': sqrt((errors[0]**2).mean()), \
+                'angle_max': nanmax(errors[1:3]), \
+                'angle_rms': sqrt((errors[1:3]**2).mean())}
+
+@memoized
+def get_design_surrogate(is_wide, order, normal=(0.,0.,1.), ac_dir=(1.,0.,0.)):
+    """The AodSurrogate with the default grid for the wide or narrow AOD of set_up_utils, built once."""
+    aod = make_aod_wide(normal, ac_dir) if is_wide else make_aod_narrow(normal, ac_dir)
+    return AodSurrogate.create_surrogate(aod, order)
@@ -1,7 +1,8 @@
 from ray import Ray
 from acoustics import Acoustics
-from numpy import linspace, pi, sin, cos, abs, sqrt, arcsin, max, array, argmax
-from plot_utils import generic_plot_surface, generic_plot, multi_line_plot
+from numpy import linspace, pi, sin, cos, abs, sqrt, arcsin, max, array, argmax, meshgrid
+from plot_utils import generic_plot_surface, generic_plot_surface_vals, generic_plot, generic_plot_vals, multi_line_plot
+from aod_surrogate import AodSurrogate
 from xu_stroud_model import diffract_by_wavevector_triangle
 from set_up_utils import make_aod_narrow, make_aod_wide
 
@@ -14,6 +15,7 @@ class AodVisualisation(object):
             resolution=60, \
             freq_bnds=(20,60), \
             deg_bnds=(0.5,4.5), \
+            use_surrogate=False, \
             ):
         normal = [0,sin(0.0),cos(0.0)]
         self.aod = make_aod_narrow(normal, ac_dir_rel)
@@ -24,6 +26,13 @@ class AodVisualisation(object):
         self.resolution = resolution
         self.mhz_range = linspace(freq_bnds[0], freq_bnds[1], resolution)
         self.degrees_range =  linspace(deg_bnds[0], deg_bnds[1], resolution)
+        self.surrogate = None
+        if use_surrogate: # efficiency plots then come from the interpolated grid, so replotting is fast
+            self.surrogate = AodSurrogate.create_surrogate(self.aod, order, x_angles=self.degrees_range*pi/180, \
+                frequencies=self.mhz_range*1e6, wavelengths=[op_wavelength_vac])
+
+    def surrogate_efficiency(self, deg, mhz, ac_power):
+        return self.surrogate(deg*pi/180, 0, mhz*1e6, ac_power, self.op_wavelength_vac)[0]
 
     def plot_mismatch_xangle(self, ac_power=1.5, freq=39):
         """Plot diffraction efficiency against acoustic frequency for fixed incidence angle."""
@@ -58,6 +67,12 @@ class AodVisualisation(object):
     def plot_efficiency_xangle_freq(self, ac_power=1.5):
         """Plot diffraction efficiency against
         incidence angle and acoustic frequency."""
+        labels = ["Incidence angle / deg","Frequency / MHz","Efficiency"]
+        if self.surrogate is not None:
+            (deg, mhz) = meshgrid(self.degrees_range, self.mhz_range)
+            generic_plot_surface_vals(deg, mhz, self.surrogate_efficiency(deg, mhz, ac_power), labels)
+            return
+
         def func(deg, mhz):
             ang = deg * pi/180
             optical_rot = pi/180 * 0
@@ -68,7 +83,6 @@ class AodVisualisation(object):
             self.aod.propagate_ray([ray], [acoustics], self.order)
             return ray.energy
 
-        labels = ["Incidence angle / deg","Frequency / MHz","Efficiency"]
         generic_plot_surface(self.degrees_range, self.mhz_range, func, labels)
 
     def plot_efficiency_xangle_freq_second_order_noise(self, ac_power=1.5):
@@ -135,6 +149,12 @@ class AodVisualisation(object):
 
     def plot_efficiency_freq(self, ac_power=1.5, deg=2.2):
         """Plot diffraction efficiency against acoustic frequency for fixed incidence angle."""
+        labels = ["Frequency / MHz","Efficiency"]
+        limits = [min(self.mhz_range),max(self.mhz_range),0,1]
+        if self.surrogate is not None:
+            generic_plot_vals(self.mhz_range, self.surrogate_efficiency(deg, self.mhz_range, ac_power), labels, limits)
+            return
+
         def func(mhz):
             ang = deg * pi / 180
             wavevector_unit = [sin(ang), 0, cos(ang)]
@@ -144,8 +164,7 @@ class AodVisualisation(object):
             self.aod.propagate_ray([ray], [acoustics], self.order)
             return ray.energy
 
-        labels = ["Frequency / MHz","Efficiency"]
-        generic_plot(self.mhz_range, func, labels, limits=[min(self.mhz_range),max(self.mhz_range),0,1])
+        generic_plot(self.mhz_range, func, labels, limits)
 
     def plot_efficiency_angle_out(self, ac_power=1.5, deg=2.2):
         """Plot diffraction efficiency against acoustic frequency for fixed incidence angle."""
@@ -216,6 +235,12 @@ class AodVisualisation(object):
 
     def plot_efficiency_xangle(self, ac_power=1.5, ac_mhz=39):
         """Plot diffraction efficiency against incidence angle for fixed acoustic frequency."""
+        labels = ["Incidence angle / deg","Efficiency"]
+        limits = (min(self.degrees_range),max(self.degrees_range),0,1)
+        if self.surrogate is not None:
+            generic_plot_vals(self.degrees_range, self.surrogate_efficiency(self.degrees_range, ac_mhz, ac_power), labels, limits)
+            return
+
         def func(deg):
             ang = deg * pi/180
             wavevector_unit = [sin(ang), 0, cos(ang)]
@@ -225,8 +250,7 @@ class AodVisualisation(object):
             self.aod.propagate_ray([ray], [acoustics], self.order)
             return ray.energy
 
-        labels = ["Incidence angle / deg","Efficiency"]
-        generic_plot(self.degrees_range, func, labels, (min(self.degrees_range),max(self.degrees_range),0,1))
+        generic_plot(self.degrees_range, func, labels, limits)
 
     def plot_efficiency_power(self, ac_mhz=40):
         """Plot maximum diffraction efficiency for any incidence angle against acoustic power for fixed acoustic frequency."""
@@ -0,0 +1,112 @@
+"""The aol_batch module provides the AolBatch class, many drive configurations
+of one AOL evaluated together. Field of view and pair deflection ratio maps
+differ only in the drive of a fixed set of AODs, so every configuration is
+propagated in a single vectorised pass through an AolFull."""
+
+from aol_full import AolFull, calculate_drive_freq, get_wavelength_groups
+from aol_simple import calc_base_ray_positions
+from acoustics import AcousticDrive, default_power, teo2_ac_vel, pointing_ramp_time
+from ray_bundle import as_ray_bundle
+from numpy import array, dtype, zeros, arange, tile, repeat, shape, atleast_1d, broadcast_to, unique, array_equal
+
+class AolBatch(object):
+    """K drive configurations of an AOL sharing its Aods and spacing. The drive
+    coefficients are held as (K, num_of_aods) arrays and the base ray positions
+    as a (K, num_of_aods, 2) array."""
+
+    @staticmethod
+    def create_aol_batch(aods, aod_spacing, order, op_wavelength, base_freq, pair_deflection_ratio, focus_positions, \
+            focus_velocities, ac_power=[default_power]*4, ac_velocity=teo2_ac_vel, ramp_time=pointing_ramp_time):
+        """Helper method to create the batch, as AolFull.create_aol for each of K focus positions.
+        focus_velocities is either one velocity for all the focus positions or (K, 3), one for each."""
+        focus_positions = array(focus_positions, dtype=dtype(float)).reshape(-1, 3)
+        focus_velocities = broadcast_to(array(focus_velocities, dtype=dtype(float)), focus_positions.shape)
+        drives = [calculate_drive_freq(aods, aod_spacing, order, op_wavelength, ac_velocity, base_freq, pair_deflection_ratio, p, v) \
+                    for (p, v) in zip(focus_positions, focus_velocities)]
+        (const, linear, quad) = [array([d[m] for d in drives], dtype=dtype(float)) for m in range(3)]
+        power = zeros(const.shape) + array(ac_power, dtype=dtype(float))
+        return AolBatch(aods, aod_spacing, order, op_wavelength, const, linear, quad, power, ac_velocity, ramp_time)
+
+    @staticmethod
+    def from_aols(aols):
+        """Stack existing AolFull objects, which must have equal Aods, spacing and order,
+        and whose drives must share one acoustic velocity and ramp time."""
+        first = aols[0]
+        for a in aols[1:]:
+            if [get_aod_key(aod) for aod in a.aods] != [get_aod_key(aod) for aod in first.aods] \
+                    or not array_equal(a.aod_spacing, first.aod_spacing) or a.order != first.order:
+                raise ValueError('AOLs must have equal Aods, spacing and order')
+        drives = [a.acoustic_drives for a in aols]
+        if len(set((d.velocity, d.ramp_time) for ds in drives for d in ds)) > 1:
+            raise ValueError('acoustic drives must share their velocity and ramp time')
+        (const, linear, quad, power) = [array([[getattr(d, name) for d in ds] for ds in drives], dtype=dtype(float)) \
+                                            for name in ('const', 'linear', 'quad', 'power')]
+        first_drive = drives[0][0]
+        base_ray_positions = array([a.base_ray_positions for a in aols], dtype=dtype(float))
+        return AolBatch(first.aods, first.aod_spacing, first.order, None, const, linear, quad, power, \
+                            first_drive.velocity, first_drive.ramp_time, base_ray_positions)
+
+    def __init__(self, aods, aod_spacing, order, op_wavelength, const, linear, quad, power, ac_velocity=teo2_ac_vel, \
+            ramp_time=pointing_ramp_time, base_ray_positions=None):
+        self.aods = array(aods)
+        self.aod_spacing = array(aod_spacing, dtype=dtype(float))
+        self.order = order
+        self.num_of_aods = self.aods.size
+        self.const = array(const, dtype=dtype(float))
+        self.linear = array(linear, dtype=dtype(float))
+        self.quad = array(quad, dtype=dtype(float))
+        self.power = array(power, dtype=dtype(float))
+        self.ac_velocity = ac_velocity
+        self.ramp_time = ramp_time
+        self.num_of_configs = self.const.shape[0]
+
+        if base_ray_positions is None:
+            base_ray_positions = self.find_base_ray_positions(op_wavelength)
+        self.base_ray_positions = array(base_ray_positions, dtype=dtype(float))
+        self.configs_aol = self.get_aol(arange(self.num_of_configs)) # one drive configuration per ray
+
+    def find_base_ray_positions(self, op_wavelength):
+        """Calculate the AOD positions of all the configurations at once, as in AolFull."""
+        return calc_base_ray_positions(self.order, op_wavelength, self.aod_spacing, [a.relative_acoustic_direction for a in self.aods], \
+                    self.const, self.quad, [self.ac_velocity]*self.num_of_aods, [self.ramp_time]*self.num_of_aods)
+
+    def get_aol(self, config_indices):
+        """An AolFull whose drives and base ray positions hold the configuration of each ray."""
+        drives = [AcousticDrive(self.const[config_indices,k], self.linear[config_indices,k], self.quad[config_indices,k], \
+                    self.power[config_indices,k], self.ac_velocity, self.ramp_time) for k in range(self.num_of_aods)]
+        base_ray_positions = self.base_ray_positions[config_indices].transpose(1,0,2)
+        return AolFull(self.aods, self.aod_spacing, drives, self.order, None, base_ray_positions)
+
+    def get_rescattering_corrections(self, wavelengths):
+        """The (num_of_aods, K, N) factors for rescattering 'off', as
+        AolFull.get_rescattering_corrections with a tracer for each configuration.
+        One set of tracers is followed for each wavelength group."""
+        (unique_wavelengths, wavelength_indices) = unique(get_wavelength_groups(wavelengths), return_inverse=True)
+        corrections = array([self.configs_aol.get_rescattering_corrections(zeros(self.num_of_configs) + w) for w in unique_wavelengths])
+        return corrections[wavelength_indices].transpose(1,2,0)
+
+    def propagate(self, rays, time, distance=0, record=('final_energies',), rescattering='full'):
+        """Propagate the N rays through every configuration, at a time or each of an
+        array of T times, in one pass. Records outputs as AolFull.propagate, with
+        shapes (K, N, ...) or (T, K, N, ...). Ray states are unchanged."""
+        bundle = as_ray_bundle(rays)
+        num_rays = len(bundle)
+        times = atleast_1d(array(time, dtype=dtype(float))).reshape(-1)
+        copies = times.size * self.num_of_configs
+        ray_indices = tile(arange(num_rays), copies)
+        config_indices = tile(repeat(arange(self.num_of_configs), num_rays), times.size)
+        ray_times = repeat(times, self.num_of_configs * num_rays)
+
+        rescattering_corrections = None
+        if rescattering == 'off':
+            rescattering_corrections = self.get_rescattering_corrections(bundle.wavelengths_vac)[:, config_indices, ray_indices]
+
+        aol = self.get_aol(config_indices)
+        results = aol.propagate_bundle(bundle.take(ray_indices), ray_times, distance, rescattering, record, rescattering_corrections)
+        leading_shape = shape(time) + (self.num_of_configs, num_rays)
+        return dict((name, r.reshape(leading_shape + r.shape[1:])) for (name, r) in results.items())
+
+def get_aod_key(aod):
+    """A key equal for Aods with equal geometry and transducers."""
+    return (tuple(aod.normal), tuple(aod.relative_acoustic_direction), aod.transducer_height, aod.transducer_width, \
+                aod.crystal_thickness, aod.transducer_efficiency_func)
@@ -1,10 +1,15 @@
-from aol_simple import AolSimple
+from aol_simple import get_base_ray_positions
 from acoustics import AcousticDrive, default_power, teo2_ac_vel
 from aol_drive import calculate_drive_freq_4, calculate_drive_freq_6
 from acoustics import pointing_ramp_time
-from numpy import append, array, dtype, concatenate, zeros, atleast_2d, dot, isnan
+from ray_bundle import RayBundle, as_ray_bundle, update_rays, concatenate_bundles
+from error_utils import check_are_unit_vectors
+from teo2 import accuracy as wavelength_group_accuracy
+from numpy import append, array, dtype, concatenate, zeros, atleast_2d, dot, isnan, isfinite, arange, nonzero, ndim, tile, repeat, unique, around, newaxis
 import copy
 
+recordable_outputs = ('paths', 'energies', 'final_energies', 'final_positions', 'rescatter') # see AolFull.propagate
+
 # AOL model using AOD objects, incoroporating the Xu & Stroud diffraction theory.
 class AolFull(object):
     """The full AOL model. Can take a list of rays and propagate them through
@@ -16,29 +21,28 @@ class AolFull(object):
             focus_velocity, ac_power=[default_power]*4, ac_velocity=teo2_ac_vel, ramp_time=pointing_ramp_time):
         """Helper method to create the AOL with AODs and drive attributes."""
 
-        crystal_thickness = array([a.crystal_thickness for a in aods], dtype=dtype(float))
-
-        if len(aods) is 4:
-            (const, linear, quad) = calculate_drive_freq_4(order, op_wavelength, ac_velocity, aod_spacing, crystal_thickness, \
-                                base_freq, pair_deflection_ratio, focus_position, focus_velocity)
-        elif len(aods) is 6:
-            (const, linear, quad) = calculate_drive_freq_6(order, op_wavelength, ac_velocity, aod_spacing, crystal_thickness, \
-                                base_freq, pair_deflection_ratio, focus_position, focus_velocity)
-        else:
-            raise Exception('Unknown drive equations for number of AODs')
-
+        (const, linear, quad) = calculate_drive_freq(aods, aod_spacing, order, op_wavelength, ac_velocity, base_freq, \
+                                pair_deflection_ratio, focus_position, focus_velocity)
         acoustic_drives = AcousticDrive.make_acoustic_drives(const, linear, quad, ac_power, ac_velocity, ramp_time)
         return AolFull(aods, aod_spacing, acoustic_drives, order, op_wavelength)
 
-    def __init__(self, aods, aod_spacing, acoustic_drives, order, op_wavelength):
+    def __init__(self, aods, aod_spacing, acoustic_drives, order, op_wavelength, base_ray_positions=None):
         self.aods = array(aods)
         self.aod_spacing = array(aod_spacing, dtype=dtype(float))
         self.acoustic_drives = array(acoustic_drives)
         self.order = order
         self.num_of_aods = self.aods.size
+        self.geometry_key = None # see get_geometry
+        self.rescattering_corrections = {} # see get_rescattering_corrections
+        self.rescattering_corrections_key = None
 
-        simple = AolSimple(self.num_of_aods, order, self.aod_spacing, self.acoustic_drives, zeros((self.num_of_aods,2)), [a.relative_acoustic_direction for a in aods])
-        self.base_ray_positions = simple.find_base_ray_positions(op_wavelength)
+        if base_ray_positions is not None: # e.g. one per ray, see AolBatch
+            self.base_ray_positions = base_ray_positions
+        else:
+            drives = self.acoustic_drives
+            self.base_ray_positions = get_base_ray_positions(order, op_wavelength, self.aod_spacing, \
+                    array([a.relative_acoustic_direction for a in aods]), array([d.const for d in drives]), array([d.quad for d in drives]), \
+                    tuple(d.velocity for d in drives), tuple(d.ramp_time for d in drives))
 
     def plot_ray_through_aol(self, rays, time, distance):
         """Method to take a list of rays and plot their path through the AOL to a given distance past it. Ray states are unchanged."""
@@ -78,51 +82,231 @@ class AolFull(object):
         plt.show()
         return plt
 
-    def propagate_to_distance_past_aol(self, rays, time, distance=0):
-        """Method to take a list of rays, propagate them through the AOL and then a given distance further. Ray states are changed."""
-        num_rays = len(rays)
-        crystal_thickness = array([a.crystal_thickness for a in self.aods], dtype=dtype(float))
-        spacings = append(self.aod_spacing, distance)
-        normals = concatenate( ([a.normal for a in self.aods], atleast_2d([0,0,1])) )
-        paths = zeros( (len(rays),self.num_of_aods*2+1,3) )
-        energies = zeros( (len(rays), self.num_of_aods) )
+    def propagate_to_distance_past_aol(self, rays, time, distance=0, rescattering='full', return_rescatter=False):
+        """Method to take a list of rays (or a RayBundle), propagate them through the AOL and then a given distance further. Ray states are changed.
+        See Aod.propagate_ray for the rescattering modes, and get_rescattering_corrections for 'off'.
+        With return_rescatter=True the rescattered energies at each AOD are also returned as an array
+        the shape of energies, which needs rescattering 'full'.
+        With an array of T times, every ray is propagated at every time in one pass and the ray states are
+        unchanged. Paths then have shape (T, N, num_of_aods*2+1, 3) and energies (T, N, num_of_aods).
+        See propagate to record less."""
+        record = ('paths', 'energies', 'rescatter') if return_rescatter else ('paths', 'energies')
+        if ndim(time) == 0:
+            bundle = as_ray_bundle(rays)
+            results = self.propagate_bundle(bundle, time, distance, rescattering, record)
+            update_rays(rays, bundle)
+        else:
+            results = self.propagate(rays, time, distance, record, rescattering)
+        return tuple(results[name] for name in record)
 
-        for m in range(num_rays): # move rays to entrance of first crystal
-                rays[m].propagate_from_plane_to_plane(0, array([0.,0.,1.]), self.aods[0].normal)
+    def propagate(self, rays, time, distance=0, record=('final_energies',), rescattering='full'):
+        """A lighter propagate_to_distance_past_aol that only records the outputs named
+        in record, from recordable_outputs, and returns them in a dict. 'final_energies'
+        and 'final_positions' are taken at the distance past the AOL, with shapes (N,)
+        and (N, 3). A RayBundle is propagated in place but the states of a list of Ray
+        objects are not updated. Time may be an array as for propagate_to_distance_past_aol,
+        giving outputs with a leading T axis."""
+        bundle = as_ray_bundle(rays)
+        if ndim(time) == 0:
+            return self.propagate_bundle(bundle, time, distance, rescattering, record)
+
+        times = array(time, dtype=dtype(float))
+        num_rays = len(bundle)
+        results = self.propagate_bundle(bundle.take(tile(arange(num_rays), times.size)), repeat(times.reshape(-1), num_rays), distance, rescattering, record)
+        return dict((name, r.reshape(times.shape + (num_rays,) + r.shape[1:])) for (name, r) in results.items())
+
+    def propagate_bundle(self, bundle, time, distance, rescattering, record, rescattering_corrections=None):
+        """Propagate the RayBundle through the AOL, at one time or at a time for each ray,
+        allocating and filling only the recorded outputs. With rescattering 'off' the
+        (num_of_aods, N) rescattering_corrections default to get_rescattering_corrections."""
+        for name in record:
+            if name not in recordable_outputs:
+                raise ValueError('cannot record %s, choose from %s' % (name, recordable_outputs))
+        if 'rescatter' in record and rescattering != 'full':
+            raise ValueError("rescatter is only recorded with rescattering 'full'")
+        if rescattering == 'off' and rescattering_corrections is None:
+            rescattering_corrections = self.get_rescattering_corrections(bundle.wavelengths_vac)
+        check_are_unit_vectors(bundle.wavevectors_unit)
+        num_rays = len(bundle)
+        (normals, spacings_less_thickness) = self.get_geometry(distance)
+        paths = zeros( (num_rays,self.num_of_aods*2+1,3) ) if 'paths' in record else None
+        energies = zeros( (num_rays, self.num_of_aods) ) if 'energies' in record else None
+        rescatter = zeros( (num_rays, self.num_of_aods) ) if 'rescatter' in record else None
+
+        bundle.propagate_from_plane_to_plane(0, array([0.,0.,1.]), normals[0]) # move rays to entrance of first crystal
 
         def diffract_and_propagate(aod_num):
-            for m in range(num_rays):
-                paths[m,2*aod_num - 2,:] = rays[m].position     # set path at entrance
-            self.diffract_at_aod(rays, time, aod_num)           # diffract at crystal
-            for m in range(num_rays):
-                paths[m,2*aod_num - 1,:] = rays[m].position     # set path at exit
-                energies[m,aod_num-1] = rays[m].energy          # (line below) move ray to entrance of next crystal
-                spacing_less_thickness = spacings[aod_num-1] - crystal_thickness[aod_num-1]/dot(self.aods[aod_num-1].normal, array([0,0,1]))
-                rays[m].propagate_from_plane_to_plane(spacing_less_thickness, normals[aod_num-1], normals[aod_num])
+            if paths is not None:
+                paths[:,2*aod_num - 2,:] = bundle.positions     # set path at entrance
+            correction = 1. if rescattering_corrections is None else rescattering_corrections[aod_num-1]
+            self.diffract_at_aod(bundle, time, aod_num, rescattering, correction) # diffract at crystal
+            if paths is not None:
+                paths[:,2*aod_num - 1,:] = bundle.positions     # set path at exit
+            if energies is not None:
+                energies[:,aod_num-1] = bundle.energies
+            if rescatter is not None:
+                rescatter[:,aod_num-1] = bundle.rescatter
+            bundle.propagate_from_plane_to_plane(spacings_less_thickness[aod_num-1], normals[aod_num-1], normals[aod_num]) # move rays to entrance of next crystal
 
         for k in range(self.num_of_aods):
             diffract_and_propagate(k+1)
 
-        for m in range(num_rays):
-            paths[m,self.num_of_aods*2,:] = rays[m].position
-        return (paths, energies)
+        if paths is not None:
+            paths[:,self.num_of_aods*2,:] = bundle.positions
+        check_are_unit_vectors(bundle.wavevectors_unit)
+        outputs = {'paths': paths, 'energies': energies, 'rescatter': rescatter}
+        if 'final_energies' in record:
+            outputs['final_energies'] = array(bundle.energies, dtype=dtype(float))
+        if 'final_positions' in record:
+            outputs['final_positions'] = bundle.positions.copy()
+        return dict((name, outputs[name]) for name in record)
+
+    def propagate_ray_tree(self, rays, time, distance=0, orders=(0, 1, -1), second_order=False, energy_floor=1e-6):
+        """Propagate rays through the AOL, splitting each ray at every AOD into the
+        given diffraction orders (see Aod.split_ray), and then a given distance
+        further. Useful for stray light and ghost focus budgets. All branches at
+        the same depth are processed as one bundle. Branches with energy below
+        energy_floor, or totally internally reflected, are pruned. Ray states are unchanged.
+        Returns (leaves, paths, ray_indices, branch_orders): a RayBundle of the M
+        surviving branches, their (M, num_of_aods*2+1, 3) paths, the index of the
+        ray each branch came from and the (M, num_of_aods) orders taken at each AOD."""
+        bundle = as_ray_bundle(rays)
+        bundle = bundle.take(arange(len(bundle))) # don't want to alter the ray state
+        check_are_unit_vectors(bundle.wavevectors_unit)
+        (normals, spacings_less_thickness) = self.get_geometry(distance)
+        paths = zeros( (len(bundle),self.num_of_aods*2+1,3) )
+        ray_indices = arange(len(bundle))
+        branch_orders = zeros( (len(bundle), self.num_of_aods), dtype=dtype(int) )
+
+        bundle.propagate_from_plane_to_plane(0, array([0.,0.,1.]), normals[0]) # move rays to entrance of first crystal
+
+        for k in range(self.num_of_aods):
+            if len(bundle) == 0:
+                break
+            paths[:,2*k,:] = bundle.positions
+            aod = self.aods[k]
+            local_acoustics = self.acoustic_drives[k].get_local_acoustics(time, bundle.positions, self.base_ray_positions[k], aod.acoustic_direction)
+
+            (branches, parents, orders_taken) = ([], [], [])
+            for (order, branch) in aod.split_ray(bundle, local_acoustics, orders, second_order):
+                surviving = (branch.energies >= energy_floor) & isfinite(branch.wavevectors_unit).all(axis=1)
+                branches.append(branch.take(surviving))
+                parents.append(nonzero(surviving)[0])
+                orders_taken.append(zeros(surviving.sum(), dtype=dtype(int)) + order)
+            bundle = concatenate_bundles(branches)
+            parents = concatenate(parents)
+            (paths, ray_indices, branch_orders) = (paths[parents], ray_indices[parents], branch_orders[parents])
+            branch_orders[:,k] = concatenate(orders_taken)
+
+            paths[:,2*k+1,:] = bundle.positions
+            bundle.propagate_from_plane_to_plane(spacings_less_thickness[k], normals[k], normals[k+1])
+
+        paths[:,self.num_of_aods*2,:] = bundle.positions
+        check_are_unit_vectors(bundle.wavevectors_unit)
+        return (bundle, paths, ray_indices, branch_orders)
+
+    def get_rescattering_corrections(self, wavelengths):
+        """The (num_of_aods, N) factors used in place of the rescattering solve for
+        rescattering 'off', from calc_rescattering_corrections at the wavelength group
+        of each ray, see get_wavelength_groups. They are computed the first time each
+        group is needed and cached, one entry per group, until the geometry or drives
+        change, so results do not depend on earlier runs."""
+        (unique_wavelengths, wavelength_indices) = unique(get_wavelength_groups(wavelengths), return_inverse=True)
+        self.get_geometry(0) # brings geometry_key up to date
+        key = (self.geometry_key, get_drive_key(self.acoustic_drives))
+        if key != self.rescattering_corrections_key:
+            self.rescattering_corrections = {}
+            self.rescattering_corrections_key = key
+        missing = [w for w in unique_wavelengths if w not in self.rescattering_corrections]
+        if missing:
+            self.rescattering_corrections.update(zip(missing, self.calc_rescattering_corrections(missing)))
+        corrections = array([self.rescattering_corrections[w] for w in unique_wavelengths]) # (wavelengths, num_of_aods, num_of_configs)
+        configs = arange(len(wavelengths)) if corrections.shape[2] > 1 else zeros(len(wavelengths), dtype=dtype(int))
+        return corrections[wavelength_indices, :, configs].T
+
+    def calc_rescattering_corrections(self, wavelengths):
+        """The rescattering correction at each AOD of tracer rays along z from the
+        origin at time 0, as (len(wavelengths), num_of_aods, num_of_configs). With one
+        drive configuration a tracer for every wavelength is followed in one pass. With
+        per-ray acoustic drives, see AolBatch, a tracer for each configuration is
+        followed for each wavelength."""
+        num_configs = array(self.acoustic_drives[0].const).size
+        if num_configs > 1:
+            return array([self.trace_rescattering_corrections(zeros(num_configs) + w) for w in wavelengths])
+        return self.trace_rescattering_corrections(array(wavelengths, dtype=dtype(float))).T[:,:,newaxis]
+
+    def trace_rescattering_corrections(self, wavelengths):
+        """The (num_of_aods, N) rescattering corrections of N tracers at the wavelengths."""
+        num_tracers = len(wavelengths)
+        tracers = RayBundle(zeros((num_tracers, 3)), tile([0.,0.,1.], (num_tracers, 1)), wavelengths)
+        (normals, spacings_less_thickness) = self.get_geometry(0)
+        corrections = zeros((self.num_of_aods, num_tracers))
 
-    def diffract_at_aod(self, rays, time, aod_number):
+        tracers.propagate_from_plane_to_plane(0, array([0.,0.,1.]), normals[0])
+        for k in range(self.num_of_aods):
+            corrections[k] = self.diffract_at_aod(tracers, 0, k+1, 'correction')
+            tracers.propagate_from_plane_to_plane(spacings_less_thickness[k], normals[k], normals[k+1])
+        return corrections
+
+    def get_geometry(self, distance):
+        """The (num_of_aods+1, 3) plane normals, ending with the [0,0,1] plane a distance
+        past the AOL, and the distance to travel from each crystal exit to the next plane.
+        The stacked arrays are rebuilt only when an AOD's geometry, crystal thickness or
+        the spacing has changed, see Aod.update_geometry."""
+        key = tuple(a.geometry_stamp for a in self.aods) + tuple(a.crystal_thickness for a in self.aods) + tuple(self.aod_spacing)
+        if self.geometry_key != key:
+            normals = concatenate( ([a.normal for a in self.aods], atleast_2d([0,0,1])) )
+            crystal_thickness = array([a.crystal_thickness for a in self.aods], dtype=dtype(float))
+            thickness_along_z = crystal_thickness / normals[0:-1,2]
+            self.geometry = (normals, self.aod_spacing - thickness_along_z[0:-1], thickness_along_z[-1])
+            self.geometry_key = key
+        (normals, gaps_less_thickness, last_thickness_along_z) = self.geometry
+        return (normals, append(gaps_less_thickness, distance - last_thickness_along_z))
+
+    def diffract_at_aod(self, rays, time, aod_number, rescattering='full', rescattering_correction=1.):
         idx = aod_number-1
 
         aod = self.aods[idx]
         base_ray_position = self.base_ray_positions[idx]
         drive = self.acoustic_drives[idx]
 
-        local_acoustics = drive.get_local_acoustics(time, [r.position for r in rays], base_ray_position, aod.acoustic_direction)
-        aod.propagate_ray(rays, local_acoustics, self.order)
+        bundle = as_ray_bundle(rays)
+        local_acoustics = drive.get_local_acoustics(time, bundle.positions, base_ray_position, aod.acoustic_direction)
+        corrections = aod.propagate_ray(bundle, local_acoustics, self.order, rescattering, rescattering_correction)
+        update_rays(rays, bundle)
+        return corrections
 
     def change_orientation(self, aod_num, new_normal):
         assert not any(isnan(new_normal))
         self.aods[aod_num-1].normal = array(new_normal)
+        self.rescattering_corrections = {}
+
+def get_wavelength_groups(wavelengths):
+    """The wavelengths rounded to the nearest 10nm, as for the refractive index tables.
+    The rescattering corrections are computed once per group."""
+    return around(array(wavelengths, dtype=dtype(float)), wavelength_group_accuracy)
+
+def get_drive_key(acoustic_drives):
+    """A hashable key equal for acoustic drives with equal values."""
+    return tuple((array(d.const).tobytes(), array(d.linear).tobytes(), array(d.quad).tobytes(), array(d.power).tobytes(), \
+                    d.velocity, d.ramp_time) for d in acoustic_drives)
+
+def calculate_drive_freq(aods, aod_spacing, order, op_wavelength, ac_velocity, base_freq, pair_deflection_ratio, focus_position, focus_velocity):
+    """The (const, linear, quad) drive coefficients of each AOD for a focus position and velocity."""
+    crystal_thickness = array([a.crystal_thickness for a in aods], dtype=dtype(float))
+
+    if len(aods) is 4:
+        (const, linear, quad) = calculate_drive_freq_4(order, op_wavelength, ac_velocity, aod_spacing, crystal_thickness, \
+                            base_freq, pair_deflection_ratio, focus_position, focus_velocity)
+    elif len(aods) is 6:
+        (const, linear, quad) = calculate_drive_freq_6(order, op_wavelength, ac_velocity, aod_spacing, crystal_thickness, \
+                            base_freq, pair_deflection_ratio, focus_position, focus_velocity)
+    else:
+        raise Exception('Unknown drive equations for number of AODs')
+    return (const, linear, quad)
 
 if __name__ == "__main__":
     import aol_model.set_up_utils as s
     rays = s.get_ray_bundle(800e-9)
     aol = s.set_up_aol(800e-9)
-    aol.plot_ray_through_aol(rays, 0, 1)
\ No newline at end of file
+    aol.plot_ray_through_aol(rays, 0, 1)
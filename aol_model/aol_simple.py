@@ -1,14 +1,16 @@
-from numpy import array, dtype, pi, concatenate, zeros, append
+from numpy import array, dtype, pi, concatenate, zeros, append, outer, floor, dot
 from acoustics import AcousticDrive
+from aol_transfer import AolTransferMatrix
 from aol_drive import get_reduced_spacings, calculate_drive_freq_4, calculate_drive_freq_6
-from error_utils import check_is_unit_vector, check_is_of_length, check_is_singleton
+from error_utils import check_is_unit_vector, check_is_of_length, check_is_singleton, checks_enabled
+from memoize import bounded_memoized
 import copy
 
 class AolSimple(object):
     """ Simplified AOL that treats AODs as thin and uses lambda*F/V to
     calculate deflection angles. Cannot calculate efficiencies. Useful for
     calculating the AOD positions in the AolFull. Can work with ray or
-    ray_paraxial. """
+    ray_paraxial, singly or as a RayBundle or RayParaxialBundle. """
     @staticmethod
     def create_aol(num_of_aods, order, op_wavelength, ac_velocity, aod_spacing, base_freq, pair_deflection_ratio, focus_position, focus_velocity, crystal_thickness=[0]*4):
         # useful for converting a 'real' aol into the simple aol
@@ -45,8 +47,9 @@ class AolSimple(object):
         self.aod_directions = array(aod_directions, dtype=dtype(float))
         self.base_ray_positions = array(base_ray_positions, dtype=dtype(float))
 
-        for d in self.aod_directions:
-            check_is_unit_vector(d)
+        if checks_enabled():
+            for d in self.aod_directions:
+                check_is_unit_vector(d)
         check_is_of_length(num_of_aods-1, self.aod_spacing)
         check_is_of_length(num_of_aods, self.acoustic_drives)
         check_is_of_length(num_of_aods, self.aod_directions)
@@ -57,20 +60,14 @@ class AolSimple(object):
 
     def find_base_ray_positions(self, op_wavelength):
         """Calculate the AOD positions for an AolFull."""
-        from ray_paraxial import RayParaxial
-        tracer_ray = RayParaxial([0,0,0], [0,0,1], op_wavelength)
+        drives = self.acoustic_drives
+        return calc_base_ray_positions(self.order, op_wavelength, self.aod_spacing, self.aod_directions, \
+                    [d.const for d in drives], [d.quad for d in drives], [d.velocity for d in drives], [d.ramp_time for d in drives])
 
-        linear = [0]*self.num_of_aods
-        for k in range(self.num_of_aods):
-            linear[k] = self.acoustic_drives[k].linear # store values
-            self.acoustic_drives[k].linear = 0
-
-        path = self.propagate_to_distance_past_aol(tracer_ray, 0)
-
-        for k in range(self.num_of_aods):
-            self.acoustic_drives[k].linear = linear[k] # restore values
-
-        return path[:-1,0:2]
+    def get_transfer_matrix(self, op_wavelength, distance=0):
+        """Precompute the affine operator that propagates paraxial rays to a
+        given distance past the AOL. Much faster than tracing for many rays or times."""
+        return AolTransferMatrix.create_from_aol(self, op_wavelength, distance)
 
     def plot_ray_through_aol(self, ray, time, distance):
         """Method to take a list of rays and plot their path through the AOL to a given distance past it. Ray states are unchanged."""
@@ -104,27 +101,67 @@ class AolSimple(object):
         plt.show()
 
     def propagate_to_distance_past_aol(self, ray, time, distance=0):
-        """Method to take a list of rays, propagate them through the AOL and then a given distance further. Ray states are changed."""
+        """Method to take a ray or a bundle of rays, propagate them through the AOL and then a given distance further.
+        Returns the path of a single ray or the (N, num_of_aods+1, 3) paths of a bundle. Ray states are changed."""
+        is_single_ray = not hasattr(ray, 'wavevectors_unit')
+        bundle = ray.to_bundle() if is_single_ray else ray
+
         spacings = append(self.aod_spacing, distance)
-        path = zeros( (self.num_of_aods + 1, 3) )
+        paths = zeros( (len(bundle), self.num_of_aods + 1, 3) )
 
         def diffract_and_propagate(aod_num):
-            path[aod_num-1,:] = ray.position
-            self.diffract_at_aod(ray, time, aod_num)
-            ray.propagate_free_space_z(spacings[aod_num-1])
+            paths[:,aod_num-1,:] = bundle.positions
+            self.diffract_at_aod(bundle, time, aod_num)
+            bundle.propagate_free_space_z(spacings[aod_num-1])
 
         for k in range(spacings.size):
             diffract_and_propagate(k + 1)
 
-        path[self.num_of_aods,:] = ray.position
-        return path
+        paths[:,self.num_of_aods,:] = bundle.positions
+        if is_single_ray:
+            bundle.copy_to_rays([ray])
+            return paths[0]
+        return paths
 
-    def diffract_at_aod(self, ray, time, aod_number):
+    def diffract_at_aod(self, bundle, time, aod_number):
         idx = aod_number-1
         aod_dir = self.aod_directions[idx]
         drive = self.acoustic_drives[idx]
 
-        local_acoustics = drive.get_local_acoustics(time, [ray.position], self.base_ray_positions[idx], aod_dir)[0] # only want singleton until class extended to support many rays
-
-        wavevector_shift = self.order * (2 * pi * local_acoustics.frequency / local_acoustics.velocity) * aod_dir
-        ray.wavevector_vac += wavevector_shift
\ No newline at end of file
+        local_acoustics = drive.get_local_acoustics(time, bundle.positions, self.base_ray_positions[idx], aod_dir)
+
+        wavevector_shifts = self.order * outer(local_acoustics.wavevector_mags, aod_dir)
+        bundle.wavevectors_vac += wavevector_shifts
+
+def calc_base_ray_positions(order, op_wavelength, aod_spacing, aod_directions, const, quad, velocities, ramp_times):
+    """The AOD positions for any number of drive configurations at once: the points
+    a paraxial tracer ray from the origin along z crosses the AODs at time 0, with
+    the linear drive terms zeroed. const and quad are (..., num_of_aods) and the
+    positions (..., num_of_aods, 2). Each AOD is stepped in closed form, replacing
+    a trace with AolSimple.propagate_to_distance_past_aol."""
+    const = array(const, dtype=dtype(float))
+    quad = zeros(const.shape) + array(quad, dtype=dtype(float))
+    directions = array(aod_directions, dtype=dtype(float))[:,0:2]
+    num_of_aods = const.shape[-1]
+
+    positions = zeros(const.shape + (2,))
+    tracer_position = zeros(const.shape[:-1] + (2,))
+    tracer_slope = zeros(const.shape[:-1] + (2,)) # x and y of the unit wavevector, whose z is 1
+    for k in range(num_of_aods):
+        positions[...,k,:] = tracer_position
+        t = - dot(tracer_position, directions[k]) / velocities[k] # as AcousticDrive.get_local_acoustics
+        if ramp_times[k] is not None:
+            t = t - floor(t/ramp_times[k] + 0.5) * ramp_times[k]
+        frequencies = const[...,k] + quad[...,k] * t**2
+        tracer_slope += order * op_wavelength / velocities[k] * frequencies[...,None] * directions[k]
+        if k < num_of_aods - 1:
+            tracer_position += tracer_slope * aod_spacing[k]
+    return positions
+
+@bounded_memoized(max_entries=4096)
+def get_base_ray_positions(order, op_wavelength, aod_spacing, aod_directions, const, quad, velocities, ramp_times):
+    """calc_base_ray_positions for one drive configuration, cached by value so
+    AOLs with the same drive and geometry share their AOD positions. Read only."""
+    positions = calc_base_ray_positions(order, op_wavelength, aod_spacing, aod_directions, const, quad, velocities, ramp_times)
+    positions.setflags(write=False)
+    return positions
@@ -0,0 +1,102 @@
+"""The aol_transfer module provides a fast path for AolSimple with paraxial rays.
+With thin AODs and linear chirps, propagation through the AOL at a fixed time is
+affine in ray position and angle, so it can be written as a 5x5 matrix acting on
+the homogeneous ray state [x, y, kx/k, ky/k, 1]. The matrix is itself affine in
+time, M(t) = M0 + t * M1, so both are precomputed once per AOL."""
+
+from numpy import array, dtype, eye, dot, outer, append, atleast_1d, einsum, ones, concatenate
+
+class AolTransferMatrix(object):
+    """The transfer operator of an AolSimple acting on paraxial rays, from the
+    plane of the first AOD to a given distance past the last AOD. Valid for
+    drives without quadratic chirp, within a single ramp period."""
+
+    @staticmethod
+    def create_from_aol(aol_simple, op_wavelength, distance=0):
+        """Helper method to build the operator from an AolSimple's aod_spacing,
+        aod_directions, base_ray_positions and drive const/linear terms."""
+        for drive in aol_simple.acoustic_drives:
+            if not drive.quad == 0:
+                raise ValueError("transfer matrix requires drives without quadratic chirp")
+
+        spacings = append(aol_simple.aod_spacing, distance)
+
+        def transfer_at_time(time):
+            matrix = eye(5)
+            for k in range(aol_simple.num_of_aods):
+                diffraction = get_diffraction_matrix(aol_simple.order, op_wavelength, aol_simple.acoustic_drives[k], \
+                                    aol_simple.aod_directions[k], aol_simple.base_ray_positions[k], time)
+                matrix = dot(get_propagation_matrix(spacings[k]), dot(diffraction, matrix))
+            return matrix
+
+        const_matrix = transfer_at_time(0.)
+        linear_matrix = transfer_at_time(1.) - const_matrix # exact because M(t) is affine in t
+        return AolTransferMatrix(const_matrix, linear_matrix, spacings.sum())
+
+    def __init__(self, const_matrix, linear_matrix, z_distance):
+        self.const_matrix = array(const_matrix, dtype=dtype(float))
+        self.linear_matrix = array(linear_matrix, dtype=dtype(float))
+        self.z_distance = z_distance
+
+    def matrix(self, time):
+        """The 5x5 transfer matrix at the given time, or a (T,5,5) stack for an array of times."""
+        times = atleast_1d(time)
+        matrices = self.const_matrix + einsum('t,ij->tij', times, self.linear_matrix)
+        return matrices[0] if array(time).ndim == 0 else matrices
+
+    def transform(self, positions, wavevectors_unit, time):
+        """Apply the operator to (N,3) positions and paraxial unit wavevectors
+        (z-component 1). Returns (positions, wavevectors_unit) of shape (N,3), or
+        (T,N,3) for an array of times."""
+        positions = array(positions, dtype=dtype(float))
+        wavevectors_unit = array(wavevectors_unit, dtype=dtype(float))
+        states = concatenate( (positions[:,0:2], wavevectors_unit[:,0:2], ones((positions.shape[0],1))), axis=1 )
+        states_out = einsum('...ij,nj->...ni', self.matrix(time), states)
+
+        positions_out = states_out[...,[0,1,4]] * 1 # take a copy before setting z
+        positions_out[...,2] = positions[:,2] + self.z_distance
+        wavevectors_out = states_out[...,[2,3,4]]
+        return (positions_out, wavevectors_out)
+
+    def propagate(self, bundle, time):
+        """Equivalent to AolSimple.propagate_to_distance_past_aol for a
+        RayParaxialBundle at a single time. Ray states are changed."""
+        (bundle.positions, bundle.wavevectors_unit) = self.transform(bundle.positions, bundle.wavevectors_unit, time)
+
+    def find_focus_distance(self):
+        """Distance past the end of the operator at which rays entering parallel
+        to the z-axis best converge. Least squares over both transverse axes."""
+        (position_block, angle_block) = (self.const_matrix[0:2,0:2], self.const_matrix[2:4,0:2])
+        return - (position_block * angle_block).sum() / (angle_block * angle_block).sum()
+
+    def find_focus_position(self, time=0):
+        """Closed form position of the focus for rays entering parallel to the
+        z-axis, in the same coordinates as AolSimple paths (first AOD at z=0)."""
+        matrix = self.matrix(time)
+        focus_distance = self.find_focus_distance()
+        xy = matrix[0:2,4] + focus_distance * matrix[2:4,4]
+        return append(xy, self.z_distance + focus_distance)
+
+    def find_focus_velocity(self):
+        """The focus moves in a straight line at constant speed, see find_focus_position."""
+        xy = self.linear_matrix[0:2,4] + self.find_focus_distance() * self.linear_matrix[2:4,4]
+        return append(xy, 0)
+
+def get_propagation_matrix(z_distance):
+    """Free space propagation of a paraxial ray through a distance in z."""
+    matrix = eye(5)
+    matrix[0,2] = z_distance
+    matrix[1,3] = z_distance
+    return matrix
+
+def get_diffraction_matrix(order, op_wavelength, drive, aod_direction, base_ray_position, time):
+    """Thin AOD deflection with frequency const + linear * (time - distance/velocity),
+    where distance is measured along the acoustic direction from the base ray position."""
+    direction = array(aod_direction[0:2], dtype=dtype(float))
+    angle_per_freq = order * op_wavelength / drive.velocity # lambda * F / V
+    freq = drive.const + drive.linear * (time + dot(base_ray_position, direction) / drive.velocity)
+
+    matrix = eye(5)
+    matrix[2:4,0:2] -= angle_per_freq * drive.linear / drive.velocity * outer(direction, direction)
+    matrix[2:4,4] += angle_per_freq * freq * direction
+    return matrix
@@ -1,18 +1,90 @@
-from numpy import array, dot
+from numpy import array, dot, arange, einsum, atleast_2d, nonzero
+import os
+
+class ValidationPolicy(object):
+    """How much checking to do. 'strict' checks every vector, 'sampled' checks
+    one in every sample_interval, 'off' checks nothing. Set the default for a
+    process with the AOL_MODEL_VALIDATION environment variable."""
+    levels = ('off', 'sampled', 'strict')
+
+    def __init__(self, level='strict', sample_interval=100):
+        self.set_level(level, sample_interval)
+
+    def set_level(self, level, sample_interval=None):
+        if level not in self.levels:
+            raise ValueError("validation level must be one of %s" % (self.levels,))
+        self.level = level
+        if sample_interval is not None:
+            self.sample_interval = sample_interval
+        self.count = 0
+
+    def should_check(self):
+        """For single checks, e.g. on setting a Ray's wavevector."""
+        if self.level == 'strict':
+            return True
+        if self.level == 'off':
+            return False
+        self.count += 1
+        return self.count % self.sample_interval == 0
+
+    def indices_to_check(self, num):
+        """For bulk checks over num rays. Sampling rotates through the rays from call to call."""
+        if self.level == 'strict':
+            return arange(num)
+        if self.level == 'off':
+            return arange(0)
+        self.count += 1
+        return arange(self.count % self.sample_interval, num, self.sample_interval)
+
+policy = ValidationPolicy(os.environ.get('AOL_MODEL_VALIDATION', 'strict'))
+
+def set_validation_level(level, sample_interval=None):
+    policy.set_level(level, sample_interval)
+
+def get_validation_level():
+    return policy.level
+
+def checks_enabled():
+    return policy.should_check()
+
+class RayValidationError(ValueError):
+    """Raised by bulk checks. The indices of the failing rays are kept on the exception."""
+    def __init__(self, message, indices):
+        ValueError.__init__(self, "%s (rays %s)" % (message, list(indices)))
+        self.indices = indices
 
 def check_is_unit_vector(vector):
     if abs(dot(vector,vector) - 1) > 1e-14:
         raise ValueError("vector must be unit length")
-    
+
+def check_are_unit_vectors(vectors):
+    """Vectorised check_is_unit_vector over the rows of an (N,3) array, following the validation policy."""
+    vectors = atleast_2d(vectors)
+    indices = policy.indices_to_check(vectors.shape[0])
+    if indices.size == 0:
+        return
+    sub = vectors[indices]
+    failed = indices[abs(einsum('ij,ij->i', sub, sub) - 1) > 1e-14]
+    if failed.size > 0:
+        raise RayValidationError("vectors must be unit length", failed)
+
+def check_all_converged(converged, message):
+    """For per-ray iterative solves. Under the 'strict' policy raise for the rays
+    not converged, otherwise the caller marks them dead. Returns their indices."""
+    failed = nonzero(~array(converged, dtype=bool))[0]
+    if failed.size > 0 and policy.level == 'strict':
+        raise RayValidationError(message, failed)
+    return failed
+
 def check_is_of_length(desired, arr):
     length = arr.shape[0]
     if not length == desired:
         raise ValueError("array has wrong size")
-    
+
 def check_is_val(var,val):
     if not var == val:
         raise ValueError("variable has wrong value")
-    
+
 def check_is_singleton(var):
     if not array(var).size == 1:
-        raise ValueError("variable is a list")
\ No newline at end of file
+        raise ValueError("variable is a list")
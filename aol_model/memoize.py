@@ -1,28 +1,151 @@
-import collections
+"""The memoize module provides the memoized decorator, a thread-safe LRU cache
+with optional bounds on the number of entries and on the bytes of numpy data
+held. Every cache keeps hit/miss/eviction/bytes counters which can be read for
+all caches at once with get_cache_stats."""
+
+from collections import OrderedDict
 import functools
+import itertools
+import threading
+import weakref
+import numpy as np
+
+max_array_key_size = 64 # numpy arguments up to this size are cached by value
+all_caches = weakref.WeakSet() # weak, so registering doesn't keep caches, e.g. of local functions, alive
+cache_ids = itertools.count()
 
 class memoized(object):
-   """Decorator. Caches a function's return value each time it is called.
-   If called later with the same arguments, the cached value is returned
-   (not reevaluated).
-   """
-   def __init__(self, func):
-      self.func = func
-      self.cache = {}
-   def __call__(self, *args):
-      if not isinstance(args, collections.Hashable):
-         # uncacheable. a list, for instance.
-         # better to not cache than blow up.
-         return self.func(*args)
-      if args in self.cache:
-         return self.cache[args]
-      else:
-         value = self.func(*args)
-         self.cache[args] = value
-         return value
-   def __repr__(self):
-      """Return the function's docstring."""
-      return self.func.__doc__
-   def __get__(self, obj, objtype):
-      """Support instance methods."""
-      return functools.partial(self.__call__, obj)
\ No newline at end of file
+    """Decorator. Caches a function's return value each time it is called.
+    If called later with the same arguments, the cached value is returned
+    (not reevaluated). Floats, tuples and small numpy arrays are keyed by value;
+    other unhashable arguments are passed through uncached.
+    Least recently used values are evicted beyond max_entries or max_bytes.
+    """
+    def __init__(self, func, max_entries=None, max_bytes=None):
+        self.func = func
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.cache = OrderedDict()
+        self.sizes = {}
+        self.lock = threading.RLock()
+        self.counters = dict(hits=0, misses=0, evictions=0, uncacheable=0, bytes=0)
+        self.__doc__ = func.__doc__
+        self.name = '%s.%s#%d' % (func.__module__, func.__name__, next(cache_ids)) # unique, see get_cache_stats
+        all_caches.add(self)
+
+    def __call__(self, *args, **kwargs):
+        key = make_key(args, kwargs)
+        if key is None: # uncacheable. better to not cache than blow up.
+            with self.lock:
+                self.counters['uncacheable'] += 1
+            return self.func(*args, **kwargs)
+
+        with self.lock:
+            if key in self.cache:
+                value = self.cache.pop(key) # reinsert to mark as most recently used
+                self.cache[key] = value
+                self.counters['hits'] += 1
+                return value
+            self.counters['misses'] += 1
+
+        value = self.func(*args, **kwargs) # not under the lock, so slow builds don't block other keys
+        self.insert(key, value)
+        return value
+
+    def insert(self, key, value):
+        size = estimate_bytes(value)
+        if self.max_bytes is not None and size > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.cache: # another thread got there first
+                return
+            self.cache[key] = value
+            self.sizes[key] = size
+            self.counters['bytes'] += size
+            while (self.max_entries is not None and len(self.cache) > self.max_entries) or \
+                  (self.max_bytes is not None and self.counters['bytes'] > self.max_bytes):
+                (old_key, _) = self.cache.popitem(last=False)
+                self.counters['bytes'] -= self.sizes.pop(old_key)
+                self.counters['evictions'] += 1
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.counters)
+            stats['entries'] = len(self.cache)
+        return stats
+
+    def clear(self):
+        with self.lock:
+            self.cache.clear()
+            self.sizes.clear()
+            self.counters['bytes'] = 0
+
+    def __repr__(self):
+        """Return the function's docstring."""
+        return self.func.__doc__
+
+    def __get__(self, obj, objtype=None):
+        """Support instance methods. The bound method is stored on the instance
+        so it is only built on the first access."""
+        if obj is None:
+            return self
+        bound = functools.partial(self.__call__, obj)
+        try:
+            obj.__dict__[self.func.__name__] = bound
+        except (AttributeError, TypeError):
+            pass
+        return bound
+
+def bounded_memoized(max_entries=None, max_bytes=None):
+    """Decorator factory, e.g. @bounded_memoized(max_entries=32)."""
+    return lambda func: memoized(func, max_entries, max_bytes)
+
+def get_cache_stats():
+    """Counters for every live memoized function, keyed by the cache's name,
+    module.function#n, which is unique even for functions of the same name."""
+    return dict((c.name, c.stats()) for c in list(all_caches))
+
+def clear_caches():
+    for c in list(all_caches):
+        c.clear()
+
+def make_key(args, kwargs):
+    """A hashable key equal for equal argument values, or None if there isn't one."""
+    try:
+        key = tuple(make_key_part(a) for a in args)
+        if kwargs:
+            key += (('kwargs',) + tuple((k, make_key_part(kwargs[k])) for k in sorted(kwargs)),)
+        hash(key)
+        return key
+    except TypeError:
+        return None
+
+def make_key_part(arg):
+    if isinstance(arg, (float, np.floating)):
+        arg = float(arg)
+        return ('nan',) if arg != arg else arg # nan != nan so would never be found
+    if isinstance(arg, np.ndarray):
+        if arg.size > max_array_key_size:
+            raise TypeError('array too large to key by value')
+        if arg.ndim == 0:
+            return make_key_part(arg[()])
+        return ('ndarray', arg.dtype.str, arg.shape, arg.tobytes())
+    if isinstance(arg, np.generic):
+        return arg.item()
+    if isinstance(arg, (tuple, list)):
+        return (type(arg).__name__,) + tuple(make_key_part(a) for a in arg)
+    return arg
+
+def estimate_bytes(value, depth=0):
+    """Bytes of numpy data held by value, looking through tuples, lists, dicts and object attributes."""
+    if depth > 4:
+        return 0
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (tuple, list)):
+        return sum(estimate_bytes(v, depth+1) for v in value)
+    if isinstance(value, dict):
+        return sum(estimate_bytes(v, depth+1) for v in value.values())
+    if hasattr(value, '__dict__'):
+        return estimate_bytes(value.__dict__, depth+1)
+    return 0
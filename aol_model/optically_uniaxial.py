@@ -1,6 +1,6 @@
 """A module providing functions useful when dealing with a uniaxial crystal, possibly with optical activity."""
 
-from numpy import array, diag, dot, atleast_1d, sqrt, power, cos, sin
+from numpy import array, atleast_1d, sqrt, power, cos, sin, stack, maximum
 
 # Follow the calculation in Xu&St Section 1.3
 # z axis is taken as direction of the optical wavevector
@@ -9,7 +9,16 @@ def calc_refractive_indices(angles, relative_impermeability_eigenvals, activity_
     """Calculate the refractive indices of a uniaxial crystal. Returns tuple:
     (n_extraordinary, n_ordinary)."""
     (sqrt_term,eigensum,_) = get_imperm_properties(angles, relative_impermeability_eigenvals, activity_vector)
+    return get_refractive_indices(sqrt_term, eigensum)
 
+def calc_refractive_indices_cos(cos_angles, relative_impermeability_eigenvals, activity_vector):
+    """As calc_refractive_indices but taking the cosines of the angles to the
+    optic axis, e.g. dot products with a unit optic axis, so no arccos is needed."""
+    transverse_imperm_eigvals = find_transverse_imperm_eigvals_cos(atleast_1d(cos_angles), relative_impermeability_eigenvals)
+    (sqrt_term,eigensum,_) = get_imperm_properties_from_eigvals(transverse_imperm_eigvals, activity_vector)
+    return get_refractive_indices(sqrt_term, eigensum)
+
+def get_refractive_indices(sqrt_term, eigensum):
     ext_recip_sqr = 0.5 * ( eigensum - sqrt_term ) # Xu&St (1.62)
     ord_recip_sqr = 0.5 * ( eigensum + sqrt_term )
 
@@ -18,11 +27,63 @@ def calc_refractive_indices(angles, relative_impermeability_eigenvals, activity_
 
     return (n_e, n_o)
 
+def calc_refractive_indices_and_gradients(angles, relative_impermeability_eigenvals, activity_vector):
+    """As calc_refractive_indices but also returns the analytic derivatives with
+    respect to angle: ((n_extraordinary, n_ordinary), (dn_e/dangle, dn_o/dangle))."""
+    angles = atleast_1d(angles)
+    (_, b_y, b_z) = relative_impermeability_eigenvals
+    imperm_properties = get_imperm_properties(angles, relative_impermeability_eigenvals, activity_vector)
+    eigenval2_gradient = (b_z - b_y) * sin(2 * angles) # eigenval1 is independent of angle
+    return get_refractive_indices_and_gradients(imperm_properties, eigenval2_gradient)
+
+def calc_refractive_indices_and_gradients_cos(cos_angles, relative_impermeability_eigenvals, activity_vector):
+    """As calc_refractive_indices_and_gradients but taking the cosines of angles in [0, pi]."""
+    cos_angles = atleast_1d(cos_angles)
+    (_, b_y, b_z) = relative_impermeability_eigenvals
+    transverse_imperm_eigvals = find_transverse_imperm_eigvals_cos(cos_angles, relative_impermeability_eigenvals)
+    imperm_properties = get_imperm_properties_from_eigvals(transverse_imperm_eigvals, activity_vector)
+    sine = sqrt(maximum((1 - cos_angles) * (1 + cos_angles), 0))
+    eigenval2_gradient = (b_z - b_y) * 2 * sine * cos_angles
+    return get_refractive_indices_and_gradients(imperm_properties, eigenval2_gradient)
+
+def get_refractive_indices_and_gradients(imperm_properties, eigenval2_gradient):
+    (sqrt_term, eigensum, eigendiff) = imperm_properties
+    sqrt_term_gradient = eigendiff * eigenval2_gradient / sqrt_term
+
+    ext_recip_sqr = 0.5 * ( eigensum - sqrt_term ) # Xu&St (1.62)
+    ord_recip_sqr = 0.5 * ( eigensum + sqrt_term )
+    ext_recip_sqr_gradient = 0.5 * ( eigenval2_gradient - sqrt_term_gradient )
+    ord_recip_sqr_gradient = 0.5 * ( eigenval2_gradient + sqrt_term_gradient )
+
+    n_e = power(ext_recip_sqr, -0.5)
+    n_o = power(ord_recip_sqr, -0.5)
+    dn_e = -0.5 * power(ext_recip_sqr, -1.5) * ext_recip_sqr_gradient
+    dn_o = -0.5 * power(ord_recip_sqr, -1.5) * ord_recip_sqr_gradient
+
+    return ((n_e, n_o), (dn_e, dn_o))
+
+def calc_internal_sines(external_sines, relative_impermeability_eigenvals, activity_vector, polarisation, iterations=20):
+    """Refraction into a crystal whose optic axis is along the surface normal:
+    the sines of the internal angles solving n(internal) * internal_sine = external_sine
+    for the given polarisation, 0 for extraordinary, 1 for ordinary. Newton's method
+    with the analytic gradient, run for a fixed number of iterations."""
+    external_sines = atleast_1d(external_sines)
+    args = (relative_impermeability_eigenvals, activity_vector)
+    internal_sines = external_sines / calc_refractive_indices_cos(1., *args)[polarisation]
+    for _ in range(iterations):
+        cosines = sqrt((1 - internal_sines) * (1 + internal_sines))
+        (n, n_gradient) = [v[polarisation] for v in calc_refractive_indices_and_gradients_cos(cosines, *args)]
+        internal_sines = internal_sines - (n * internal_sines - external_sines) / (n + internal_sines * n_gradient / cosines)
+    return internal_sines
+
 def get_imperm_properties(angles, relative_impermeability_eigenvals, activity_vector):
     """Calculate relative impermeability properties of a uniaxial crystal
     needed to calculate the refractive indices."""
     angles = atleast_1d(angles)
     transverse_imperm_eigvals = find_transverse_imperm_eigvals(angles, relative_impermeability_eigenvals)
+    return get_imperm_properties_from_eigvals(transverse_imperm_eigvals, activity_vector)
+
+def get_imperm_properties_from_eigvals(transverse_imperm_eigvals, activity_vector):
     eigenval1 = transverse_imperm_eigvals[:,0]
     eigenval2 = transverse_imperm_eigvals[:,1]
 
@@ -33,10 +94,23 @@ def get_imperm_properties(angles, relative_impermeability_eigenvals, activity_ve
     return (sqrt_term, eigensum, eigendiff)
 
 def find_transverse_imperm_eigvals(angles, relative_impermeability_eigenvals):
-    principal_imperm = diag(relative_impermeability_eigenvals)
-    rotation_matrix = get_yz_rotation_matrix(angles)
-    relative_impermeability_matrix = array([dot(dot(rot,principal_imperm),rot.T) for rot in rotation_matrix]) # Xu&St (1.59)
-    return array([[x[0,0],x[1,1]] for x in relative_impermeability_matrix]) # eigenvals for transverse components
+    """Diagonal transverse components of R B R.T (Xu&St (1.59)) for B the principal
+    impermeability and R the rotation about x given by get_yz_rotation_matrix.
+    Written out in closed form: B[0,0] is unchanged and B[1,1] mixes the y and z
+    eigenvalues by cos^2 and sin^2 of the angle."""
+    (b_x, b_y, b_z) = relative_impermeability_eigenvals
+    (cosine, sine) = (cos(angles), sin(angles))
+    eigval_x = b_x + 0 * cosine
+    eigval_y = (cosine * b_y) * cosine + (sine * b_z) * sine # same order of operations as the matrix product
+    return stack((eigval_x, eigval_y), axis=-1) # eigenvals for transverse components
+
+def find_transverse_imperm_eigvals_cos(cos_angles, relative_impermeability_eigenvals):
+    """As find_transverse_imperm_eigvals, with sin^2 taken as 1 - cos^2."""
+    (b_x, b_y, b_z) = relative_impermeability_eigenvals
+    cos_sqr = cos_angles * cos_angles
+    eigval_x = b_x + 0 * cos_sqr
+    eigval_y = b_y * cos_sqr + b_z * (1 - cos_sqr)
+    return stack((eigval_x, eigval_y), axis=-1)
 
 def get_yz_rotation_matrix(angles):
     return array([[ [1,     0,       0  ], \
@@ -1,6 +1,6 @@
 """The optimise_aol module is useful to calculate the correct orientation of each AOD in an AOL."""
 
-from numpy import arange, linspace, pi, arctan2, array, cos, sin, sqrt, append
+from numpy import arange, linspace, pi, arctan2, array, cos, sin, sqrt, append, mean
 from numpy.linalg import norm
 from scipy import optimize
 from aod_visualisation import generic_plot_surface
@@ -87,18 +87,9 @@ def calculate_efficiency(aol, after_nth_aod, op_wavelength=op_wavelength):
     the (after_nth_aod) AOD."""
 
     time_array = (arange(3)-1)*5e-5
-
-    energy = 0
-    ray_count = 0
-
-    for t in time_array:
-        rays = get_ray_bundle(op_wavelength)
-
-        (_,energies) = aol.propagate_to_distance_past_aol(rays, t) 
-        energy += sum(energies[:,after_nth_aod-1])
-        ray_count += len(rays)
-
-    return energy / ray_count
+    rays = get_ray_bundle(op_wavelength)
+    energies = aol.propagate(rays, time_array, record=('energies',))['energies'] # all times in one pass
+    return mean(energies[:,:,after_nth_aod-1])
 
 def get_best_pdr_x(pdr, ang):
     aol = set_up_aol(op_wavelength, base_freq=base_freq, pair_deflection_ratio=pdr, focus_position=[ang*3.14159/180*1e9,0,1e9])
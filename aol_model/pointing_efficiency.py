@@ -1,6 +1,6 @@
 from plot_utils import multi_line_plot_vals
-from numpy import linspace, shape, pi, array, meshgrid, arange, prod, transpose, power, max
-from set_up_utils import get_ray_bundle, set_up_aol6
+from numpy import linspace, shape, pi, array, meshgrid, arange, prod, transpose, power, max, mean
+from set_up_utils import get_ray_bundle, set_up_aol6_batch
 import matplotlib.pyplot as plt
 from matplotlib import rcParams as r
 r.update({'font.size': 24})
@@ -90,22 +90,18 @@ def generate_plot(normalised_img, description, colmap=plt.cm.bone, pdr_z=None):
 def get_effs(focus_position_many, pdr):
     #get eff for a 2d array for focus positions (so 3d array input)
     shp = focus_position_many.shape[0:2]
-    aols = [set_up_aol6(op_wavelength, focus_position=f, base_freq=base_freq, pair_deflection_ratio=pdr) for f in focus_position_many.reshape(prod(shp), 3)]
-    effs = [calculate_efficiency(a) for a in aols]
-    return array(effs).reshape(shp)
+    batch = set_up_aol6_batch(op_wavelength, focus_position_many.reshape(prod(shp), 3), base_freq=base_freq, pair_deflection_ratio=pdr)
+    time_array = (arange(3)-1)*1e-7
+    rays = get_ray_bundle(op_wavelength)
+    final_energies = batch.propagate(rays, time_array, 0)['final_energies'] # all positions and times in one pass
+    effs = power(mean(final_energies, axis=(0,2)), 2)
+    return effs.reshape(shp)
 
 def calculate_efficiency(aol):
     time_array = (arange(3)-1)*1e-7
-    energy = 0
-    ray_count = 0
-
-    for time in time_array:
-        rays = get_ray_bundle(op_wavelength)
-        (_,energies) = aol.propagate_to_distance_past_aol(rays, time, 0)
-        energy += sum(energies[:,-1])
-        ray_count += len(rays)
-
-    return power(energy / ray_count, 2)
+    rays = get_ray_bundle(op_wavelength)
+    final_energies = aol.propagate(rays, time_array, 0)['final_energies'] # all times in one pass
+    return power(mean(final_energies), 2)
 
 if __name__ == '__main__':
     effs = plot_fov_surf(1e9, 1)
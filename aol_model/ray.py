@@ -1,4 +1,5 @@
-from error_utils import check_is_unit_vector
+from error_utils import check_is_unit_vector, checks_enabled
+from ray_bundle import RayBundle
 from numpy import pi, array, dot, dtype, concatenate
 from numpy.linalg import norm
 
@@ -15,7 +16,8 @@ class Ray(object):
         return self._wavevector_unit
     @wavevector_unit.setter
     def wavevector_unit(self, v):
-        check_is_unit_vector(v) # useful for error checking but slow!
+        if checks_enabled(): # useful for error checking but slow, see error_utils.policy
+            check_is_unit_vector(v)
         self._wavevector_unit = array(v, dtype=dtype(float))
 
     @property
@@ -33,6 +35,10 @@ class Ray(object):
         self.wavevector_vac_mag = norm(v)
         self.wavevector_unit = array(v, dtype=dtype(float)) / self.wavevector_vac_mag
 
+    def to_bundle(self):
+        """A RayBundle holding only this ray."""
+        return RayBundle.from_rays([self])
+
     def propagate_free_space(self, distance):
         self.position += self.wavevector_unit * distance
 
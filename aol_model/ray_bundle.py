@@ -0,0 +1,109 @@
+"""The ray_bundle module contains the RayBundle class, a structure-of-arrays
+alternative to a list of Ray objects. The AolFull pipeline (AolFull, Aod and
+xu_stroud_model) works on RayBundles internally; lists of Ray objects are
+converted on the way in and written back on the way out."""
+
+from numpy import pi, array, dtype, dot, zeros, ones, atleast_1d, atleast_2d, concatenate
+from numpy.linalg import norm
+import copy
+
+array_attributes = ['positions', 'wavevectors_unit', 'wavevectors_vac_mag', 'energies', 'rescatter'] # one row per ray
+
+class RayBundle(object):
+    """Many rays, free from paraxial assumptions. Positions and unit wavevectors
+    are held as (N,3) arrays; vacuum wavevector magnitudes, energies and
+    rescattering terms as (N,) arrays. The rescattering terms are None when
+    they have not been computed, see xu_stroud_model.diffract_acousto_optically."""
+
+    @classmethod
+    def from_rays(cls, rays):
+        """Helper method to gather a list of Ray objects into a RayBundle."""
+        bundle = cls([r.position for r in rays], [r.wavevector_unit for r in rays], \
+                           [r.wavelength_vac for r in rays], [r.energy for r in rays])
+        bundle.rescatter = array([getattr(r, 'resc', 0) for r in rays], dtype=dtype(float))
+        return bundle
+
+    def __init__(self, positions, wavevectors_unit, wavelengths, energies=1):
+        self.positions = array(atleast_2d(positions), dtype=dtype(float))
+        self.wavevectors_unit = array(atleast_2d(wavevectors_unit), dtype=dtype(float))
+        num_rays = self.positions.shape[0]
+        self.wavevectors_vac_mag = 2 * pi / atleast_1d(array(wavelengths, dtype=dtype(float))) * ones(num_rays)
+        self.energies = array(energies, dtype=dtype(float)) * ones(num_rays)
+        self.rescatter = zeros(num_rays)
+
+    def __len__(self):
+        return self.positions.shape[0]
+
+    @property
+    def wavelengths_vac(self):
+        return 2 * pi / self.wavevectors_vac_mag
+
+    @property
+    def wavevectors_vac(self):
+        return (self.wavevectors_vac_mag * self.wavevectors_unit.T).T
+    @wavevectors_vac.setter
+    def wavevectors_vac(self, v):
+        self.wavevectors_vac_mag = norm(v, axis=1)
+        self.wavevectors_unit = (array(v, dtype=dtype(float)).T / self.wavevectors_vac_mag).T
+
+    def copy_to_rays(self, rays):
+        """Write the bundle state back onto a list of Ray objects of the same length."""
+        for (r, p, u, m, e) in zip(rays, self.positions, self.wavevectors_unit, \
+                                   self.wavevectors_vac_mag, self.energies):
+            r.position = p.copy()
+            r.wavevector_unit = u
+            r.wavevector_vac_mag = m
+            r.energy = e
+        if self.rescatter is not None:
+            for (r, resc) in zip(rays, self.rescatter):
+                r.resc = resc
+
+    def take(self, indices):
+        """A new bundle of copies of the rays at the given indices (or boolean mask)."""
+        bundle = copy.copy(self)
+        for name in array_attributes:
+            value = getattr(self, name)
+            setattr(bundle, name, None if value is None else value[indices])
+        return bundle
+
+    def propagate_free_space(self, distances):
+        self.positions += (self.wavevectors_unit.T * distances).T
+
+    def propagate_to_plane(self, points_on_plane, normal_to_plane):
+        from_rays_to_points = points_on_plane - self.positions
+        distances = dot(from_rays_to_points, normal_to_plane) / dot(self.wavevectors_unit, normal_to_plane)
+        self.propagate_free_space(distances)
+
+    def propagate_from_plane_to_plane(self, plane_z_separation, normal_to_first, normal_to_second):
+        """Move rays from one plane to the next. Vectorised form of Ray.propagate_from_plane_to_plane."""
+        points_on_first_plane = self.positions
+        z_displacements_from_points_to_origin = dot(points_on_first_plane[:,0:2], normal_to_first[0:2]) / normal_to_first[2]
+        displacements_from_points_to_origin = concatenate( (-points_on_first_plane[:,0:2], atleast_2d(z_displacements_from_points_to_origin).T), axis=1 )
+
+        # assumes all AODs are rotated about (x,y)=(0,0), as in Ray
+        points_on_second_plane = points_on_first_plane + displacements_from_points_to_origin + [0,0,plane_z_separation]
+        self.propagate_to_plane(points_on_second_plane, normal_to_second)
+
+    def propagate_free_space_z(self, distance):
+        """Move rays a given distance in the z-direction. Used only in AolSimple. """
+        self.propagate_to_plane(self.positions + [0,0,distance], [0,0,1])
+
+def concatenate_bundles(bundles):
+    """One bundle of all the rays in a list of bundles of the same type. The
+    rescattering terms are kept only if every bundle has them."""
+    bundle = copy.copy(bundles[0])
+    for name in array_attributes:
+        values = [getattr(b, name) for b in bundles]
+        setattr(bundle, name, None if any(v is None for v in values) else concatenate(values))
+    return bundle
+
+def as_ray_bundle(rays):
+    """Return rays unchanged if already a RayBundle, else gather the list of Ray objects into one."""
+    if hasattr(rays, 'wavevectors_unit'): # duck type rather than isinstance, module may be imported under two names
+        return rays
+    return RayBundle.from_rays(rays)
+
+def update_rays(rays, bundle):
+    """Counterpart of as_ray_bundle: write the bundle back if rays was a list of Ray objects."""
+    if rays is not bundle:
+        bundle.copy_to_rays(rays)
@@ -1,5 +1,6 @@
 from numpy import pi, array, dtype
-from error_utils import check_is_val
+from error_utils import check_is_val, checks_enabled
+from ray_bundle import RayBundle
 
 class RayParaxial(object):
     """A simplified ray whose angle to [0,0,1] (z-axis) is assumed to be small. """
@@ -14,7 +15,8 @@ class RayParaxial(object):
         return self._wavevector_unit
     @wavevector_unit.setter
     def wavevector_unit(self, v):
-        check_is_val(v[2], 1)
+        if checks_enabled():
+            check_is_val(v[2], 1)
         self._wavevector_unit = array(v, dtype=dtype(float))
 
     @property
@@ -31,7 +33,27 @@ class RayParaxial(object):
     def wavevector_vac(self, v):
         self.wavevector_unit[0:2] = array(v[0:2]) / self.wavevector_vac_mag
 
+    def to_bundle(self):
+        """A RayParaxialBundle holding only this ray."""
+        return RayParaxialBundle.from_rays([self])
+
     def propagate_free_space_z(self, distance):
         """Move the ray in the direction of its wavevector such that it travels
         a given distance in z."""
         self.position += self.wavevector_unit * distance
+
+class RayParaxialBundle(RayBundle):
+    """Many RayParaxial rays held as arrays. Unit wavevectors keep a z-component
+    of 1 so only their x and y components change on diffraction."""
+
+    @property
+    def wavevectors_vac(self):
+        return (self.wavevectors_vac_mag * self.wavevectors_unit.T).T
+    @wavevectors_vac.setter
+    def wavevectors_vac(self, v):
+        self.wavevectors_unit[:,0:2] = (array(v)[:,0:2].T / self.wavevectors_vac_mag).T
+
+    def propagate_free_space_z(self, distance):
+        """Move the rays in the direction of their wavevectors such that they
+        travel a given distance in z."""
+        self.positions += self.wavevectors_unit * distance
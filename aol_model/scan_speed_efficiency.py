@@ -1,7 +1,7 @@
 from numpy import linspace, pi, sin, cos, array, arctan2, meshgrid
 from numpy.linalg import norm
 from aol_model.set_up_utils import get_ray_bundle, set_up_aol
-from aol_model.plot_utils import multi_line_plot, generic_plot_surface_vals
+from aol_model.plot_utils import multi_line_plot_vals, generic_plot_surface_vals
 
 op_wavelength = 920e-9
 scan_ang = 70e-3
@@ -16,10 +16,9 @@ def plot_lines(focal_length, dwell_many_ns):
 
     labels = ["scan angle / deg", "efficiency"]
     lgnd = dwell_many_ns.astype(int)
-    multi_line_plot(scan_deg, funcs, labels, lgnd, (min(scan_deg),max(scan_deg),0,0.3))
+    multi_line_plot_vals(scan_deg, [func(scan_deg) for func in funcs], labels, lgnd, (min(scan_deg),max(scan_deg),0,0.3))
 
 def plot_fov_surf(focal_length, vel):
-    from numpy import vectorize
     orthogonal_deg = scan_range_rad * 180/pi
     orthogonal_distance = focal_length * scan_deg * pi/180
     scan_angle = arctan2(vel[1], vel[0])
@@ -28,8 +27,7 @@ def plot_fov_surf(focal_length, vel):
     for dist in orthogonal_distance:
         focus_position = dist * array([-sin(scan_angle), cos(scan_angle), 0]) + [0,0,focal_length]
         func = create_efficiency_function_closure(focus_position, vel)
-        vec_func = vectorize(func)
-        effs.append(vec_func(scan_deg))
+        effs.append(func(scan_deg))
 
     labels = ["xangle / deg", "yangle / deg", "efficiency"]
     (x, y) = get_xy(scan_angle, scan_deg, orthogonal_deg)
@@ -52,13 +50,9 @@ def create_efficiency_function_closure(focus_position_tzero, focus_velocity):
     return func
 
 def calculate_efficiency(aol, time):
+    """Mean efficiency over the ray bundle at a time, or at each of an array of times in one pass."""
     rays = get_ray_bundle(op_wavelength)
-
-    (_,energies) = aol.propagate_to_distance_past_aol(rays, time, 0)
-    energy = sum(energies[:,-1])
-    ray_count = len(rays)
-
-    return energy / ray_count
+    return aol.propagate(rays, time, 0)['final_energies'].mean(axis=-1)
 
 if __name__ == '__main__':
     f = 0.4
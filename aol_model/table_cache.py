@@ -0,0 +1,59 @@
+"""The table_cache module stores lookup tables on disk as .npy files so that new
+processes can memory-map them read-only instead of rebuilding them. Many worker
+processes mapping the same file share one copy in the page cache.
+
+The cache directory is taken from the AOL_MODEL_CACHE_DIR environment variable,
+defaulting to ~/.cache/aol_model. Use set_cache_dir(None) to disable the cache."""
+
+from numpy import save, load as load_npy
+import hashlib
+import os
+
+cache_format_version = 2 # 2: refraction maps no longer hold the unused ordinary in map
+cache_dir = os.environ.get('AOL_MODEL_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'aol_model'))
+
+def set_cache_dir(path):
+    global cache_dir
+    cache_dir = path
+
+def get_cache_dir():
+    return cache_dir
+
+def make_key(name, *params):
+    """A file name safe key from a table name and the floats it depends on."""
+    description = '%s v%d %s' % (name, cache_format_version, ' '.join(['%r' % float(p) for p in params]))
+    return name + '_' + hashlib.sha1(description.encode('ascii')).hexdigest()[0:16]
+
+def get_path(key, array_name):
+    return os.path.join(cache_dir, '%s_%s.npy' % (key, array_name))
+
+def load(key, array_names):
+    """Memory-map the named arrays stored under key, or return None if any is missing."""
+    if cache_dir is None:
+        return None
+    try:
+        return [load_npy(get_path(key, n), mmap_mode='r') for n in array_names]
+    except (IOError, OSError, ValueError): # missing, partially written or unreadable
+        return None
+
+def store(key, arrays):
+    """Write a dict of named arrays under key. Each file is written to a temporary
+    name and renamed into place, so readers never see a partial file. Failures
+    are ignored since the cache is only an optimisation."""
+    if cache_dir is None:
+        return
+    if not os.path.isdir(cache_dir):
+        try:
+            os.makedirs(cache_dir)
+        except OSError: # may have been created by another process in the meantime
+            if not os.path.isdir(cache_dir):
+                return
+    try:
+        for (n, arr) in arrays.items():
+            path = get_path(key, n)
+            tmp_path = '%s.%d.tmp' % (path, os.getpid())
+            with open(tmp_path, 'wb') as f:
+                save(f, arr)
+            os.rename(tmp_path, path)
+    except (IOError, OSError):
+        pass
@@ -1,49 +1,246 @@
 """The teo2 module contains functions for calculating the refractive indices of
 TeO2 (paratellurite) from the parameters given in Uchida 1971."""
 
-from scipy.interpolate import splrep, splev
 from scipy.constants import h, c, e, pi
 import optically_uniaxial as oua
 from numpy import power, arange, array, sqrt
 import numpy as np
-from memoize import memoized
+from memoize import bounded_memoized
+from uniform_table import UniformTable, get_cubic_coeffs
+import table_cache
 import matplotlib.pyplot as plt
 
 accuracy = 8
+table_wavelength_tolerance = 1e-14 # relative. Wavelengths this close to a multiple of 10nm use its tables, see group_by_table
+table_step = 1e-4
+table_is_cubic = True # cubic tables match the exact indices to ~2e-15, linear to ~4e-10
+cos_table_max = 0.75 # the cos keyed tables cover sin and |cos| in [0, cos_table_max], just over 1/sqrt(2)
 
 def calc_refractive_indices(angles, wavelength_vac):
     """Calculate the extraordinary and ordinary refractive indices at the given
-    wavelength and angle to the optic axis.
+    wavelength and angle to the optic axis. The wavelength may be a single value
+    or one per angle.
     This is the most called function in the model so a look-up table is
-    memoized for each group of wavelengths. The wavelength groups are given
-    to the nearest 10nm."""
-    wavelength_vac_rounded = np.round(wavelength_vac, accuracy) # to nearest 10nm
-    (n_e, n_o) = ref_ind_lookup(wavelength_vac_rounded)
-    return (splev(abs(angles),n_e),splev(abs(angles),n_o))
-
-@memoized
-def ref_ind_lookup(wavelength_vac_rounded):
-    angles_stored = arange(0, pi/2+1e-4, 1e-4)
-    n_fixed_wavelength = oua.calc_refractive_indices(angles_stored, \
-        get_relative_impermeability_eigenvals(wavelength_vac_rounded), get_activity_vector(wavelength_vac_rounded))
-    return (splrep(angles_stored, n_fixed_wavelength[0]), splrep(angles_stored, n_fixed_wavelength[1]))
+    memoized for each wavelength on a 10nm grid. Rays at other wavelengths use
+    the continuous surface, see evaluate_per_ray."""
+    lookup = lambda tables, keys: array([t(keys) for t in tables])
+    exact = lambda keys, wavelengths: array(oua.calc_refractive_indices(keys, *get_material_constants(wavelengths)))
+    return tuple(evaluate_per_ray(wavelength_vac, abs(angles), 'angle', lookup, exact))
+
+def calc_refractive_indices_and_gradients(angles, wavelength_vac):
+    """As calc_refractive_indices but also returns the derivatives with respect
+    to angle, ((n_e, n_o), (dn_e/dangle, dn_o/dangle)). The derivatives are
+    those of the table interpolant (or of the closed form surface), so come
+    from the same lookup as the values."""
+    lookup = lambda tables, keys: np.swapaxes(array([t.value_and_derivative(keys) for t in tables]), 0, 1)
+    exact = lambda keys, wavelengths: array(oua.calc_refractive_indices_and_gradients(keys, *get_material_constants(wavelengths)))
+    ((n_e, n_o), (dn_e, dn_o)) = evaluate_per_ray(wavelength_vac, abs(angles), 'angle', lookup, exact)
+    return ((n_e, n_o), (np.sign(angles) * dn_e, np.sign(angles) * dn_o)) # tables are in abs(angles)
+
+def calc_refractive_indices_cos(cos_angles, wavelength_vac):
+    """As calc_refractive_indices but taking the cosines of the angles to the
+    optic axis, e.g. dot products with the unit optic axis. This avoids an arccos
+    per lookup, which also loses precision near the axis."""
+    lookup = lambda tables, keys: array(lookup_cos_tables(tables, keys, False)[0])
+    exact = lambda keys, wavelengths: array(oua.calc_refractive_indices_cos(keys, *get_material_constants(wavelengths)))
+    return tuple(evaluate_per_ray(wavelength_vac, cos_angles, 'cos', lookup, exact))
+
+def calc_refractive_indices_and_gradients_cos(cos_angles, wavelength_vac):
+    """As calc_refractive_indices_and_gradients but taking the cosines of angles
+    in [0, pi], see calc_refractive_indices_cos."""
+    lookup = lambda tables, keys: array(lookup_cos_tables(tables, keys, True))
+    exact = lambda keys, wavelengths: array(oua.calc_refractive_indices_and_gradients_cos(keys, *get_material_constants(wavelengths)))
+    ((n_e, n_o), (dn_e, dn_o)) = evaluate_per_ray(wavelength_vac, cos_angles, 'cos', lookup, exact)
+    return ((n_e, n_o), (dn_e, dn_o))
+
+def lookup_cos_tables(tables, cos_angles, with_gradients):
+    """Evaluate the tables from ref_ind_lookup(..., keyed_on='cos'). Within 45 degrees
+    of the axis the indices are looked up by sin = sqrt((1 - cos)(1 + cos)), which
+    is accurate near the axis where the indices change fastest in cos, and elsewhere
+    by |cos|. Returns ((n_e, n_o), (dn_e/dangle, dn_o/dangle) or None)."""
+    cos_angles = np.asarray(cos_angles, dtype=np.dtype(float))
+    abs_cos = abs(cos_angles)
+    sines = sqrt(np.maximum((1 - abs_cos) * (1 + abs_cos), 0))
+    near_axis = abs_cos >= sines
+    regions = [(0, sines, cos_angles), (2, abs_cos, -np.sign(cos_angles) * sines)] # table offset, key, d(key)/dangle
+
+    if near_axis.all() or not near_axis.any():
+        (offset, keys, key_gradients) = regions[0] if near_axis.all() else regions[1]
+        if not with_gradients:
+            return ((tables[offset](keys), tables[offset+1](keys)), None)
+        ((n_e, dn_e), (n_o, dn_o)) = [t.value_and_derivative(keys) for t in tables[offset:offset+2]]
+        return ((n_e, n_o), (dn_e * key_gradients, dn_o * key_gradients))
+
+    indices = np.empty((2,) + cos_angles.shape)
+    gradients = np.empty((2,) + cos_angles.shape) if with_gradients else None
+    for ((offset, keys, key_gradients), region) in zip(regions, [near_axis, ~near_axis]):
+        for k in range(2):
+            if with_gradients:
+                (indices[k][region], gradients[k][region]) = tables[offset+k].value_and_derivative(keys[region])
+                gradients[k][region] *= key_gradients[region]
+            else:
+                indices[k][region] = tables[offset+k](keys[region])
+    return ((indices[0], indices[1]), None if gradients is None else (gradients[0], gradients[1]))
+
+def evaluate_per_ray(wavelength_vac, keys, keyed_on, lookup, exact):
+    """Evaluate each key at its own wavelength, one wavelength or one per key:
+    lookup(tables, keys) for keys whose wavelength has tables, see group_by_table,
+    and exact(keys, wavelengths) on the continuous surface for the rest. Both
+    return arrays whose last axis is the keys. The backend for a key depends only
+    on its own wavelength and the two agree to ~2e-15, so results do not depend
+    on the other wavelengths in a bundle."""
+    keys = np.asarray(keys, dtype=np.dtype(float))
+    (groups, off_table) = group_by_table(wavelength_vac, keyed_on)
+    if len(groups) == 1 and not off_table.any():
+        return lookup(groups[0][0], keys) # the usual case, one table wavelength
+
+    (keys, wavelengths) = np.broadcast_arrays(keys, np.asarray(wavelength_vac, dtype=np.dtype(float)))
+    masks = [np.broadcast_to(mask, keys.shape) for (_, mask) in groups]
+    parts = [(lookup(tables, keys[mask]), mask) for ((tables, _), mask) in zip(groups, masks)]
+    if off_table.any():
+        off_table = np.broadcast_to(off_table, keys.shape)
+        parts.append((exact(keys[off_table], wavelengths[off_table]), off_table))
+    result = np.empty(parts[0][0].shape[:-1] + keys.shape)
+    for (values, mask) in parts:
+        result[..., mask] = values
+    return result
+
+def group_by_table(wavelength_vac, keyed_on='angle'):
+    """Group wavelengths, one or one per ray, by the memoized tables they use:
+    ([(tables, mask)], off_table_mask). Only wavelengths on the 10nm grid, to within
+    table_wavelength_tolerance, have tables. The masks have the shape of wavelength_vac."""
+    wavelengths = np.asarray(wavelength_vac, dtype=np.dtype(float))
+    rounded = np.round(wavelengths, accuracy) # to nearest 10nm
+    on_table = abs(wavelengths - rounded) <= table_wavelength_tolerance * rounded
+    groups = [(ref_ind_lookup(w, table_is_cubic, keyed_on), on_table & (rounded == w)) for w in np.unique(rounded[on_table])]
+    return (groups, ~on_table)
+
+def get_material_constants(wavelengths):
+    """The impermeability eigenvalues and activity at each wavelength, evaluated once per distinct wavelength."""
+    (unique_wavelengths, indices) = np.unique(wavelengths, return_inverse=True)
+    eigenvals = get_relative_impermeability_eigenvals(unique_wavelengths)
+    return (eigenvals[:, indices], get_activity_vector(unique_wavelengths)[indices])
+
+def calc_refractive_indices_surface(angles, wavelength_vac):
+    """The refractive indices as a continuous function of both angle and
+    wavelength, evaluated in closed form from get_relative_impermeability_eigenvals
+    and get_activity_vector at each wavelength. No grouping or interpolation,
+    so small wavelength differences such as Doppler shifts are kept."""
+    return oua.calc_refractive_indices(abs(angles), \
+        get_relative_impermeability_eigenvals(wavelength_vac), get_activity_vector(wavelength_vac))
+
+@bounded_memoized(max_entries=32, max_bytes=256 * 2**20) # each table is ~1MB, so sweeps stay bounded
+def ref_ind_lookup(wavelength_vac_rounded, cubic=True, keyed_on='angle'):
+    """Uniform tables of (n_e, n_o) against angle, see uniform_table. The cubic
+    tables reproduce the splrep/splev splines previously used here to rounding
+    error while evaluating in O(1) per angle.
+    With keyed_on='cos' there are four tables, (n_e, n_o) against sin of the
+    angle then (n_e, n_o) against |cos|, see lookup_cos_tables.
+    With keyed_on='refraction' there are three refraction maps for a crystal
+    with its optic axis along the surface normal: the internal sine against the
+    external sine of the angle to the normal for extraordinary light refracting
+    in, then the external sine against the internal sine for (extraordinary,
+    ordinary) light refracting out. The model only refracts extraordinary light
+    in, see Aod.refract_in. The maps have error ~1e-15.
+    Tables are memory-mapped from the on-disk table_cache where possible."""
+    key = get_table_key(wavelength_vac_rounded, cubic, keyed_on)
+    array_names = get_array_names(cubic)
+    stored = table_cache.load(key, array_names)
+    if stored is None:
+        stored = build_ref_ind_tables(wavelength_vac_rounded, cubic, keyed_on)
+        table_cache.store(key, dict(zip(array_names, stored)))
+
+    if cubic:
+        return tuple(UniformTable.from_coeffs(0, table_step, c) for c in stored[0])
+    return tuple(UniformTable(0, table_step, v, False) for v in stored[0])
+
+def get_array_names(cubic):
+    """Only the arrays that evaluation reads are stored: the coefficients of cubic tables or the values of linear ones."""
+    return ['coeffs'] if cubic else ['values']
+
+def build_ref_ind_tables(wavelength_vac_rounded, cubic=True, keyed_on='angle'):
+    """Returns [values] for linear tables, the (2,N) array of (n_e, n_o) on the
+    angle grid, or (4,N) on the sin and |cos| grids, or the (3,N) refraction maps
+    on the sine grid. For cubic tables returns [coeffs], their (2, 3 or 4,4,N-1)
+    coefficients, see get_array_names."""
+    eigenvals = get_relative_impermeability_eigenvals(wavelength_vac_rounded)
+    activity = get_activity_vector(wavelength_vac_rounded)
+    if keyed_on == 'angle':
+        angles_stored = arange(0, pi/2+table_step, table_step)
+        values = array(oua.calc_refractive_indices(angles_stored, eigenvals, activity))
+    elif keyed_on == 'cos':
+        keys_stored = arange(0, cos_table_max+table_step, table_step)
+        cos_for_sines = sqrt((1 - keys_stored) * (1 + keys_stored))
+        values = array(oua.calc_refractive_indices_cos(cos_for_sines, eigenvals, activity) \
+                     + oua.calc_refractive_indices_cos(keys_stored, eigenvals, activity))
+    elif keyed_on == 'refraction':
+        sines_stored = np.minimum(arange(int(round(1 / table_step)) + 1) * table_step, 1)
+        cos_for_sines = sqrt((1 - sines_stored) * (1 + sines_stored))
+        values = array([oua.calc_internal_sines(sines_stored, eigenvals, activity, 0)] \
+                     + [n * sines_stored for n in oua.calc_refractive_indices_cos(cos_for_sines, eigenvals, activity)])
+    else:
+        raise ValueError("tables are keyed on 'angle', 'cos' or 'refraction'")
+    if not cubic:
+        return [values]
+    return [array([get_cubic_coeffs(table_step, v) for v in values])]
+
+def get_table_key(wavelength_vac_rounded, cubic, keyed_on='angle'):
+    """The key depends on the material constants only through the impermeability
+    eigenvalues and activity they produce, so changing any constant changes the key."""
+    name = 'teo2_ref_ind' if keyed_on == 'angle' else 'teo2_ref_ind_%s' % keyed_on
+    params = [table_step, cos_table_max, cubic] if keyed_on == 'cos' else [table_step, cubic]
+    return table_cache.make_key(name, wavelength_vac_rounded, *(params + [get_activity_vector(wavelength_vac_rounded)] \
+        + list(get_relative_impermeability_eigenvals(wavelength_vac_rounded))))
+
+def build_and_store_ref_ind_tables(wavelength_cubic_and_keyed_on):
+    (wavelength_vac_rounded, cubic, keyed_on) = wavelength_cubic_and_keyed_on
+    array_names = get_array_names(cubic)
+    tables = build_ref_ind_tables(wavelength_vac_rounded, cubic, keyed_on)
+    table_cache.store(get_table_key(wavelength_vac_rounded, cubic, keyed_on), dict(zip(array_names, tables)))
+
+def warm_up(wavelengths, cubic=None, processes=None, keyed_on=('angle', 'cos', 'refraction')):
+    """Build any refractive index tables missing from the on-disk cache, using a
+    pool of worker processes. Useful at install time or at the start of a job
+    so that workers only memory-map the tables. Without a cache directory the
+    tables are built into this process's memo instead."""
+    from multiprocessing import Pool
+    cubic = table_is_cubic if cubic is None else cubic
+    wavelengths_rounded = np.unique(np.round(wavelengths, accuracy))
+    wanted = [(w, cubic, k) for w in wavelengths_rounded for k in keyed_on]
+
+    if table_cache.get_cache_dir() is None:
+        for w in wanted:
+            ref_ind_lookup(*w)
+        return
+
+    array_names = get_array_names(cubic)
+    missing = [w for w in wanted if table_cache.load(get_table_key(*w), array_names) is None]
+    if len(missing) < 2 or processes == 1:
+        for m in missing:
+            build_and_store_ref_ind_tables(m)
+        return
+    pool = Pool(processes)
+    try:
+        pool.map(build_and_store_ref_ind_tables, missing)
+    finally:
+        pool.close()
+        pool.join()
 
 def ord_ref_ind_gradient(angles, wavelength_vac):
-    delta = 1e-4 # match the lookup table accuracy
-    _, ord1 = calc_refractive_indices(angles, wavelength_vac)
-    _, ord2 = calc_refractive_indices(angles + delta, wavelength_vac)
-    return (ord2 - ord1) / delta
+    """The angular derivative of the ordinary index, see calc_refractive_indices_and_gradients."""
+    return calc_refractive_indices_and_gradients(angles, wavelength_vac)[1][1]
 
 # See Uchida 1971 for constants and formulas
 def get_ref_ind(wavelength_vac):
+    """Returns (n_o, n_e) along the principal axes, each of the same shape as wavelength_vac."""
     F1 = array([220.6, 241.0])
     F2 = array([25.55, 34.20])
     E1_F = array([9.24, 9.24])
     E2_F = array([4.70, 4.71])
-    E = h*c/e/wavelength_vac
+    E = h*c/e/np.asarray(wavelength_vac)[...,np.newaxis]
     n_sqr = 1 + F1 / (power(E1_F, 2.) - power(E, 2.)) \
               + F2 / (power(E2_F, 2.) - power(E, 2.)) # Uchida 1971 (4)
-    return sqrt(n_sqr)
+    return np.rollaxis(sqrt(n_sqr), -1)
 
 def get_relative_impermeability_eigenvals(wavelength_vac):
     n = get_ref_ind(wavelength_vac)
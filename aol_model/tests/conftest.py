@@ -0,0 +1,13 @@
+"""Keep the on-disk table cache out of the user's home directory while testing."""
+
+from aol_model import table_cache
+import shutil
+import tempfile
+
+def pytest_configure(config):
+    """Runs before the test modules are imported, some of which build tables at import."""
+    config.table_cache_dir = tempfile.mkdtemp(prefix='aol_model_cache_')
+    table_cache.set_cache_dir(config.table_cache_dir)
+
+def pytest_unconfigure(config):
+    shutil.rmtree(config.table_cache_dir, ignore_errors=True)
@@ -1,5 +1,5 @@
 from aol_model.acoustics import AcousticDrive
-from numpy import allclose
+from numpy import allclose, sqrt
 
 def test_only_const():
     drive = AcousticDrive(10, 0)
@@ -43,6 +43,25 @@ def test_ramp_loop():
     f2 = drive.get_local_acoustics(10., [[0,0,0]], [0,0], [1,0,0])[0].frequency
     
     assert allclose(f2 - f1, 0)
-    
+
+def test_field_matches_acoustics_objects():
+    from aol_model.acoustics import Acoustics, AcousticField, as_acoustic_field
+    from aol_model.aod import Aod
+    aod = Aod([0,0,1], [1,0,0], 16e-3, 3.25e-3, 8e-3, lambda f: f / 50e6)
+    objects = [Acoustics(f, p) for (f, p) in [(30e6, 1.), (40e6, 1.5), (50e6, 2.)]]
+    field = AcousticField([30e6, 40e6, 50e6], [1., 1.5, 2.])
+    (frequencies, wavevector_mags, amplitudes) = field.get_properties(aod)
+    assert allclose(wavevector_mags, [a.wavevector_mag for a in objects], rtol=1e-15, atol=0)
+    assert allclose(amplitudes, [a.amplitude(aod) * sqrt(a.frequency / 50e6) for a in objects], rtol=1e-15, atol=0)
+    assert field.get_properties(aod) is field.get_properties(aod)
+    assert allclose(as_acoustic_field(objects).get_properties(aod), (frequencies, wavevector_mags, amplitudes), rtol=0, atol=0)
+
+def test_field_indexing():
+    from aol_model.acoustics import AcousticField
+    field = AcousticField([30e6, 40e6, 50e6], 1.5)
+    assert len(field) == 3 and field[1].frequency == 40e6 and field[1].power == 1.5
+    assert field[[0, 2]].frequencies.tolist() == [30e6, 50e6]
+    assert [a.frequency for a in field] == [30e6, 40e6, 50e6]
+
 if __name__ == '__main__':
     test_ramp_loop()
\ No newline at end of file
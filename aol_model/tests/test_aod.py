@@ -85,6 +85,78 @@ def test_acoustic_sound_direction():
     direc = aod_new.acoustic_direction
     assert allclose(direc, [1,0,-1]/sqrt(2))
 
+def test_mixed_wavelengths_match_separate_bundles():
+    from aol_model.ray_bundle import RayBundle
+    from aol_model.acoustics import Acoustics
+    wavevecs = [normalise([0.02,0,1]), normalise([0.025,0.001,1])]
+    wavelengths = [800e-9, 920e-9]
+    mixed = RayBundle([[0,0,0]]*2, wavevecs, wavelengths)
+    aod.propagate_ray(mixed, [Acoustics(40e6)]*2, 1)
+    for m in range(2):
+        single = RayBundle([[0,0,0]], [wavevecs[m]], wavelengths[m])
+        aod.propagate_ray(single, [Acoustics(40e6)], 1)
+        assert allclose(single.wavevectors_unit[0], mixed.wavevectors_unit[m], rtol=0, atol=1e-8) # surface keeps the Doppler shift the tables round away
+        assert allclose(single.energies[0], mixed.energies[m], rtol=1e-6)
+
+def test_refraction_in_obeys_snells_law():
+    from aol_model.ray_bundle import RayBundle
+    from aol_model.vector_utils import normalise_list
+    from numpy import array
+    from numpy.linalg import norm
+    wavevecs = normalise_list(array([[0,0,1], [0.01,0,1], [0.05,-0.03,1], [0.6,0.2,1]]))
+    bundle = RayBundle([[0,0,0]]*4, wavevecs, [800e-9, 800e-9, 920e-9, 800e-9])
+    aod.refract_in(bundle)
+    n_ext = aod.calc_refractive_indices_rays(bundle)[0]
+    sin_inside = norm(cross(bundle.wavevectors_unit, aod.normal), axis=1)
+    sin_outside = norm(cross(wavevecs, aod.normal), axis=1)
+    assert allclose(n_ext * sin_inside, sin_outside, rtol=0, atol=1e-15)
+
+def test_refraction_angles_flag_non_converged_rays():
+    import aol_model.aod as aod_module
+    from numpy import array
+    old_max = aod_module.refraction_max_iterations
+    aod_module.refraction_max_iterations = 1
+    try:
+        (_, converged) = aod.find_refraction_angles(array([[1.,0,0]]*2), array([0, 0.3]), 800e-9)
+    finally:
+        aod_module.refraction_max_iterations = old_max
+    assert converged.tolist() == [True, False]
+
+def test_refraction_maps_match_solving():
+    import aol_model.aod as aod_module
+    from aol_model.ray_bundle import RayBundle
+    from aol_model.vector_utils import normalise_list
+    from numpy import array
+    wavevecs = normalise_list(array([[0,0,1], [1e-4,0,1], [0.05,-0.03,1], [0.6,0.2,1], [-2,1,1]]))
+    results = []
+    for use_maps in [True, False]:
+        aod_module.use_refraction_maps = use_maps
+        try:
+            bundle = RayBundle([[0,0,0]]*5, wavevecs, 920e-9)
+            aod.refract_in(bundle)
+            inside = bundle.wavevectors_unit.copy()
+            outside = []
+            for polarisation in [0, 1]: # extraordinary and ordinary out
+                bundle.wavevectors_unit = inside
+                aod.refract_out(bundle, polarisation)
+                outside.append(bundle.wavevectors_unit)
+            results.append((inside, array(outside)))
+        finally:
+            aod_module.use_refraction_maps = True
+    assert allclose(results[0][0], results[1][0], rtol=0, atol=1e-14)
+    assert allclose(results[0][1], results[1][1], rtol=0, atol=1e-14, equal_nan=True)
+
+def test_acoustic_direction_follows_normal():
+    aod_new = Aod([0,0,1], [1,0,0], 1, 1, 1)
+    stamp = aod_new.geometry_stamp
+    aod_new.normal = [1/sqrt(2),0,1/sqrt(2)]
+    assert allclose(aod_new.acoustic_direction, [1,0,-1]/sqrt(2)) and aod_new.geometry_stamp != stamp
+    try:
+        aod_new.normal[0] = 0 # in place changes would bypass the cache
+        assert False
+    except ValueError:
+        pass
+
 if __name__ == "__main__":
     test_walkoff_towards_axis()
     
\ No newline at end of file
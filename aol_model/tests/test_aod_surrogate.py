@@ -0,0 +1,33 @@
+from aol_model.aod_surrogate import AodSurrogate
+from aol_model.set_up_utils import make_aod_wide
+from numpy import allclose, linspace, array, pi
+
+aod = make_aod_wide([0,0,1], [1,0,0])
+surrogate = AodSurrogate.create_surrogate(aod, -1, x_angles=linspace(1, 3, 21)*pi/180, y_angles=[0], \
+                frequencies=linspace(30e6, 50e6, 41), powers=linspace(0.5, 1.5, 5), wavelengths=[920e-9], num_spot_checks=50)
+
+def test_grid_points_are_exact():
+    x = surrogate.axes[0][[0, 7, 20]]
+    f = surrogate.axes[2][[3, 20, 40]]
+    approx = surrogate(x, 0, f, 1.5, 920e-9)
+    exact = surrogate.calc_exact(x, 0, f, 1.5, 920e-9)
+    assert allclose(approx, exact, rtol=0, atol=1e-12)
+
+def test_error_estimate_bounds_interpolation():
+    errors = surrogate.error_estimate
+    assert errors['efficiency_max'] < 0.05 and errors['efficiency_rms'] <= errors['efficiency_max']
+    assert errors['angle_max'] < 1e-5
+
+def test_off_grid_falls_back_to_exact():
+    x = array([2, 4, 2]) * pi/180 # second point off the grid
+    f = array([40e6, 40e6, 40e6])
+    powers = array([1., 1., 2.]) # third point off the grid
+    approx = surrogate(x, 0, f, powers, 920e-9)
+    exact = surrogate.calc_exact(x, 0, f, powers, 920e-9)
+    assert allclose(array(approx)[:,1:], array(exact)[:,1:], rtol=0, atol=0)
+    assert allclose(approx[0][0], exact[0][0], rtol=0, atol=0.05)
+
+def test_angles_in_aod_frame():
+    rotated = AodSurrogate(make_aod_wide([0,0,1], [0,1,0]), -1, [[2*pi/180], [0], [40e6], [1.], [920e-9]])
+    x = array([1.5, 2, 2.5]) * pi/180
+    assert allclose(rotated.calc_exact(x, 1e-3, 40e6, 1., 920e-9), surrogate.calc_exact(x, 1e-3, 40e6, 1., 920e-9), rtol=0, atol=1e-12)
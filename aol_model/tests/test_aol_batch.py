@@ -0,0 +1,52 @@
+from aol_model.aol_batch import AolBatch
+from aol_model.set_up_utils import set_up_aol, set_up_aol_batch, get_ray_bundle
+from aol_model.vector_utils import normalise
+from numpy import allclose, array, linspace
+import pytest
+
+op_wavelength = 920e-9
+focus_positions = array([[0,0,1e12], [0.02,-0.01,1], [-0.03,0.01,2], [0.01,0.02,-1]])
+focus_velocity = [1,-1,0]
+times = linspace(-1e-7, 1e-7, 3)
+
+batch = set_up_aol_batch(op_wavelength, focus_positions, focus_velocity=focus_velocity)
+aols = [set_up_aol(op_wavelength, focus_position=f, focus_velocity=focus_velocity) for f in focus_positions]
+
+def test_batch_matches_separate_aols():
+    rays = get_ray_bundle(op_wavelength)
+    record = ('final_energies', 'final_positions', 'paths')
+    results = batch.propagate(rays, times, 0.5, record)
+    assert results['final_energies'].shape == (3, 4, len(rays))
+    for (k, aol) in enumerate(aols):
+        expected = aol.propagate(rays, times, 0.5, record)
+        for name in record:
+            assert allclose(results[name][:,k], expected[name], rtol=1e-12, atol=0)
+
+def test_from_aols():
+    stacked = AolBatch.from_aols(aols)
+    assert allclose(stacked.base_ray_positions, batch.base_ray_positions)
+    rays = get_ray_bundle(op_wavelength)
+    assert allclose(stacked.propagate(rays, 0)['final_energies'], batch.propagate(rays, 0)['final_energies'], rtol=1e-12, atol=0)
+
+def test_from_aols_checks_shared_aol():
+    other = set_up_aol(op_wavelength, focus_position=focus_positions[0], focus_velocity=focus_velocity)
+    other.change_orientation(2, normalise([0.01,0,1]))
+    with pytest.raises(ValueError):
+        AolBatch.from_aols([aols[0], other])
+    other = set_up_aol(op_wavelength, focus_position=focus_positions[0], focus_velocity=focus_velocity)
+    other.acoustic_drives[2].ramp_time = 2e-5
+    with pytest.raises(ValueError):
+        AolBatch.from_aols([aols[0], other])
+
+def test_scalar_time_and_bad_record():
+    rays = get_ray_bundle(op_wavelength)
+    assert batch.propagate(rays, 0)['final_energies'].shape == (4, len(rays))
+    with pytest.raises(ValueError):
+        batch.propagate(rays, 0, record=('wavevectors',))
+
+def test_rescattering_off_matches_separate_aols():
+    rays = get_ray_bundle(op_wavelength)
+    results = batch.propagate(rays, 0, 0, rescattering='off')
+    for (k, aol) in enumerate(aols):
+        expected = aol.propagate(get_ray_bundle(op_wavelength), 0, 0, rescattering='off')
+        assert allclose(results['final_energies'][k], expected['final_energies'], rtol=1e-12, atol=0)
@@ -1,12 +1,14 @@
 from aol_model.aol_full import AolFull
 from aol_model.aod import Aod
 from aol_model.ray import Ray
+from aol_model.ray_bundle import RayBundle
 from aol_model.vector_utils import normalise
 from aol_model.aol_simple import AolSimple
 from aol_model.acoustics import teo2_ac_vel
 from numpy import allclose, array, arange, outer, linspace, meshgrid, dot,\
     concatenate, mean, std
 from random import random as r
+import pytest
 
 order = 1
 op_wavelength = 800e-9
@@ -84,7 +86,106 @@ def test_efficiency_low_at_angle():
     ray = Ray([0,0,0], [3./5,0,4./5], op_wavelength)
     aol.propagate_to_distance_past_aol([ray], 0, focal_length)
     assert ray.energy < 1e-9
-    
+
+def test_rescattering_modes():
+    angles = linspace(-1e-3, 1e-3, 5)
+    wavevecs = [normalise([a, 0, 1]) for a in angles]
+    results = {}
+    for mode in ['off', 'correction', 'full']:
+        rays = RayBundle([[0,0,0]]*5, wavevecs, op_wavelength)
+        results[mode] = aol.propagate_to_distance_past_aol(rays, 0, focal_length, rescattering=mode, return_rescatter=(mode == 'full'))
+    (paths, energies, rescatter) = results['full']
+    assert rescatter.shape == energies.shape and (rescatter >= 0).all() and (rescatter > 0).any()
+    assert allclose(results['correction'][1], energies, rtol=0, atol=0)
+    assert allclose(results['off'][0], paths, rtol=0, atol=0)
+    assert allclose(results['off'][1], energies, rtol=1e-2, atol=1e-6)
+    with pytest.raises(ValueError):
+        aol.propagate_to_distance_past_aol(RayBundle([[0,0,0]]*5, wavevecs, op_wavelength), 0, rescattering='correction', return_rescatter=True)
+
+def test_rescattering_off_is_deterministic():
+    wavevecs = [normalise([a, 0, 1]) for a in linspace(-1e-3, 1e-3, 5)]
+    fresh_aol = AolFull.create_aol(aods, aod_spacing, order, op_wavelength, base_freq, pair_deflection_ratio, focus_position, focus_velocity)
+    off = fresh_aol.propagate(RayBundle([[0,0,0]]*5, wavevecs, op_wavelength), 0, focal_length, rescattering='off')
+    fresh_aol.propagate(RayBundle([[1e-3,0,0]]*5, wavevecs, op_wavelength), 1e-6, focal_length, rescattering='full')
+    again = fresh_aol.propagate(RayBundle([[0,0,0]]*5, wavevecs, op_wavelength), 0, focal_length, rescattering='off')
+    assert allclose(off['final_energies'], again['final_energies'], rtol=0, atol=0)
+    corrections = fresh_aol.get_rescattering_corrections([op_wavelength]*5)
+    assert corrections.shape == (4, 5) and (corrections > 0).all() and (corrections <= 1).all()
+
+def test_rescattering_corrections_cached_per_wavelength_group():
+    from aol_model.set_up_utils import set_up_aol
+    fresh_aol = set_up_aol(op_wavelength) # its own Aods, as their orientation is changed
+    wavelengths = linspace(800e-9, 900e-9, 200)
+    corrections = fresh_aol.get_rescattering_corrections(wavelengths)
+    assert len(fresh_aol.rescattering_corrections) == 11 # one tracer per 10nm group
+    assert allclose(corrections[:,0], fresh_aol.get_rescattering_corrections([800e-9])[:,0], rtol=0, atol=0)
+    assert allclose(corrections[:,-1], fresh_aol.get_rescattering_corrections([900e-9])[:,0], rtol=0, atol=0)
+    for k in range(5):
+        fresh_aol.change_orientation(3, normalise([1e-4 * (k+1), 0, 1]))
+        fresh_aol.get_rescattering_corrections(wavelengths)
+        assert len(fresh_aol.rescattering_corrections) == 11
+    fresh_aol.acoustic_drives[0].const += 1e6
+    fresh_aol.get_rescattering_corrections([op_wavelength])
+    assert len(fresh_aol.rescattering_corrections) == 1
+
+def test_ray_tree_single_order_matches_propagation():
+    wavevecs = [normalise([a, 0, 1]) for a in linspace(-1e-3, 1e-3, 5)]
+    rays = RayBundle([[0,0,0]]*5, wavevecs, op_wavelength)
+    (leaves, tree_paths, ray_indices, branch_orders) = aol.propagate_ray_tree(rays, 0, focal_length, orders=(order,), energy_floor=0)
+    (paths, energies) = aol.propagate_to_distance_past_aol(RayBundle([[0,0,0]]*5, wavevecs, op_wavelength), 0, focal_length)
+    assert ray_indices.tolist() == list(range(5)) and (branch_orders == order).all()
+    assert allclose(tree_paths, paths, rtol=0, atol=1e-15)
+    assert allclose(leaves.energies, energies[:,-1], rtol=1e-12, atol=0)
+    assert allclose(rays.positions, 0) # ray states unchanged
+
+def test_ray_tree_conserves_energy_and_prunes():
+    from numpy import bincount
+    wavevecs = [normalise([a, 0, 1]) for a in linspace(-1e-3, 1e-3, 3)]
+    rays = RayBundle([[0,0,0]]*3, wavevecs, op_wavelength)
+    (leaves, paths, ray_indices, branch_orders) = aol.propagate_ray_tree(rays, 0, focal_length, second_order=True, energy_floor=0)
+    assert paths.shape == (len(leaves), 9, 3) and branch_orders.shape == (len(leaves), 4)
+    assert allclose(bincount(ray_indices, leaves.energies), 1, rtol=0, atol=1e-12)
+    pruned = aol.propagate_ray_tree(rays, 0, focal_length, second_order=True, energy_floor=1e-3)
+    assert len(pruned[0]) < len(leaves) and (pruned[0].energies >= 1e-3).all()
+
+def test_time_array_matches_separate_times():
+    wavevecs = [normalise([a, 0, 1]) for a in linspace(-1e-3, 1e-3, 4)]
+    positions = [[1e-3*k, -1e-3*k, 0] for k in range(4)]
+    times = array([-1e-5, 0, 2e-5])
+    (paths, energies) = aol.propagate_to_distance_past_aol(RayBundle(positions, wavevecs, op_wavelength), times, focal_length)
+    assert paths.shape == (3, 4, 9, 3) and energies.shape == (3, 4, 4)
+    for (k, t) in enumerate(times):
+        (paths_t, energies_t) = aol.propagate_to_distance_past_aol(RayBundle(positions, wavevecs, op_wavelength), t, focal_length)
+        assert allclose(paths[k], paths_t, rtol=0, atol=1e-15) and allclose(energies[k], energies_t, rtol=1e-12, atol=0)
+
+def test_change_orientation_updates_geometry():
+    from aol_model.set_up_utils import set_up_aol
+    new_normal = normalise([-0.03, 0.001, 1])
+    (changed, fresh) = (set_up_aol(op_wavelength), set_up_aol(op_wavelength))
+    changed.propagate_to_distance_past_aol([Ray([0,0,0], [0,0,1], op_wavelength)], 0, 1) # fill the geometry cache
+    changed.change_orientation(1, new_normal)
+    fresh.aods[0] = Aod(new_normal, [1,0,0], 16e-3, 3.25e-3, 8e-3, fresh.aods[0].transducer_efficiency_func)
+    results = [aol_k.propagate_to_distance_past_aol([Ray([0,0,0], [0,0,1], op_wavelength)], 0, 1) for aol_k in (changed, fresh)]
+    assert allclose(results[0][0], results[1][0], rtol=0, atol=0) and allclose(results[0][1], results[1][1], rtol=0, atol=0)
+
+def test_propagate_records_requested_outputs():
+    wavevecs = [normalise([a, 0, 1]) for a in linspace(-1e-3, 1e-3, 4)]
+    (paths, energies) = aol.propagate_to_distance_past_aol(RayBundle([[0,0,0]]*4, wavevecs, op_wavelength), array([0, 1e-5]), focal_length)
+    results = aol.propagate(RayBundle([[0,0,0]]*4, wavevecs, op_wavelength), array([0, 1e-5]), focal_length, record=('final_energies', 'final_positions'))
+    assert sorted(results.keys()) == ['final_energies', 'final_positions']
+    assert allclose(results['final_energies'], energies[:,:,-1], rtol=0, atol=0)
+    assert allclose(results['final_positions'], paths[:,:,-1], rtol=0, atol=0)
+    rays = [Ray([0,0,0], [0,0,1], op_wavelength)]
+    assert list(aol.propagate(rays, 0, focal_length).keys()) == ['final_energies'] # same names for scalar time
+    assert allclose(rays[0].position, [0,0,0]) # list of rays not updated
+    with pytest.raises(ValueError):
+        aol.propagate(rays, 0, record=('directions',))
+
+def test_ray_energy_independent_of_bundle_wavelengths():
+    alone = aol.propagate(RayBundle([[0,0,0]], [[0,0,1]], 924e-9), 0, focal_length)['final_energies']
+    mixed = aol.propagate(RayBundle([[0,0,0]]*2, [[0,0,1]]*2, [924e-9, 936e-9]), 0, focal_length)['final_energies']
+    assert allclose(mixed[0], alone[0], rtol=0, atol=0)
+
 if __name__ == '__main__':
     #test_ray_passes_through_focus()
     test_angles_on_aods()
\ No newline at end of file
@@ -1,7 +1,10 @@
-from aol_model.aol_simple import AolSimple
+from aol_model.aol_simple import AolSimple, calc_base_ray_positions, get_base_ray_positions
+from aol_model.acoustics import AcousticDrive
 from aol_model.ray import Ray
+from aol_model.ray_bundle import RayBundle
+from aol_model.ray_paraxial import RayParaxial, RayParaxialBundle
 import pytest
-from numpy import allclose, array
+from numpy import allclose, array, zeros
 
 wavelength = 800e-9
 order = -1
@@ -51,6 +54,41 @@ def test_find_base_ray_positions():
     aol_chirp = AolSimple.create_aol_from_drive(num_aods, order, spacing, [1e6]*4, [1e6]*4, wavelength)
     assert allclose(aol_const.base_ray_positions, aol_chirp.base_ray_positions, atol=0) and not aol_chirp.acoustic_drives[0].linear == 0 
 
+def test_base_ray_positions_match_tracer():
+    drives = AcousticDrive.make_acoustic_drives(array([30e6, 35e6, 40e6, 45e6]), [0]*4, [2e12, -1e12, 3e12, 1e12], ramp_time=1e-6)
+    aol = AolSimple(num_aods, order, spacing, drives)
+    path = aol.propagate_to_distance_past_aol(RayParaxial([0,0,0], [0,0,1], wavelength), 0)
+    positions = aol.find_base_ray_positions(wavelength)
+    assert allclose(positions, path[:-1,0:2], rtol=1e-12, atol=1e-15)
+
+def test_base_ray_positions_for_many_configs():
+    const = array([[30e6, 35e6, 40e6, 45e6], [40e6]*4, [20e6, 50e6, 30e6, 40e6]])
+    args = (order, wavelength, spacing, array([[1,0,0],[0,1,0],[-1,0,0],[0,-1,0]]))
+    positions = calc_base_ray_positions(*(args + (const, 0, [613.]*4, [None]*4)))
+    for (c, p) in zip(const, positions):
+        assert allclose(calc_base_ray_positions(*(args + (c, 0, [613.]*4, [None]*4))), p, rtol=1e-15, atol=0)
+    assert get_base_ray_positions(*(args + (const[0], zeros(4), (613.,)*4, (None,)*4))) is \
+            get_base_ray_positions(*(args + (const[0].copy(), zeros(4), (613.,)*4, (None,)*4)))
+
+def test_bundle_matches_single_rays():
+    aol = AolSimple.create_aol_from_drive(num_aods, order, spacing, array([1e6]*4), array([1e6]*4), wavelength)
+    positions = [[0,0,0], [1e-3,0,0], [0,-2e-3,0]]
+    wavevecs = [[0,0,1], [0,3./5,4./5], [3./5,0,4./5]]
+    rays = [Ray(p, w, wavelength) for (p, w) in zip(positions, wavevecs)]
+    bundle = RayBundle(positions, wavevecs, wavelength)
+    paths_single = array([aol.propagate_to_distance_past_aol(r, 1e-6, 1) for r in rays])
+    paths_bundle = aol.propagate_to_distance_past_aol(bundle, 1e-6, 1)
+    assert allclose(paths_single, paths_bundle) and allclose([r.wavevector_unit for r in rays], bundle.wavevectors_unit)
+
+def test_paraxial_bundle_matches_single_rays():
+    aol = AolSimple.create_aol_from_drive(num_aods, order, spacing, array([1e6]*4), array([1e6]*4), wavelength)
+    positions = [[0,0,0], [1e-3,0,0], [0,-2e-3,0]]
+    rays = [RayParaxial(p, [0,0,1], wavelength) for p in positions]
+    bundle = RayParaxialBundle(positions, [[0,0,1]]*3, wavelength)
+    paths_single = array([aol.propagate_to_distance_past_aol(r, 1e-6, 1) for r in rays])
+    paths_bundle = aol.propagate_to_distance_past_aol(bundle, 1e-6, 1)
+    assert allclose(paths_single, paths_bundle) and allclose(bundle.wavevectors_unit[:,2], 1, rtol=0, atol=0)
+
 if __name__ == '__main__':
     test_constant_freq_for_zero_chirp()
     test_plot()
\ No newline at end of file
@@ -0,0 +1,47 @@
+from aol_model.aol_simple import AolSimple
+from aol_model.ray_paraxial import RayParaxialBundle
+from aol_model.acoustics import teo2_ac_vel
+from numpy import allclose, array, linspace, meshgrid, zeros
+
+order = -1
+op_wavelength = 900e-9
+aod_spacing = array([5e-2, 5e-2, 5e-2])
+base_freq = 40e6
+pair_deflection_ratio = 0.9
+focus_position = array([1e-3, 2e-3, 3])
+focus_velocity = array([100, -50, 0])
+
+aol = AolSimple.create_aol(4, order, op_wavelength, teo2_ac_vel, aod_spacing, base_freq, pair_deflection_ratio, focus_position, focus_velocity)
+
+def get_bundle():
+    x, y = meshgrid(linspace(-1,1,4)*1e-2, linspace(-1,1,3)*1e-2)
+    positions = array([x.ravel(), y.ravel(), zeros(x.size)]).T
+    wavevecs = array([1e-3 * x.ravel(), -2e-3 * y.ravel(), 1 + zeros(x.size)]).T
+    return RayParaxialBundle(positions, wavevecs, op_wavelength)
+
+def test_matches_ray_tracing():
+    transfer = aol.get_transfer_matrix(op_wavelength, focus_position[2])
+    for time in [0, 1e-6, -3e-5]:
+        traced = get_bundle()
+        aol.propagate_to_distance_past_aol(traced, time, focus_position[2])
+        fast = get_bundle()
+        transfer.propagate(fast, time)
+        assert allclose(traced.positions, fast.positions, rtol=0, atol=1e-12)
+        assert allclose(traced.wavevectors_unit, fast.wavevectors_unit, rtol=0, atol=1e-12)
+
+def test_many_times_in_one_product():
+    transfer = aol.get_transfer_matrix(op_wavelength, focus_position[2])
+    times = array([0, 1e-6, 2e-6])
+    bundle = get_bundle()
+    (positions, _) = transfer.transform(bundle.positions, bundle.wavevectors_unit, times)
+    for (t, p) in zip(times, positions):
+        (positions_single, _) = transfer.transform(bundle.positions, bundle.wavevectors_unit, t)
+        assert allclose(p, positions_single, rtol=0, atol=0)
+
+def test_focus_closed_form():
+    transfer = aol.get_transfer_matrix(op_wavelength)
+    traced = RayParaxialBundle([[0,0,0], [1e-2,0,0], [0,-1e-2,0]], [[0,0,1]]*3, op_wavelength)
+    aol.propagate_to_distance_past_aol(traced, 1e-6, focus_position[2])
+    assert allclose(transfer.find_focus_position(1e-6), traced.positions, rtol=0, atol=1e-9)
+    assert allclose(transfer.find_focus_velocity(), focus_velocity, rtol=1e-6, atol=0)
+    assert allclose(transfer.find_focus_distance(), focus_position[2])
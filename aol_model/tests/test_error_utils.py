@@ -0,0 +1,40 @@
+from aol_model.error_utils import check_are_unit_vectors, set_validation_level, get_validation_level, RayValidationError
+from aol_model.ray import Ray
+from aol_model.aod import Aod
+from aol_model.acoustics import Acoustics
+from aol_model.ray_bundle import RayBundle
+import pytest
+
+def teardown_function(function):
+    set_validation_level('strict')
+
+def test_strict_reports_failed_indices():
+    with pytest.raises(RayValidationError) as err:
+        check_are_unit_vectors([[0,0,1],[0,0,1.1],[1,0,0],[0,1,1]])
+    assert list(err.value.indices) == [1,3]
+
+def test_off_skips_checks():
+    set_validation_level('off')
+    check_are_unit_vectors([[0,0,1.1]])
+    Ray([0,0,0], [1,0,0.1], 800e-9)
+
+def test_sampled_checks_some_rays():
+    set_validation_level('sampled', 2)
+    failures = 0
+    for _ in range(4):
+        try:
+            check_are_unit_vectors([[0,0,1.1],[0,0,1]])
+        except RayValidationError:
+            failures += 1
+    assert failures == 2
+
+def test_invalid_level():
+    with pytest.raises(ValueError):
+        set_validation_level('sometimes')
+    assert get_validation_level() == 'strict'
+
+def test_aod_checks_at_stage_boundaries():
+    aod = Aod([0,0,1], [1,0,0], 1e-3, 1e-3, 1e-3)
+    bundle = RayBundle([[0,0,0]]*2, [[0,0,1],[0,0,1.1]], 800e-9)
+    with pytest.raises(RayValidationError):
+        aod.propagate_ray(bundle, [Acoustics(40e6)]*2, 1)
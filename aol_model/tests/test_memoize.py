@@ -0,0 +1,94 @@
+from aol_model.memoize import memoized, bounded_memoized, get_cache_stats
+from numpy import arange, array, nan
+import threading
+import gc
+
+def make_counting(max_entries=None, max_bytes=None):
+    calls = []
+    def func(*args):
+        calls.append(args)
+        return arange(10.) # 80 bytes
+    return (memoized(func, max_entries, max_bytes), calls)
+
+def test_hits_and_misses():
+    (f, calls) = make_counting()
+    f(1.); f(1.); f(2.)
+    stats = f.stats()
+    assert len(calls) == 2
+    assert stats['hits'] == 1 and stats['misses'] == 2 and stats['entries'] == 2
+    assert stats['bytes'] == 160
+
+def test_lru_eviction_by_entries():
+    (f, calls) = make_counting(max_entries=2)
+    f(1.); f(2.); f(1.); f(3.) # 2 is least recently used
+    f(1.)
+    assert len(calls) == 3
+    f(2.)
+    assert len(calls) == 4
+    assert f.stats()['evictions'] == 2
+
+def test_eviction_by_bytes():
+    (f, calls) = make_counting(max_bytes=200)
+    f(1.); f(2.); f(3.)
+    stats = f.stats()
+    assert stats['entries'] == 2 and stats['bytes'] == 160 and stats['evictions'] == 1
+
+def test_value_keys():
+    (f, calls) = make_counting()
+    f(array([1., 2.])); f(array([1., 2.]))
+    f((1., 2.)); f((1., 2.))
+    f(nan); f(nan)
+    assert len(calls) == 3
+
+def test_large_arrays_are_not_cached():
+    (f, calls) = make_counting()
+    f(arange(1000.)); f(arange(1000.))
+    assert len(calls) == 2 and f.stats()['uncacheable'] == 2
+
+def test_stats_registry():
+    @bounded_memoized(max_entries=1)
+    def square(x):
+        return x * x
+    square(3)
+    assert square.name.startswith(square.func.__module__ + '.square#')
+    assert get_cache_stats()[square.name]['misses'] == 1
+
+def test_stats_of_same_named_functions_are_separate():
+    (f, _) = make_counting()
+    (g, _) = make_counting()
+    f(1.); g(1.); g(2.)
+    stats = get_cache_stats()
+    assert f.name != g.name
+    assert stats[f.name]['misses'] == 1 and stats[g.name]['misses'] == 2
+
+def test_registry_does_not_keep_caches_alive():
+    (f, _) = make_counting()
+    name = f.name
+    assert name in get_cache_stats()
+    del f
+    gc.collect()
+    assert name not in get_cache_stats()
+
+def test_method():
+    class Counter(object):
+        def __init__(self):
+            self.calls = 0
+        @memoized
+        def value(self, x):
+            self.calls += 1
+            return x
+    c = Counter()
+    assert c.value(1) == 1 and c.value(1) == 1
+    assert c.calls == 1
+
+def test_threads():
+    (f, calls) = make_counting(max_entries=5)
+    def work():
+        for k in range(200):
+            f(float(k % 7))
+    threads = [threading.Thread(target=work) for _ in range(4)]
+    for t in threads: t.start()
+    for t in threads: t.join()
+    stats = f.stats()
+    assert stats['entries'] == 5 and stats['bytes'] == 400
+    assert stats['hits'] + stats['misses'] == 800
@@ -0,0 +1,43 @@
+from aol_model.ray_bundle import RayBundle, as_ray_bundle
+from aol_model.ray import Ray
+from aol_model.vector_utils import normalise
+import aol_model.set_up_utils as su
+from numpy import allclose, array
+
+wavelength = 800e-9
+
+def test_from_rays_and_back():
+    rays = [Ray([1,2,3], [3./5,4./5,0], wavelength, 0.5), Ray([0,0,0], [0,0,1], 2*wavelength)]
+    bundle = RayBundle.from_rays(rays)
+    new_rays = [Ray([0,0,0], [0,0,1], 1) for _ in rays]
+    bundle.copy_to_rays(new_rays)
+    assert allclose([r.position for r in new_rays], [r.position for r in rays])
+    assert allclose([r.wavevector_unit for r in new_rays], [r.wavevector_unit for r in rays])
+    assert allclose([r.wavelength_vac for r in new_rays], [r.wavelength_vac for r in rays])
+    assert allclose([r.energy for r in new_rays], [r.energy for r in rays])
+
+def test_as_ray_bundle_is_identity_for_bundle():
+    bundle = RayBundle([[0,0,0]], [[0,0,1]], wavelength)
+    assert as_ray_bundle(bundle) is bundle
+
+def test_wavevectors():
+    bundle = RayBundle([[0,0,0]]*2, [[0,0,1],[3./5,4./5,0]], [wavelength, 2*wavelength])
+    assert allclose(bundle.wavevectors_vac, (bundle.wavevectors_unit.T * bundle.wavevectors_vac_mag).T)
+    assert allclose(bundle.wavelengths_vac, [wavelength, 2*wavelength])
+
+def test_propagate_from_plane_to_plane_matches_ray():
+    rays = [Ray([1,0,0], [0,0,1], wavelength), Ray([0,2,0], normalise([1,1,10]), wavelength)]
+    bundle = RayBundle.from_rays(rays)
+    for r in rays:
+        r.propagate_from_plane_to_plane(10, normalise([1,2,1]), normalise([-1,3,1]))
+    bundle.propagate_from_plane_to_plane(10, normalise([1,2,1]), normalise([-1,3,1]))
+    assert allclose(bundle.positions, [r.position for r in rays])
+
+def test_aol_bundle_matches_rays():
+    aol = su.set_up_aol(wavelength, focus_position=[1e-3,2e-3,1])
+    rays = su.get_ray_bundle(wavelength)
+    bundle = RayBundle.from_rays(rays)
+    (paths_rays, energies_rays) = aol.propagate_to_distance_past_aol(rays, 1e-6, 0.1)
+    (paths_bundle, energies_bundle) = aol.propagate_to_distance_past_aol(bundle, 1e-6, 0.1)
+    assert allclose(paths_rays, paths_bundle, rtol=0, atol=0) and allclose(energies_rays, energies_bundle, rtol=0, atol=0)
+    assert allclose([r.energy for r in rays], bundle.energies, rtol=0, atol=0)
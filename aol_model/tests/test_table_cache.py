@@ -0,0 +1,36 @@
+from aol_model import table_cache, teo2
+from numpy import allclose, arange, memmap
+import os
+
+def setup_function(function):
+    function.old_dir = table_cache.get_cache_dir()
+
+def teardown_function(function):
+    table_cache.set_cache_dir(function.old_dir)
+
+def test_store_and_load(tmpdir):
+    table_cache.set_cache_dir(str(tmpdir))
+    key = table_cache.make_key('test', 1.5, 2)
+    assert table_cache.load(key, ['a']) is None
+    table_cache.store(key, {'a': arange(5.)})
+    (a,) = table_cache.load(key, ['a'])
+    assert isinstance(a, memmap) and allclose(a, arange(5.))
+
+def test_key_depends_on_params():
+    assert not table_cache.make_key('test', 1.5) == table_cache.make_key('test', 1.6)
+
+def test_disabled_cache_stores_nothing(tmpdir):
+    table_cache.set_cache_dir(None)
+    key = table_cache.make_key('test', 1)
+    table_cache.store(key, {'a': arange(5.)})
+    assert table_cache.load(key, ['a']) is None
+
+def test_ref_ind_tables_round_trip(tmpdir):
+    table_cache.set_cache_dir(str(tmpdir))
+    teo2.warm_up([800e-9, 920e-9], processes=1)
+    assert len(os.listdir(str(tmpdir))) == 6 # coeffs of the angle, cos and refraction tables, per wavelength
+    angles = arange(0, 1.5, 0.1)
+    (n_e_cached, n_o_cached) = teo2.ref_ind_lookup.func(800e-9, True)
+    table_cache.set_cache_dir(None)
+    (n_e, n_o) = teo2.ref_ind_lookup.func(800e-9, True)
+    assert allclose(n_e_cached(angles), n_e(angles), rtol=0, atol=0) and allclose(n_o_cached(angles), n_o(angles), rtol=0, atol=0)
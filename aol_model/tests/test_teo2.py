@@ -1,5 +1,5 @@
 from aol_model.teo2 import calc_refractive_indices, get_relative_impermeability_eigenvals
-from numpy import pi, arange, allclose, array, power
+from numpy import pi, arange, allclose, array, power, sign
 
 wavelen = 800e-9
 
@@ -45,4 +45,81 @@ def test_relative_impermeability_eigenvals():
     ref_inds = array([power(get_relative_impermeability_eigenvals(w), -0.5) for w in wavs])
     assert allclose(ref_inds[:,0], ref_inds[:,1])
     assert allclose(ref_inds[:,0], [2.4315, 2.2597, 2.208], atol=0.05) #ords
-    assert allclose(ref_inds[:,2], [2.6157, 2.4119, 2.352], atol=0.05) #exts
\ No newline at end of file
+    assert allclose(ref_inds[:,2], [2.6157, 2.4119, 2.352], atol=0.05) #exts
+
+def test_tables_match_exact_indices():
+    import aol_model.optically_uniaxial as oua
+    from aol_model.teo2 import ref_ind_lookup, get_activity_vector
+    angles = array([0, 1e-5, 0.0123456, 0.3, 1.5, pi/2])
+    exact = oua.calc_refractive_indices(angles, get_relative_impermeability_eigenvals(wavelen), get_activity_vector(wavelen))
+    for (cubic, tol) in [(True, 1e-14), (False, 1e-9)]:
+        (n_e, n_o) = ref_ind_lookup(wavelen, cubic)
+        assert allclose(n_e(angles), exact[0], rtol=0, atol=tol) and allclose(n_o(angles), exact[1], rtol=0, atol=tol)
+
+def test_closed_form_transverse_eigvals_match_rotation():
+    from aol_model.optically_uniaxial import find_transverse_imperm_eigvals, get_yz_rotation_matrix
+    from numpy import diag, dot, linspace
+    angles = linspace(-pi, pi, 37)
+    eigvals = get_relative_impermeability_eigenvals(wavelen)
+    rotated = array([dot(dot(rot, diag(eigvals)), rot.T) for rot in get_yz_rotation_matrix(angles)])
+    assert allclose(find_transverse_imperm_eigvals(angles, eigvals), rotated[:,[0,1],[0,1]], rtol=0, atol=1e-16)
+
+def test_surface_matches_tables():
+    from aol_model.teo2 import calc_refractive_indices_surface
+    angles = array([0, 0.01, 0.3, 1.2])
+    wavelengths = array([800e-9, 920e-9, 800e-9, 1040e-9])
+    surface = calc_refractive_indices_surface(angles, wavelengths)
+    for (a, w, n_e, n_o) in zip(angles, wavelengths, surface[0], surface[1]):
+        assert allclose(calc_refractive_indices(a, w), [n_e, n_o], rtol=0, atol=1e-14)
+    assert allclose(calc_refractive_indices(angles, wavelengths), surface, rtol=0, atol=0)
+
+def test_gradients_match_closed_form():
+    import aol_model.optically_uniaxial as oua
+    from aol_model.teo2 import calc_refractive_indices_and_gradients, get_activity_vector
+    angles = array([-0.5, -1e-3, 0, 2e-3, 0.05, 0.3, 1.5])
+    exact = oua.calc_refractive_indices_and_gradients(abs(angles), get_relative_impermeability_eigenvals(wavelen), get_activity_vector(wavelen))
+    ((n_e, n_o), (dn_e, dn_o)) = calc_refractive_indices_and_gradients(angles, wavelen)
+    assert allclose([n_e, n_o], exact[0], rtol=0, atol=1e-14)
+    assert allclose([dn_e, dn_o], array(exact[1]) * sign(angles), rtol=0, atol=1e-10)
+
+def test_closed_form_gradient_matches_finite_difference():
+    import aol_model.optically_uniaxial as oua
+    from aol_model.teo2 import get_activity_vector
+    angles = array([1e-3, 0.05, 0.3, 1.5])
+    delta = 1e-7
+    args = (get_relative_impermeability_eigenvals(wavelen), get_activity_vector(wavelen))
+    (n1, n2) = [array(oua.calc_refractive_indices(a, *args)) for a in (angles - delta, angles + delta)]
+    assert allclose(oua.calc_refractive_indices_and_gradients(angles, *args)[1], (n2 - n1) / (2*delta), rtol=1e-5, atol=1e-9)
+
+def test_cos_tables_match_angle_form():
+    import aol_model.optically_uniaxial as oua
+    from aol_model.teo2 import calc_refractive_indices_cos, calc_refractive_indices_and_gradients_cos, get_activity_vector
+    from numpy import cos
+    angles = array([0, 1e-6, 1e-3, 0.0123456, 0.3, pi/4, 1.2, pi/2, 2.0, pi - 1e-3, pi])
+    args = (get_relative_impermeability_eigenvals(wavelen), get_activity_vector(wavelen))
+    exact = oua.calc_refractive_indices_and_gradients(angles, *args)
+    for (n, dn) in [calc_refractive_indices_and_gradients_cos(cos(angles), wavelen), \
+                    oua.calc_refractive_indices_and_gradients_cos(cos(angles), *args)]:
+        assert allclose(n, exact[0], rtol=0, atol=1e-14)
+        assert allclose(dn, exact[1], rtol=0, atol=2e-10) # spline derivatives, as for the angle tables
+    assert allclose(calc_refractive_indices_cos(cos(angles), wavelen), exact[0], rtol=0, atol=1e-14)
+    near_axis = cos(angles[0:4])
+    assert allclose(calc_refractive_indices_cos(near_axis, wavelen), array(exact[0])[:,0:4], rtol=0, atol=1e-14)
+
+def test_cos_surface_for_mixed_wavelengths():
+    from aol_model.teo2 import calc_refractive_indices_cos, calc_refractive_indices_surface
+    from numpy import cos
+    angles = array([0, 0.01, 0.3, 1.2])
+    wavelengths = array([800e-9, 920e-9, 800e-9, 1040e-9])
+    assert allclose(calc_refractive_indices_cos(cos(angles), wavelengths), calc_refractive_indices_surface(angles, wavelengths), rtol=0, atol=1e-14)
+
+def test_ray_indices_independent_of_bundle_wavelengths():
+    from aol_model.teo2 import calc_refractive_indices_cos, calc_refractive_indices_and_gradients_cos
+    cos_angles = array([0.9999, 0.9])
+    for wavelengths in [array([804e-9, 816e-9]), array([800e-9, 810e-9])]:
+        alone = calc_refractive_indices_cos(cos_angles[0], wavelengths[0])
+        assert allclose(array(calc_refractive_indices_cos(cos_angles, wavelengths))[:,0], alone, rtol=0, atol=0)
+        (n, dn) = calc_refractive_indices_and_gradients_cos(cos_angles, wavelengths)
+        (n_alone, dn_alone) = calc_refractive_indices_and_gradients_cos(cos_angles[0:1], wavelengths[0:1])
+        assert allclose(array(n)[:,0], array(n_alone)[:,0], rtol=0, atol=0)
+        assert allclose(array(dn)[:,0], array(dn_alone)[:,0], rtol=0, atol=0)
@@ -0,0 +1,26 @@
+from aol_model.transducer_profile import TransducerProfile, smooth_window
+from aol_model.set_up_utils import transducer_efficiency_narrow, transducer_efficiency_wide
+from numpy import allclose, linspace, array
+
+freqs = linspace(-10e6, 120e6, 20001)
+
+def test_table_matches_exact_profile():
+    for profile in [transducer_efficiency_narrow, transducer_efficiency_wide]:
+        assert allclose(profile(freqs), profile.calc_exact(freqs), rtol=0, atol=1e-8)
+
+def test_calibrated_range_reproduced_exactly():
+    calibrated = linspace(22e6, 50e6, 1001) # wide cut-off window is flat here
+    assert allclose(transducer_efficiency_wide(calibrated), transducer_efficiency_wide.calc_exact(calibrated), rtol=0, atol=1e-14)
+    assert allclose(transducer_efficiency_wide(transducer_efficiency_wide.frequencies[1:]), transducer_efficiency_wide.efficiencies[1:], rtol=0, atol=1e-14)
+
+def test_zero_outside_window():
+    assert (transducer_efficiency_wide(array([0, 14e6, 60e6, 1e9])) == 0).all()
+
+def test_smooth_window():
+    assert allclose(smooth_window([10, 15, 20, 30, 45, 50, 60], 10, 10, 50, 10), [0, 0.5, 1, 1, 0.5, 0, 0])
+
+def test_file_round_trip(tmpdir):
+    path = str(tmpdir.join('narrow.json'))
+    transducer_efficiency_narrow.to_file(path)
+    loaded = TransducerProfile.from_file(path)
+    assert allclose(loaded(freqs), transducer_efficiency_narrow(freqs), rtol=0, atol=0)
@@ -0,0 +1,24 @@
+from aol_model.uniform_table import UniformTable
+from numpy import allclose, linspace, sin, arange
+
+def test_cubic_reproduces_cubic():
+    x = arange(0, 2, 0.1)
+    table = UniformTable(0, 0.1, x**3 - x)
+    pts = linspace(-0.2, 2.2, 50) # includes extrapolation
+    assert allclose(table(pts), pts**3 - pts, rtol=0, atol=1e-12)
+
+def test_linear_interpolates_linearly():
+    table = UniformTable(1, 0.5, [0, 1, 4], cubic=False)
+    assert allclose(table([1, 1.25, 1.5, 1.75, 2]), [0, 0.5, 1, 2.5, 4])
+
+def test_cubic_error_small():
+    table = UniformTable(0, 1e-2, sin(arange(0, 3, 1e-2)))
+    pts = linspace(0, 2.9, 1000)
+    assert allclose(table(pts), sin(pts), rtol=0, atol=1e-9)
+
+def test_from_coeffs_matches_table():
+    table = UniformTable(0, 1e-2, sin(arange(0, 3, 1e-2)))
+    from_coeffs = UniformTable.from_coeffs(0, 1e-2, table.coeffs)
+    pts = linspace(-0.1, 3.1, 1000)
+    assert allclose(from_coeffs(pts), table(pts), rtol=0, atol=0)
+    assert allclose(from_coeffs.value_and_derivative(pts), table.value_and_derivative(pts), rtol=0, atol=0)
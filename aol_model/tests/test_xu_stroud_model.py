@@ -4,7 +4,7 @@ from aol_model.acoustics import Acoustics
 from aol_model.xu_stroud_model import diffract_acousto_optically,diffract_by_wavevector_triangle,get_efficiency
 from aol_model.vector_utils import normalise
 import pytest
-from numpy import allclose, all, array, pi
+from numpy import allclose, all, any, array, pi
 from random import random
 from scipy import less_equal, greater_equal
 
@@ -48,10 +48,98 @@ def test_wavevector_triangle():
     zero_sum = k_i + order * K + aod.normal * wavevector_mismatch_mag - k_d[0]
     assert allclose(zero_sum, 0, atol=0.2, rtol=0)
 
+def test_triangle_solve_shrinks_working_set():
+    from aol_model.xu_stroud_model import triangle_solve
+    from numpy import cos, sin, dot, ones, arange
+    from numpy.linalg import norm
+    angles = arange(5) * 0.05
+    sum_vectors = array([sin(angles), 0*angles, cos(angles)]).T * 10
+    multipliers = 1 + arange(5) * 0.1
+    calls = []
+    def multiplier_func(vectors, ray_indices):
+        calls.append(ray_indices)
+        return multipliers[ray_indices] * (1 + 0.01 * dot(vectors, [1,0,0]) / norm(vectors, axis=1))
+    (_, unit, base, converged) = triangle_solve(sum_vectors, 10 * ones(5), array([0,0,1.]), multiplier_func, tolerance=1e-12)
+    assert all(converged) and len(calls) <= 12 # precondition and at most 10 steps
+    assert [len(c) for c in calls[2:]] == sorted([len(c) for c in calls[2:]], reverse=True)
+    out = (unit.T * base * multiplier_func(unit, arange(5))).T
+    assert allclose(out[:,0], sum_vectors[:,0], rtol=0, atol=1e-12) # only the axial component moves
+
+def test_triangle_solve_iteration_limit():
+    from aol_model.xu_stroud_model import triangle_solve
+    from numpy import ones
+    multiplier_func = lambda vectors, ray_indices: 1 + 0.001 * vectors[:,0]**2
+    sum_vectors = array([[0.1,0,1],[3,0,1]])
+    converged = triangle_solve(sum_vectors, 5 * ones(2), array([0,0,1.]), multiplier_func, tolerance=0, max_iterations=3)[3]
+    assert not any(converged)
+
+def test_wavevector_triangle_not_converged(monkeypatch):
+    import aol_model.xu_stroud_model as xsm
+    from aol_model.error_utils import RayValidationError
+    monkeypatch.setattr(xsm, 'triangle_tolerance', 0)
+    monkeypatch.setattr(xsm, 'triangle_max_iterations', 1)
+    wavevecs_unit = array([[0,0,1.],[0.6,0,0.8]])
+    with pytest.raises(RayValidationError) as error:
+        diffract_by_wavevector_triangle(aod, wavevecs_unit, [2*pi/wavelen]*2, [acoustics]*2, order, (0,1))
+    assert list(error.value.indices) == [0, 1]
+
+def test_unconverged_ray_is_dead_in_mixed_bundle(monkeypatch):
+    import aol_model.xu_stroud_model as xsm
+    from aol_model.error_utils import policy, RayValidationError
+    from aol_model.ray_bundle import RayBundle
+    from aol_model.vector_utils import normalise_list
+    solve = xsm.triangle_solve
+    def fail_second_ray(*args):
+        (mismatches, unit, base, converged) = solve(*args)
+        converged[1] = False
+        return (mismatches, unit, base, converged)
+    wavevecs_unit = normalise_list(array([[0.01,0,1],[0.02,0.01,1],[-0.03,0,1]]))
+    make_bundle = lambda: RayBundle([[0,0,0]]*3, wavevecs_unit, wavelen)
+    expected = make_bundle()
+    diffract_acousto_optically(aod, expected, [acoustics]*3, order)
+
+    monkeypatch.setattr(xsm, 'triangle_solve', fail_second_ray)
+    with pytest.raises(RayValidationError) as error:
+        diffract_acousto_optically(aod, make_bundle(), [acoustics]*3, order)
+    assert list(error.value.indices) == [1]
+
+    monkeypatch.setattr(policy, 'level', 'sampled')
+    bundle = make_bundle()
+    diffract_acousto_optically(aod, bundle, [acoustics]*3, order)
+    assert bundle.energies[1] == 0
+    assert allclose(bundle.energies[[0,2]], expected.energies[[0,2]], rtol=0, atol=0)
+    assert allclose(bundle.wavevectors_unit[[0,2]], expected.wavevectors_unit[[0,2]], rtol=0, atol=0)
+
+def test_fused_rescattering_matches_separate_passes():
+    from aol_model.xu_stroud_model import diffract_with_rescattering, get_diffracted_wavevectors_and_efficiency
+    from aol_model.vector_utils import normalise_list
+    wavevecs_unit = normalise_list(array([[0.01,0,1],[0.02,0.01,1],[-0.03,0,1]]))
+    wavevecs_mag = 2 * pi / array([800e-9, 800e-9, 920e-9])
+    local_acoustics = [Acoustics(f) for f in [30e6, 40e6, 50e6]]
+    (effs, unit, mag) = get_diffracted_wavevectors_and_efficiency(aod, wavevecs_unit, wavevecs_mag, local_acoustics, order, (0,1))
+    (effs_r,_,_) = get_diffracted_wavevectors_and_efficiency(aod, unit, mag, local_acoustics, order, (1,0))
+    (fused_effs, fused_unit, fused_mag, rescattering) = diffract_with_rescattering(aod, wavevecs_unit, wavevecs_mag, local_acoustics, order, (0,1))
+    assert allclose(fused_unit, unit, rtol=0, atol=0) and allclose(fused_mag, mag, rtol=0, atol=0)
+    assert allclose(rescattering, 0.5 * effs_r, rtol=0, atol=0)
+    assert allclose(fused_effs, effs * (1 - 0.5 * effs_r), rtol=0, atol=0)
+
 def test_setting_invalid_mode():
     with pytest.raises(ValueError):
         ray = Ray([0,0,0,], [0,0,1], wavelen)
         diffract_acousto_optically(aod, [ray], [acoustics], 2)
+
+
+def test_setting_invalid_rescattering_mode():
+    with pytest.raises(ValueError):
+        ray = Ray([0,0,0,], [0,0,1], wavelen)
+        diffract_acousto_optically(aod, [ray], [acoustics], 1, rescattering='partial')
+
+def test_rescattering_off_skips_resc():
+    rays = [Ray([0,0,0], normalise([0.01,0,1]), wavelen) for _ in range(2)]
+    corrections = diffract_acousto_optically(aod, rays[0:1], [acoustics], 1)
+    assert diffract_acousto_optically(aod, rays[1:2], [acoustics], 1, rescattering='off', rescattering_correction=corrections[0]) is None
+    assert not hasattr(rays[1], 'resc')
+    assert allclose(rays[0].energy, rays[1].energy, rtol=1e-14)
         
 if __name__ == '__main__':
     test_wavevector_triangle()
\ No newline at end of file
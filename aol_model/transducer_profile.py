@@ -0,0 +1,92 @@
+"""The transducer_profile module provides the TransducerProfile class, the
+calibrated efficiency of an AOD transducer against acoustic frequency. An Aod
+calls its profile for every ray, so the profile is compiled once into a
+UniformTable and evaluated in one vectorised step."""
+
+from uniform_table import UniformTable, get_cubic_coeffs
+from numpy import array, dtype, asarray, clip, where, exp, errstate, arange, zeros, floor, ceil, unique, concatenate
+import scipy.interpolate as interp
+import json
+
+default_step = 10e3 # Hz. Calibration frequencies on a multiple of this are reproduced exactly
+
+class TransducerProfile(object):
+    """Transducer efficiency at the calibration frequencies, interpolated by the
+    cubic spline through them and held constant beyond them. A smooth cut-off
+    window (lower, lower_width, upper, upper_width), see smooth_window, is
+    applied everywhere and an optional low_taper window below the lowest
+    calibration frequency. Frequencies are in Hz.
+
+    The profile is compiled into a table on a uniform grid. The grid is split
+    into pieces at the spline knots, the ends of the calibrated range and the
+    window edges, and each piece gets its own cubic, so the spline part is
+    reproduced exactly and the kinks at the ends of the calibrated range are
+    not smoothed over."""
+
+    def __init__(self, frequencies, efficiencies, cut_off, low_taper=None, step=default_step):
+        self.frequencies = array(frequencies, dtype=dtype(float))
+        self.efficiencies = array(efficiencies, dtype=dtype(float))
+        self.cut_off = tuple(float(c) for c in cut_off)
+        self.low_taper = None if low_taper is None else tuple(float(c) for c in low_taper)
+        self.step = float(step)
+        self.spline = interp.splrep(self.frequencies, self.efficiencies)
+        self.table = self.compile_table()
+
+    @staticmethod
+    def from_file(path):
+        """Load a profile saved with to_file, a JSON calibration file."""
+        with open(path) as f:
+            calibration = json.load(f)
+        return TransducerProfile(calibration['frequencies'], calibration['efficiencies'], calibration['cut_off'], \
+                                    calibration.get('low_taper'), calibration.get('step', default_step))
+
+    def to_file(self, path):
+        calibration = {'frequencies': self.frequencies.tolist(), 'efficiencies': self.efficiencies.tolist(), \
+                       'cut_off': list(self.cut_off), 'low_taper': self.low_taper, 'step': self.step}
+        with open(path, 'w') as f:
+            json.dump(calibration, f, indent=1)
+
+    def __call__(self, frequencies):
+        return self.table(frequencies)
+
+    def calc_exact(self, frequencies):
+        """The profile evaluated directly, without the table."""
+        freqs = asarray(frequencies, dtype=dtype(float))
+        vals = interp.splev(clip(freqs, self.frequencies[0], self.frequencies[-1]), self.spline)
+        if self.low_taper is not None:
+            vals = where(freqs < self.frequencies[0], vals * smooth_window(freqs, *self.low_taper), vals)
+        return vals * smooth_window(freqs, *self.cut_off)
+
+    def get_breakpoints(self):
+        (lower, lower_width, upper, upper_width) = self.cut_off
+        knots = self.spline[0]
+        breakpoints = [lower, lower + lower_width, upper - upper_width, upper] + list(knots[(knots > self.frequencies[0]) & (knots < self.frequencies[-1])])
+        breakpoints += [self.frequencies[0], self.frequencies[-1]]
+        if self.low_taper is not None:
+            breakpoints += [self.low_taper[0], self.low_taper[0] + self.low_taper[1]]
+        return array(breakpoints)
+
+    def compile_table(self):
+        """Zero beyond the cut-off window, so a few zero intervals at each end make the extrapolation exact."""
+        (lower, _, upper, _) = self.cut_off
+        start = (floor(lower / self.step) - 4) * self.step
+        num_points = int(ceil(upper / self.step) + 4 - start / self.step) + 1
+        values = self.calc_exact(start + self.step * arange(num_points))
+
+        breakpoints = (self.get_breakpoints() - start) / self.step
+        breakpoints = unique(concatenate(([0, num_points-1], clip(breakpoints, 0, num_points-1).round()))).astype(int)
+        coeffs = zeros((4, num_points-1))
+        for (i0, i1) in zip(breakpoints[:-1], breakpoints[1:]):
+            coeffs[:,i0:i1] = get_cubic_coeffs(self.step, values[i0:i1+1])
+        return UniformTable(start, self.step, values, coeffs=coeffs)
+
+def smooth_step(x, width):
+    """0 for x <= 0 rising smoothly to 1 for x >= width, infinitely differentiable."""
+    with errstate(divide='ignore', invalid='ignore'):
+        p_rise = where(x > 0, exp(-width / where(x > 0, x, 1)), 0.)
+        p_fall = where(width - x > 0, exp(-width / where(width - x > 0, width - x, 1)), 0.)
+        return where(x > 0, p_rise / (p_rise + p_fall), 0.)
+
+def smooth_window(x, lower, lower_width, upper, upper_width): # 11.13 Priestley, Introduction to Integration
+    x = asarray(x, dtype=dtype(float))
+    return smooth_step(upper - x, upper_width) * smooth_step(x - lower, lower_width)
@@ -0,0 +1,65 @@
+"""The uniform_table module provides lookup tables on a uniform grid. A value is
+found by direct index arithmetic and a local polynomial, so each evaluation is
+O(1) however many points are stored. Used by teo2 for refractive indices."""
+
+from numpy import array, dtype, asarray, floor, clip, diff, arange
+from scipy.interpolate import CubicSpline
+
+class UniformTable(object):
+    """Values of a smooth function tabulated at start, start + step, ...
+
+    With cubic=True the table stores the coefficients of the not-a-knot cubic
+    spline through the values, the same interpolant as scipy's splrep with s=0,
+    so results match a splrep/splev lookup to rounding error. With cubic=False
+    the table interpolates linearly, with error step**2 / 8 * max|f''|.
+    Points outside the grid are extrapolated from the end intervals.
+
+    Precomputed coeffs (e.g. memory-mapped from table_cache) can be passed in,
+    in which case values and coeffs are used as given without copying. A cubic
+    table evaluates from its coeffs alone, see from_coeffs."""
+
+    @staticmethod
+    def from_coeffs(start, step, coeffs):
+        """A cubic table from its (4, N-1) coefficients only, without the values."""
+        return UniformTable(start, step, None, True, coeffs)
+
+    def __init__(self, start, step, values, cubic=True, coeffs=None):
+        self.start = float(start)
+        self.step = float(step)
+        self.values = None if values is None else asarray(values, dtype=dtype(float))
+        self.cubic = cubic
+        if cubic:
+            self.coeffs = coeffs if coeffs is not None else get_cubic_coeffs(self.step, self.values)
+            self.num_points = self.coeffs.shape[1] + 1
+        else:
+            self.slopes = diff(self.values)
+            self.num_points = self.values.size
+
+    def locate(self, points):
+        """Index of the interval holding each point and the fractional position t within it."""
+        x = (asarray(points, dtype=dtype(float)) - self.start) / self.step
+        idx = clip(floor(x).astype(int), 0, self.num_points - 2)
+        return (idx, x - idx)
+
+    def __call__(self, points):
+        (idx, t) = self.locate(points)
+        if not self.cubic:
+            return self.values[idx] + t * self.slopes[idx]
+        c = self.coeffs[:,idx]
+        return ((c[0] * t + c[1]) * t + c[2]) * t + c[3]
+
+    def value_and_derivative(self, points):
+        """The interpolated values and the analytic derivative of the interpolant, from one lookup."""
+        (idx, t) = self.locate(points)
+        if not self.cubic:
+            return (self.values[idx] + t * self.slopes[idx], self.slopes[idx] / self.step)
+        c = self.coeffs[:,idx]
+        value = ((c[0] * t + c[1]) * t + c[2]) * t + c[3]
+        derivative = ((3 * c[0] * t + 2 * c[1]) * t + c[2]) / self.step
+        return (value, derivative)
+
+def get_cubic_coeffs(step, values):
+    """(4, N-1) coefficients of the not-a-knot cubic spline in each interval, as powers of t in [0,1]."""
+    grid = step * arange(values.size)
+    coeffs = CubicSpline(grid, values).c # coefficients of powers of (x - x_i)
+    return coeffs * array([[step**3], [step**2], [step], [1.]])
@@ -2,70 +2,153 @@
 The xu_stroud_model module contains the functions to diffract an optic ray accordiong to the
 Xu and Stroud theory."""
 
-from numpy import dot, sin, sqrt, array, power, outer, abs, all, isnan
+from numpy import dot, sin, sqrt, array, power, outer, abs, all, any, isnan, isfinite, where, zeros, arange, nan, dtype
 from scipy.constants import c, pi
 from numpy.linalg import norm
 from vector_utils import normalise_list
+from ray_bundle import as_ray_bundle, update_rays
+from acoustics import as_acoustic_field
+from error_utils import check_all_converged
 
-def diffract_acousto_optically(aod, rays, local_acoustics, order, ext_to_ord=True):
+triangle_tolerance = 1e-6 # on the ratio of desired to current wavevector length
+triangle_max_iterations = 50
+rescattering_modes = ('full', 'correction', 'off')
+rescattering_fraction = 0.5 # inferred from single AOD experiment, may depend on AOD design and optical wavelength
+
+def diffract_acousto_optically(aod, rays, local_acoustics, order, ext_to_ord=True, rescattering='full', rescattering_correction=1.):
     """The top level function handles the diffraction and sets out details
     including possible polarisations (ordinary or exrtaordinary -> ordinary
-    or extraordinary) and whether second order diffraction is included."""
+    or extraordinary) and whether second order diffraction is included.
+    Takes a list of Ray objects or a RayBundle.
+
+    The rescattering mode is one of rescattering_modes. 'full' solves the
+    rescattering pass, corrects the efficiencies and stores the rescattered
+    energies on the bundle (or each ray's resc). 'correction' only corrects the
+    efficiencies. 'off' skips the second solve and scales the efficiencies by
+    rescattering_correction instead. Returns the per-ray correction factors,
+    or None when rescattering is off."""
 
     if not abs(order) == 1:
         raise ValueError("Order only supports +1, -1")
+    if rescattering not in rescattering_modes:
+        raise ValueError("rescattering must be one of %s" % (rescattering_modes,))
 
     ref_inds = (1,0) # ord->ext
     if ext_to_ord:
         ref_inds = (0,1) # ext->ord
 
-    wavevecs_in_mag  = [r.wavevector_vac_mag for r in rays] # store these
-    wavevecs_in_unit  = array([r.wavevector_unit for r in rays])
+    bundle = as_ray_bundle(rays)
+    if rescattering == 'off':
+        ref_inds_in = ref_ind_ext_ord(aod, bundle.wavevectors_unit, bundle.wavevectors_vac_mag)
+        (efficiencies, wavevecs_out_unit, wavevecs_out_mag, _) = diffract_and_get_efficiency(aod, \
+            bundle.wavevectors_unit, bundle.wavevectors_vac_mag, ref_inds_in, get_acoustic_properties(aod, local_acoustics), order, ref_inds)
+        efficiencies *= rescattering_correction
+        (corrections, rescatter) = (None, None)
+    else:
+        (efficiencies, wavevecs_out_unit, wavevecs_out_mag, rescattering_terms) = \
+            diffract_with_rescattering(aod, bundle.wavevectors_unit, bundle.wavevectors_vac_mag, local_acoustics, order, ref_inds)
+        corrections = 1 - rescattering_terms
+        rescatter = rescattering_terms * efficiencies if rescattering == 'full' else None
+
+    bundle.wavevectors_vac_mag = wavevecs_out_mag
+    bundle.wavevectors_unit = wavevecs_out_unit
+    bundle.energies *= efficiencies
+    bundle.rescatter = rescatter
+    update_rays(rays, bundle)
+    return corrections
+
+def diffract_with_rescattering(aod, wavevecs_in_unit, wavevecs_in_mag, local_acoustics, order, ref_inds):
+    """The forward diffraction followed by the rescattering of the diffracted
+    light back into the incident polarisation, in one sweep. The acoustic
+    properties are gathered once, and the refractive indices of the diffracted
+    wavevectors are shared between the two passes. Returns (efficiencies,
+    wavevecs_out_unit, wavevecs_out_mag, rescattering_terms), with the
+    efficiencies already reduced by rescattering."""
+    (efficiencies, wavevecs_out_unit, wavevecs_out_mag, efficiencies_r, _, _) = \
+        diffract_both_passes(aod, wavevecs_in_unit, wavevecs_in_mag, local_acoustics, order, ref_inds)
+    rescattering_terms = rescattering_fraction * efficiencies_r
+    efficiencies *= 1 - rescattering_terms
+
+    return (efficiencies, wavevecs_out_unit, wavevecs_out_mag, rescattering_terms)
 
-    (efficiencies, wavevecs_out_unit, wavevecs_out_mag) = \
-        get_diffracted_wavevectors_and_efficiency(aod, wavevecs_in_unit, wavevecs_in_mag, local_acoustics, order, ref_inds)
+def diffract_both_passes(aod, wavevecs_in_unit, wavevecs_in_mag, local_acoustics, order, ref_inds):
+    """The uncorrected efficiencies and wavevectors of the forward pass and of
+    the rescattering pass, as (efficiencies, wavevecs_out_unit, wavevecs_out_mag,
+    efficiencies_r, wavevecs_rescattered_unit, wavevecs_rescattered_mag)."""
+    acoustic_properties = get_acoustic_properties(aod, local_acoustics)
+    ref_inds_in = ref_ind_ext_ord(aod, wavevecs_in_unit, wavevecs_in_mag)
+
+    (efficiencies, wavevecs_out_unit, wavevecs_out_mag, ref_inds_out) = \
+        diffract_and_get_efficiency(aod, wavevecs_in_unit, wavevecs_in_mag, ref_inds_in, acoustic_properties, order, ref_inds)
 
     # rescattering
     rev_ref_inds = ref_inds[::-1]
-    (efficiencies_r,_,_) = get_diffracted_wavevectors_and_efficiency(aod, wavevecs_out_unit, wavevecs_out_mag, local_acoustics, order, rev_ref_inds)
-    rescattering_terms = 0.5 * efficiencies_r # 0.5 inferred from single AOD experiment, may depend on AOD design and optical wavelength
-    efficiencies *= 1 - rescattering_terms
+    (efficiencies_r, wavevecs_r_unit, wavevecs_r_mag, _) = \
+        diffract_and_get_efficiency(aod, wavevecs_out_unit, wavevecs_out_mag, ref_inds_out, acoustic_properties, order, rev_ref_inds)
 
-    for r, m, u, e, resc in zip(rays, wavevecs_out_mag, wavevecs_out_unit, efficiencies, rescattering_terms):
-        r.wavevector_vac_mag = m
-        r.wavevector_unit = u
-        r.energy *= e
-        r.resc = resc * e
+    return (efficiencies, wavevecs_out_unit, wavevecs_out_mag, efficiencies_r, wavevecs_r_unit, wavevecs_r_mag)
 
 def get_diffracted_wavevectors_and_efficiency(aod, wavevecs_in_unit, wavevecs_in_mag, local_acoustics, order, ref_inds):
     """The basic Xu and Stroud theory is implemented in this function."""
-    (wavevector_mismatches_mag, wavevecs_out_unit, wavevecs_out_mag) = diffract_by_wavevector_triangle(aod, wavevecs_in_unit, wavevecs_in_mag, local_acoustics, order, ref_inds)
-    efficiencies = get_efficiency(aod, wavevector_mismatches_mag, wavevecs_in_mag, wavevecs_in_unit, wavevecs_out_mag, wavevecs_out_unit, local_acoustics, ref_inds)
-    return (efficiencies, wavevecs_out_unit, wavevecs_out_mag)
+    ref_inds_in = ref_ind_ext_ord(aod, wavevecs_in_unit, wavevecs_in_mag)
+    return diffract_and_get_efficiency(aod, wavevecs_in_unit, wavevecs_in_mag, ref_inds_in, \
+        get_acoustic_properties(aod, local_acoustics), order, ref_inds)[0:3]
+
+def diffract_and_get_efficiency(aod, wavevecs_in_unit, wavevecs_in_mag, ref_inds_in, acoustic_properties, order, ref_inds):
+    """As get_diffracted_wavevectors_and_efficiency, from the (n_e, n_o) of the
+    incident wavevectors and the acoustic properties. Also returns the
+    (n_e, n_o) of the diffracted wavevectors."""
+    n_in = ref_inds_in[ref_inds[0]]
+    (wavevector_mismatches_mag, wavevecs_out_unit, wavevecs_out_mag, converged) = \
+        solve_wavevector_triangle(aod, wavevecs_in_unit, wavevecs_in_mag, n_in, acoustic_properties, order, ref_inds)
+    ref_inds_out = ref_ind_ext_ord(aod, wavevecs_out_unit, wavevecs_out_mag)
+    efficiencies = calc_efficiency(aod, wavevector_mismatches_mag, wavevecs_in_mag, wavevecs_in_unit, \
+        wavevecs_out_mag, wavevecs_out_unit, acoustic_properties[2], n_in, ref_inds_out[ref_inds[1]])
+    efficiencies[~converged] = 0 # dead rays, pruned by energy
+    return (efficiencies, wavevecs_out_unit, wavevecs_out_mag, ref_inds_out)
+
+def get_acoustic_properties(aod, local_acoustics):
+    """The (frequencies, wavevector magnitudes, amplitudes) of the local
+    acoustics as arrays, from an AcousticField or a list of Acoustics objects.
+    The amplitudes include the transducer efficiency."""
+    return as_acoustic_field(local_acoustics).get_properties(aod)
 
 def diffract_by_wavevector_triangle(aod, wavevec_unit_in, wavevec_vac_mag_in, local_acoustics, order, ref_inds):
     """Wavevector matching between the incident optic, acoustic and diffracted
     optic is dealt with here. The diffracted wavevector including its direction
     is calculated here. """
-    wavevectors_vac_mag_out = wavevec_vac_mag_in + (2 * pi / c) * array([a.frequency for a in local_acoustics]) # from w_out = w_in + w_ac
-    resultants = get_resultant_wavevectors(aod, wavevec_unit_in, wavevec_vac_mag_in, local_acoustics, order, ref_inds)
-
-    f = lambda k: ref_ind_ext_ord(aod, normalise_list(k), wavevec_vac_mag_in)[ref_inds[1]] # pass this function to be used recursively
-    return triangle_solve(resultants, wavevectors_vac_mag_out, aod.normal, f)
-
-def get_resultant_wavevectors(aod, wavevec_unit_in, wavevec_vac_mag_in, local_acoustics, order, ref_inds):
-    """Calculate the sum of the incident optic and acoustic wavevectors."""
     n_in = ref_ind_ext_ord(aod, wavevec_unit_in, wavevec_vac_mag_in)[ref_inds[0]]
+    return solve_wavevector_triangle(aod, wavevec_unit_in, wavevec_vac_mag_in, n_in, get_acoustic_properties(aod, local_acoustics), order, ref_inds)[0:3]
+
+def solve_wavevector_triangle(aod, wavevec_unit_in, wavevec_vac_mag_in, n_in, acoustic_properties, order, ref_inds):
+    """The diffracted wavevectors and the mismatches, as triangle_solve. Rays that do not
+    converge raise under the 'strict' validation policy, otherwise they are returned
+    as not converged, to be given zero efficiency, see check_all_converged."""
+    (frequencies, acoustic_wavevector_mags, _) = acoustic_properties
+    wavevectors_vac_mag_out = wavevec_vac_mag_in + (2 * pi / c) * frequencies # from w_out = w_in + w_ac
+    resultants = get_resultant_wavevectors(aod, wavevec_unit_in, wavevec_vac_mag_in, n_in, acoustic_wavevector_mags, order)
+
+    wavevec_vac_mag_in = array(wavevec_vac_mag_in)
+    f = lambda k, ray_indices: ref_ind_ext_ord(aod, normalise_list(k), wavevec_vac_mag_in[ray_indices])[ref_inds[1]]
+    (wavevector_mismatches_mag, wavevectors_out_unit, wavevectors_vac_mag_out, converged) = \
+        triangle_solve(resultants, wavevectors_vac_mag_out, aod.normal, f)
+    check_all_converged(converged, "wavevector triangle did not converge")
+    return (wavevector_mismatches_mag, wavevectors_out_unit, wavevectors_vac_mag_out, converged)
+
+def get_resultant_wavevectors(aod, wavevec_unit_in, wavevec_vac_mag_in, n_in, acoustic_wavevector_mags, order):
+    """Calculate the sum of the incident optic and acoustic wavevectors."""
     wavevectors_in = (n_in * wavevec_vac_mag_in * array(wavevec_unit_in).T).T
-    wavevectors_ac = outer(array([a.wavevector_mag for a in local_acoustics]), aod.acoustic_direction)
+    wavevectors_ac = outer(acoustic_wavevector_mags, aod.acoustic_direction)
     return wavevectors_in + order * wavevectors_ac
 
 def get_efficiency(aod, wavevector_mismatches_mag, wavevecs_in_mag, wavevecs_in_unit, wavevecs_out_mag, wavevecs_out_unit, acoustics, ref_inds):
     """Based on the calculated diffracted wavevector, the diffraction efficiency can be calculated."""
-    amp = [a.amplitude(aod) for a in acoustics] * sqrt(aod.transducer_efficiency_func([a.frequency for a in acoustics])) # square root because transducer eff is in terms of power
-
+    amp = get_acoustic_properties(aod, acoustics)[2]
     n_in = ref_ind_ext_ord(aod, wavevecs_in_unit, wavevecs_in_mag)[ref_inds[0]]
     n_out = ref_ind_ext_ord(aod, wavevecs_out_unit, wavevecs_out_mag)[ref_inds[1]]
+    return calc_efficiency(aod, wavevector_mismatches_mag, wavevecs_in_mag, wavevecs_in_unit, wavevecs_out_mag, wavevecs_out_unit, amp, n_in, n_out)
+
+def calc_efficiency(aod, wavevector_mismatches_mag, wavevecs_in_mag, wavevecs_in_unit, wavevecs_out_mag, wavevecs_out_unit, amp, n_in, n_out):
     p = -0.12  # for P66' (see appendix p583)
 
     delta_n0 = -0.5 * power(n_in, 2.) * n_out * p * amp # Xu & St (2.128)
@@ -79,33 +162,58 @@ def get_efficiency(aod, wavevector_mismatches_mag, wavevecs_in_mag, wavevecs_in_
     return v0*v1/4 * power((sin(sigma) / sigma), 2.) # Xu&St (2.134)
 
 def ref_ind_ext_ord(aod, unit_vector, wavevector_vac):
-    return aod.calc_refractive_indices_vectors(unit_vector, 2*pi/wavevector_vac[0])
-
-def triangle_solve(sum_vector, base_length, normal, multiplier_func):
-
-    def tail_rec_solve(sv):
-        multiplier = multiplier_func(sv) # ord ref ind
-        ratio = base_length * multiplier / norm(sv, axis=1) # desired_wavelength_in_crystal / current_wavelength
-        if all(abs(ratio - 1) < 1e-6):
-            return sv
-        new_sum_vector = sv - outer(dot(sv, normal) * (1 - ratio), normal) # improve approx
-        return tail_rec_solve(new_sum_vector)
+    return aod.calc_refractive_indices_vectors(unit_vector, 2*pi/array(wavevector_vac)) # one wavelength per ray
+
+def triangle_solve(sum_vector, base_length, normal, multiplier_func, tolerance=None, max_iterations=None):
+    """Find the diffracted wavevectors: each sum_vector moved along the normal
+    until its length is base_length * multiplier_func(vector, ray_indices).
+    Solved by a secant iteration on the component along the normal, starting
+    from a fixed point step. Converged rays are dropped from the working set,
+    so multiplier_func is called only with the rays still being solved.
+    Also returns a mask of the rays converged to tolerance within max_iterations."""
+    tolerance = triangle_tolerance if tolerance is None else tolerance
+    max_iterations = triangle_max_iterations if max_iterations is None else max_iterations
+    num_rays = sum_vector.shape[0]
+    base_length = array(base_length, dtype=dtype(float)) + zeros(num_rays)
 
     wavevec_out = precondition(sum_vector, base_length, normal, multiplier_func)
-
-    wavevec_out = tail_rec_solve(wavevec_out)
+    axial = dot(wavevec_out, normal)
+    transverse = wavevec_out - outer(axial, normal)
+
+    converged_rays = zeros(num_rays, dtype=dtype(bool))
+    previous_axial = zeros(num_rays) + nan
+    previous_error = zeros(num_rays) + nan
+    active = arange(num_rays)
+    for k in range(max_iterations + 1):
+        sv = transverse[active] + outer(axial[active], normal)
+        ratio = base_length[active] * multiplier_func(sv, active) / norm(sv, axis=1) # desired_wavelength_in_crystal / current_wavelength
+        error = ratio - 1
+        converged = abs(error) < tolerance
+        converged_rays[active[converged]] = True
+        (active, ratio, error) = (active[~converged], ratio[~converged], error[~converged])
+        if active.size == 0 or k == max_iterations:
+            break
+
+        z = axial[active]
+        (z_prev, error_prev) = (previous_axial[active], previous_error[active])
+        use_secant = isfinite(z_prev) & (error != error_prev)
+        secant_step = error * (z - z_prev) / where(use_secant, error - error_prev, 1)
+        (previous_axial[active], previous_error[active]) = (z, error)
+        axial[active] = where(use_secant, z - secant_step, z * ratio) # fixed point step scales the axial component
+
+    wavevec_out = transverse + outer(axial, normal)
     wavevectors_out_unit = normalise_list(wavevec_out)
 
     wavevector_mismatches_mag = dot(wavevec_out - sum_vector, normal)
 
-    return (wavevector_mismatches_mag, wavevectors_out_unit, base_length)
+    return (wavevector_mismatches_mag, wavevectors_out_unit, base_length, converged_rays)
 
 def precondition(sum_vectors, base_length, normal, multiplier_func):
     # use of xyz could be slightly misleading: z taken to be aligned with norm
     r_xy = sum_vectors - outer(dot(normal, sum_vectors.transpose()), normal)
-    multiplier = multiplier_func(sum_vectors)
+    multiplier = multiplier_func(sum_vectors, arange(sum_vectors.shape[0]))
     r_z = sqrt( (base_length * multiplier)**2 - norm(r_xy, axis=1)**2 )
     assert not any(isnan(r_z)) # has gone off the indicatrix
 
     wavevec_out = r_xy + outer(r_z, normal)
-    return wavevec_out
\ No newline at end of file
+    return wavevec_out